@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# classify_batch.py
+#
+# Offline batch classification with model.h5 (or an exported .tflite/.onnx) and class_names.json.
+#
+# Sources (streamed, never listed into memory as images):
+#   --src DIR        every image under DIR (recursive, sorted)
+#   --csv FILE       a metadata CSV: scraper metadata.csv (filename,label) or the ETL's
+#                    metadata_processed.csv (dst_path/src_path); relative paths against --root
+#   --packed DIR     dataset_packed/ from pack_shards.py (--subset; memmap if present, else tar)
+#
+# Decode + resize run in a thread pool (Pillow releases the GIL) while the model runs on
+# fixed-size batches (the last one is padded, so the graph/interpreter never reshapes).
+# Results stream to --out (.csv or .jsonl) and are flushed per batch; --resume skips the
+# keys already in --out, so an interrupted run continues where it stopped.
+#
+# Usage:
+#   python3 classify_batch.py --src nuevas_descargas --model model.h5 --out preds.csv --topk 3
+#   python3 classify_batch.py --csv ../Web_scrapping/metadata.csv --root ../Web_scrapping/dataset --out preds.jsonl --resume
+#   python3 classify_batch.py --packed dataset_packed --subset test --model export/model_int8.tflite --out test.csv
+import os
+import csv
+import json
+import time
+import tarfile
+import argparse
+from io import BytesIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+REPORT_EVERY = 10.0  # seconds between progress lines
+
+# ---------- SOURCES ----------
+# each yields (key, item): item is a path, encoded bytes or an already decoded uint8 array
+def iter_dir(src):
+    for root, dirs, files in os.walk(src):
+        dirs.sort()
+        for fname in sorted(files):
+            if fname.lower().endswith(IMAGE_EXTS):
+                path = os.path.join(root, fname)
+                yield os.path.relpath(path, src), path
+
+def iter_csv(path, root):
+    with open(path, newline='', encoding='utf-8') as f:
+        # the sample CSVs in the repo start with a comment line and a blank line
+        lines = (line for line in f if line.strip() and not line.startswith('#'))
+        reader = csv.DictReader(lines)
+        col = next((c for c in ('dst_path', 'src_path', 'filename', 'path') if c in (reader.fieldnames or [])), None)
+        if col is None:
+            raise SystemExit(f"{path}: no dst_path/src_path/filename/path column")
+        for row in reader:
+            value = row[col]
+            full = value if os.path.isabs(value) else os.path.join(root, value)
+            if not os.path.exists(full) and row.get('label'):
+                # scraper layout: <root>/<label with spaces as _>/<filename> (LabelQuota.folder)
+                full = os.path.join(root, row['label'].replace(" ", "_"), value)
+            yield value, full
+
+def iter_packed(pack_dir, subset):
+    sub = os.path.join(pack_dir, subset)
+    with open(os.path.join(sub, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('shape'):
+        images = np.memmap(os.path.join(sub, 'images.u8'), dtype=np.uint8, mode='r', shape=tuple(meta['shape']))
+        with open(os.path.join(sub, 'index.csv'), newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                yield row['src_path'], images[int(row['i'])]
+        return
+    for name in meta['shards']:
+        with tarfile.open(os.path.join(sub, name), 'r|') as tar:
+            data = None
+            for member in tar:
+                payload = tar.extractfile(member).read()
+                if not member.name.endswith('.json'):
+                    data = payload
+                elif data is not None:
+                    yield json.loads(payload)['src_path'], data
+                    data = None
+
+# ---------- DECODE ----------
+def load_item(item, size):
+    """uint8 size x size x 3, resized like training (nearest); JPEGs are decoded at reduced scale."""
+    if isinstance(item, np.ndarray) and item.shape == (size, size, 3):
+        return np.asarray(item)
+    if isinstance(item, np.ndarray):
+        im = Image.fromarray(np.asarray(item))
+    else:
+        im = Image.open(BytesIO(item) if isinstance(item, bytes) else item)
+        im.draft('RGB', (size, size))
+    return np.asarray(im.convert('RGB').resize((size, size), Image.NEAREST))
+
+def decode_stream(items, size, workers, ahead):
+    """Yield (key, image or None, error) in source order, keeping up to `ahead` decodes in flight."""
+    def job(key, item):
+        try:
+            return key, load_item(item, size), ''
+        except Exception as e:
+            return key, None, f"{type(e).__name__}: {e}"
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for key, item in items:
+            pending.append(pool.submit(job, key, item))
+            if len(pending) >= ahead:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+# ---------- OUTPUT ----------
+class ResultWriter:
+    """CSV (key, label_1, prob_1, ..., error) or JSONL ({"key", "top": [[label, prob], ...], "error"})."""
+    def __init__(self, path, topk, resume):
+        self.jsonl = path.endswith('.jsonl')
+        self.topk = topk
+        self.done = set()
+        exists = resume and os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            self.done = self._read_keys(path)
+        self.f = open(path, 'a' if exists else 'w', newline='', encoding='utf-8')
+        self.csv = None if self.jsonl else csv.writer(self.f)
+        if self.csv is not None and not exists:
+            header = ['key']
+            for i in range(1, topk + 1):
+                header += [f'label_{i}', f'prob_{i}']
+            self.csv.writerow(header + ['error'])
+
+    def _read_keys(self, path):
+        # an interrupted run can leave half a line: cut the file back to the last newline
+        with open(path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                f.truncate(end)
+        lines = data[:end].decode('utf-8').splitlines()
+        if self.jsonl:
+            return {json.loads(line)['key'] for line in lines if line.strip()}
+        return {row[0] for row in list(csv.reader(lines))[1:] if row}
+
+    def write(self, key, top, error=''):
+        if self.jsonl:
+            rec = {'key': key, 'top': [[label, round(prob, 6)] for label, prob in top]}
+            if error:
+                rec['error'] = error
+            self.f.write(json.dumps(rec, ensure_ascii=False) + '\n')
+        else:
+            row = [key]
+            for label, prob in top:
+                row += [label, f'{prob:.6f}']
+            row += [''] * (1 + 2 * self.topk - len(row))
+            self.csv.writerow(row + [error])
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+def load_class_names(path):
+    # generate_class_names.py writes {"0": name, ...}; pack_shards.py classes.json is a list
+    with open(path, encoding='utf-8') as f:
+        names = json.load(f)
+    if isinstance(names, dict):
+        names = [names[str(i)] for i in range(len(names))]
+    return names
+
+# ---------- MAIN ----------
+def main():
+    parser = argparse.ArgumentParser(description='batch-classify images with model.h5 + class_names.json')
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument('--src', help='directory of images (recursive)')
+    src.add_argument('--csv', help='metadata CSV (dst_path/src_path/filename column)')
+    src.add_argument('--packed', help='dataset_packed/ dir from pack_shards.py')
+    parser.add_argument('--root', default=None, help='--csv: base dir of relative paths (default: the CSV dir)')
+    parser.add_argument('--subset', default='test', help='--packed: train/val/test')
+    parser.add_argument('--model', default='model.h5', help='model.h5, or a .tflite/.onnx from train_classifier.py export')
+    parser.add_argument('--classes', default='class_names.json')
+    parser.add_argument('--out', default='predictions.csv', help='.csv or .jsonl')
+    parser.add_argument('--topk', type=int, default=3)
+    parser.add_argument('--batch', type=int, default=64, help='fixed model batch size')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help='decode threads')
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1, help='inference threads (.tflite/.onnx)')
+    parser.add_argument('--resume', action='store_true', help='skip keys already in --out and append')
+    parser.add_argument('--limit', type=int, default=0, help='stop after N images (0 = all)')
+    args = parser.parse_args()
+
+    class_names = load_class_names(args.classes)
+    args.topk = min(args.topk, len(class_names))
+
+    # tensorflow is heavy: imported only once the arguments are known to be fine
+    from train_classifier import load_runner, to_input
+    fmt = {'.tflite': 'tflite', '.onnx': 'onnx'}.get(os.path.splitext(args.model)[1].lower(), 'keras')
+    start = time.perf_counter()
+    runner = load_runner(fmt, args.model, args.threads)
+    size = runner.input_size
+    print(f"[CLASSIFY] {args.model} ({fmt}, {size}px, {len(class_names)} classes) loaded in "
+          f"{time.perf_counter() - start:.1f}s")
+
+    if args.src:
+        items = iter_dir(args.src)
+    elif args.csv:
+        items = iter_csv(args.csv, args.root or os.path.dirname(os.path.abspath(args.csv)))
+    else:
+        items = iter_packed(args.packed, args.subset)
+
+    writer = ResultWriter(args.out, args.topk, args.resume)
+    if writer.done:
+        print(f"[CLASSIFY] resuming: {len(writer.done)} already in {args.out}")
+        done = writer.done
+        items = ((key, item) for key, item in items if key not in done)
+    if args.limit:
+        items = (kv for i, kv in zip(range(args.limit), items))
+
+    count = errors = 0
+    model_time = 0.0
+    start = last = time.perf_counter()
+    buf = np.zeros((args.batch, size, size, 3), dtype=np.uint8)
+    keys = []
+
+    def run_batch():
+        nonlocal count, model_time
+        t = time.perf_counter()
+        probs = runner(to_input(buf))[:len(keys)]  # full batch every time, padding rows dropped
+        model_time += time.perf_counter() - t
+        if probs.shape[1] != len(class_names):
+            raise SystemExit(f"{args.model} predicts {probs.shape[1]} classes, {args.classes} has {len(class_names)}")
+        top = np.argsort(-probs, axis=1)[:, :args.topk]
+        for key, p, idx in zip(keys, probs, top):
+            writer.write(key, [(class_names[j], float(p[j])) for j in idx])
+        writer.flush()
+        count += len(keys)
+        keys.clear()
+
+    try:
+        for key, im, error in decode_stream(items, size, args.workers, ahead=2 * args.batch):
+            if im is None:
+                writer.write(key, [], error)
+                errors += 1
+                continue
+            buf[len(keys)] = im
+            keys.append(key)
+            if len(keys) == args.batch:
+                run_batch()
+                now = time.perf_counter()
+                if now - last >= REPORT_EVERY:
+                    print(f"[CLASSIFY] {count} images, {count / (now - start):.1f} img/s")
+                    last = now
+        if keys:
+            run_batch()
+    finally:
+        writer.close()
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f"[CLASSIFY] {count} images classified, {errors} unreadable, in {elapsed:.1f}s -> "
+          f"{count / elapsed:.1f} img/s (model {model_time:.1f}s of it)")
+    print(f"[CLASSIFY] results in {args.out}")
+
+if __name__ == '__main__':
+    main()
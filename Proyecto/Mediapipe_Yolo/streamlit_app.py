@@ -3,8 +3,7 @@ import streamlit as st
 import threading, queue, time, os
 import cv2
 import numpy as np
-from collections import OrderedDict
-from scipy.spatial import distance as dist
+from utils_tracker import CentroidTracker, calc_speed_m_s
 
 # Optional: ultralytics YOLO
 try:
@@ -14,92 +13,6 @@ except Exception:
     ULTRALYTICS_AVAILABLE = False
 
 # ----------------------------
-# Simple CentroidTracker
-# ----------------------------
-class CentroidTracker:
-    def __init__(self, max_disappeared=50, max_distance=60):
-        self.nextObjectID = 0
-        self.objects = OrderedDict()
-        self.disappeared = OrderedDict()
-        self.history = OrderedDict()
-        self.maxDisappeared = max_disappeared
-        self.maxDistance = max_distance
-
-    def register(self, centroid):
-        self.objects[self.nextObjectID] = centroid
-        self.disappeared[self.nextObjectID] = 0
-        self.history[self.nextObjectID] = [centroid]
-        self.nextObjectID += 1
-
-    def deregister(self, objectID):
-        if objectID in self.objects: del self.objects[objectID]
-        if objectID in self.disappeared: del self.disappeared[objectID]
-        if objectID in self.history: del self.history[objectID]
-
-    def update(self, rects):
-        if len(rects) == 0:
-            for objectID in list(self.disappeared.keys()):
-                self.disappeared[objectID] += 1
-                if self.disappeared[objectID] > self.maxDisappeared:
-                    self.deregister(objectID)
-            return self.objects
-
-        inputCentroids = np.zeros((len(rects), 2), dtype="int")
-        for (i, (sx, sy, ex, ey)) in enumerate(rects):
-            cX = int((sx + ex) / 2.0)
-            cY = int((sy + ey) / 2.0)
-            inputCentroids[i] = (cX, cY)
-
-        if len(self.objects) == 0:
-            for i in range(len(inputCentroids)):
-                self.register(tuple(inputCentroids[i]))
-        else:
-            objectIDs = list(self.objects.keys())
-            objectCentroids = list(self.objects.values())
-            if len(objectCentroids) == 0:
-                for i in range(len(inputCentroids)):
-                    self.register(tuple(inputCentroids[i]))
-                return self.objects
-            D = dist.cdist(np.array(objectCentroids), inputCentroids)
-            rows = D.min(axis=1).argsort()
-            cols = D.argmin(axis=1)[rows]
-            usedRows, usedCols = set(), set()
-            for (row, col) in zip(rows, cols):
-                if row in usedRows or col in usedCols:
-                    continue
-                if D[row, col] > self.maxDistance:
-                    continue
-                objectID = objectIDs[row]
-                self.objects[objectID] = tuple(inputCentroids[col])
-                self.disappeared[objectID] = 0
-                self.history[objectID].append(tuple(inputCentroids[col]))
-                if len(self.history[objectID]) > 30:
-                    self.history[objectID].pop(0)
-                usedRows.add(row)
-                usedCols.add(col)
-            unusedRows = set(range(0, D.shape[0])).difference(usedRows)
-            unusedCols = set(range(0, D.shape[1])).difference(usedCols)
-            if D.shape[0] >= D.shape[1]:
-                for row in unusedRows:
-                    objectID = objectIDs[row]
-                    self.disappeared[objectID] += 1
-                    if self.disappeared[objectID] > self.maxDisappeared:
-                        self.deregister(objectID)
-            else:
-                for col in unusedCols:
-                    self.register(tuple(inputCentroids[col]))
-        return self.objects
-
-def calc_speed_m_s(history, pixels_to_m=0.005, window_seconds=0.5):
-    if len(history) < 2:
-        return 0.0
-    ptA = history[-1]
-    ptB = history[0]
-    d_pixels = np.linalg.norm(np.array(ptA) - np.array(ptB))
-    d_meters = d_pixels * pixels_to_m
-    speed = d_meters / window_seconds
-    return speed
-# ----------------------------
 # Shared video capture thread
 # ----------------------------
 class VideoCaptureThread(threading.Thread):
@@ -146,7 +59,7 @@ class PersonProcessor(threading.Thread):
         self.stop_event = stop_event
         self.pixels_to_m = pixels_to_m
         self.detector = person_detector
-        self.ct = CentroidTracker(max_disappeared=20, max_distance=80)
+        self.ct = CentroidTracker(max_disappeared=20, max_distance=80, max_history=30)
 
     def detect_persons(self, frame):
         rects = []
@@ -0,0 +1,38 @@
+# test_utils_tracker.py
+#
+# CentroidTracker (vectorizado) contra LoopCentroidTracker (el bucle original) en
+# secuencias con semilla: mismos ids, centroides e historiales en cada frame (pytest).
+import numpy as np
+import pytest
+from utils_tracker import CentroidTracker, LoopCentroidTracker, simulate
+
+def frames_with_gaps(n, count, seed):
+    frames = simulate(n, count, seed=seed, size=60 * max(n, 5) ** 0.5)
+    # frames vacíos (nadie detectado) y frames con la mitad de las detecciones
+    for i in range(7, count, 23):
+        frames[i] = np.empty((0, 4))
+    for i in range(3, count, 17):
+        frames[i] = frames[i][::2]
+    return frames
+
+@pytest.mark.parametrize("n", [1, 5, 50, 300])
+def test_greedy_ids_match_the_loop_tracker(n):
+    kw = dict(max_disappeared=5, max_distance=30, max_history=10)
+    fast = CentroidTracker(**kw)
+    loop = LoopCentroidTracker(**kw)
+    for t, rects in enumerate(frames_with_gaps(n, 200, seed=n)):
+        objects = fast.update(rects)
+        expected = loop.update(rects)
+        assert list(objects) == list(expected), f"frame {t}"
+        for oid, c in expected.items():
+            assert objects[oid] == tuple(int(v) for v in c), f"frame {t}, id {oid}"
+            assert fast.history[oid].tolist() == np.asarray(loop.history[oid]).tolist(), f"frame {t}, id {oid}"
+    assert fast.nextObjectID == loop.nextObjectID
+
+def test_age_and_register_does_both():
+    ct = CentroidTracker(max_disappeared=0, max_distance=10, age_and_register=True)
+    ct.update([(0, 0, 10, 10), (100, 100, 110, 110)])
+    # 2 tracks, 2 detecciones: una se empareja, el track sin detección se borra y la
+    # detección sin track se registra (el bucle original solo habría envejecido el track)
+    objects = ct.update([(1, 1, 11, 11), (300, 300, 310, 310)])
+    assert dict(objects) == {0: (6, 6), 2: (305, 305)}
@@ -1,64 +1,757 @@
 # train_classifier.py
 import os
+import sys
+import csv
+import json
+import hashlib
+import math
+import time
 import argparse
+import numpy as np
 import tensorflow as tf
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras import layers, models
 from tensorflow.keras.applications import MobileNetV2
-from tensorflow.keras.callbacks import ModelCheckpoint, ReduceLROnPlateau, EarlyStopping
+from tensorflow.keras.callbacks import Callback, ModelCheckpoint, ReduceLROnPlateau, EarlyStopping
+
+# optional export backends (train_classifier.py export --formats onnx,onnx-int8)
+try:
+    import tf2onnx
+    TF2ONNX_AVAILABLE = True
+except ImportError:
+    TF2ONNX_AVAILABLE = False
+try:
+    import onnxruntime as ort
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    ORT_AVAILABLE = True
+except ImportError:
+    ORT_AVAILABLE = False
+
+# augmentation shared by both loaders (ImageDataGenerator kwargs; angles in degrees)
+AUGMENT = dict(rotation_range=15,
+               width_shift_range=0.1,
+               height_shift_range=0.1,
+               shear_range=0.1,
+               zoom_range=0.1,
+               horizontal_flip=True,
+               fill_mode='nearest')
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')  # what tf.io.decode_image reads
+SHUFFLE_BUFFER = 2048  # decoded images held for shuffling after cache()
+HEAD_LAYERS = 4  # layers after GlobalAveragePooling2D, see add_head()
+AUTOTUNE = tf.data.AUTOTUNE
+
+def add_head(x, num_classes):
+    x = layers.Dropout(0.3)(x)
+    x = layers.Dense(256, activation='relu')(x)
+    x = layers.Dropout(0.3)(x)
+    return layers.Dense(num_classes, activation='softmax')(x)
 
 def build_model(num_classes, input_shape=(224,224,3)):
     base = MobileNetV2(weights='imagenet', include_top=False, input_shape=input_shape)
     base.trainable = False
     x = layers.GlobalAveragePooling2D()(base.output)
-    x = layers.Dropout(0.3)(x)
-    x = layers.Dense(256, activation='relu')(x)
-    x = layers.Dropout(0.3)(x)
-    outputs = layers.Dense(num_classes, activation='softmax')(x)
+    outputs = add_head(x, num_classes)
     model = models.Model(inputs=base.input, outputs=outputs)
     model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
     return model
 
+def build_backbone(input_shape=(224,224,3)):
+    # the frozen part of build_model(): image -> pooled embedding
+    base = MobileNetV2(weights='imagenet', include_top=False, input_shape=input_shape)
+    base.trainable = False
+    return models.Model(inputs=base.input, outputs=layers.GlobalAveragePooling2D()(base.output))
+
+def build_head(num_classes, dim):
+    # the trainable part of build_model(), fed with cached embeddings
+    inputs = layers.Input(shape=(dim,))
+    model = models.Model(inputs=inputs, outputs=add_head(inputs, num_classes))
+    model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+    return model
+
+def load_packed(pack_dir, subset):
+    # memmap pack written by pack_shards.py / etl_pipeline.py --pack: raw uint8 N x S x S x 3 + int labels
+    with open(os.path.join(pack_dir, subset, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    if not meta.get('shape'):
+        raise SystemExit(f"{pack_dir}/{subset} has no memmap pack (pack it with --formats memmap)")
+    images = np.memmap(os.path.join(pack_dir, subset, 'images.u8'), dtype=np.uint8, mode='r',
+                       shape=tuple(meta['shape']))
+    labels = np.load(os.path.join(pack_dir, subset, 'labels.npy'))
+    return images, labels
+
+class PackedSequence(tf.keras.utils.Sequence):
+    """Batches straight from the memmap: no per-file open/decode.
+
+    Unshuffled batches are contiguous slices; shuffled ones gather a per-epoch
+    permutation (sorted inside the batch to keep reads sequential). datagen only
+    provides the random augmentation, the 1/255 rescale is applied here.
+    """
+    def __init__(self, images, labels, num_classes, batch_size, img_size, datagen=None, shuffle=False, seed=0):
+        super().__init__()
+        self.images = images
+        self.labels = labels
+        self.num_classes = num_classes
+        self.batch_size = batch_size
+        self.img_size = img_size
+        self.datagen = datagen
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.order = np.arange(len(labels))
+        self.on_epoch_end()
+
+    def __len__(self):
+        return math.ceil(len(self.labels) / self.batch_size)
+
+    def __getitem__(self, i):
+        idx = np.sort(self.order[i * self.batch_size:(i + 1) * self.batch_size])
+        if self.shuffle:
+            x = self.images[idx]
+        else:
+            x = self.images[idx[0]:idx[-1] + 1]
+        x = x.astype('float32')
+        if x.shape[1:3] != (self.img_size, self.img_size):
+            x = tf.image.resize(x, (self.img_size, self.img_size)).numpy()
+        if self.datagen is not None:
+            x = np.stack([self.datagen.random_transform(im) for im in x])
+        x *= 1. / 255
+        return x, tf.keras.utils.to_categorical(self.labels[idx], self.num_classes)
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.rng.shuffle(self.order)
+
+def list_images(split_dir, class_names=None):
+    # same classes and order as flow_from_directory: sorted subdirectories, sorted files
+    if class_names is None:
+        class_names = sorted(d for d in os.listdir(split_dir) if os.path.isdir(os.path.join(split_dir, d)))
+    paths, labels = [], []
+    for i, name in enumerate(class_names):
+        class_dir = os.path.join(split_dir, name)
+        if not os.path.isdir(class_dir):
+            continue
+        for fname in sorted(os.listdir(class_dir)):
+            if fname.lower().endswith(IMAGE_EXTS):
+                paths.append(os.path.join(class_dir, fname))
+                labels.append(i)
+    return class_names, paths, labels
+
+def random_affine(x, aug=AUGMENT):
+    """Batch version of ImageDataGenerator.random_transform: one projective transform op per batch.
+
+    Per image: rotation, shift, shear, zoom (same ranges and composition as Keras, about
+    the image center), bilinear sampling with nearest fill, then a random horizontal flip.
+    """
+    b = tf.shape(x)[0]
+    h = tf.cast(tf.shape(x)[1], tf.float32)
+    w = tf.cast(tf.shape(x)[2], tf.float32)
+    zeros, ones = tf.zeros([b]), tf.ones([b])
+
+    def uniform(r):
+        return tf.random.uniform([b], -r, r)
+
+    def mat(*rows):
+        return tf.reshape(tf.stack(rows, axis=1), [-1, 3, 3])
+
+    theta = uniform(aug['rotation_range']) * (math.pi / 180)
+    tx = uniform(aug['width_shift_range']) * w
+    ty = uniform(aug['height_shift_range']) * h
+    shear = uniform(aug['shear_range']) * (math.pi / 180)
+    zx = 1 + uniform(aug['zoom_range'])
+    zy = 1 + uniform(aug['zoom_range'])
+    cx, cy = (w - 1) / 2 * ones, (h - 1) / 2 * ones
+
+    rotation = mat(tf.cos(theta), -tf.sin(theta), zeros, tf.sin(theta), tf.cos(theta), zeros, zeros, zeros, ones)
+    shift = mat(ones, zeros, tx, zeros, ones, ty, zeros, zeros, ones)
+    shearing = mat(ones, -tf.sin(shear), zeros, zeros, tf.cos(shear), zeros, zeros, zeros, ones)
+    zoom = mat(zx, zeros, zeros, zeros, zy, zeros, zeros, zeros, ones)
+    center = mat(ones, zeros, cx, zeros, ones, cy, zeros, zeros, ones)
+    uncenter = mat(ones, zeros, -cx, zeros, ones, -cy, zeros, zeros, ones)
+    # maps output pixel -> input pixel, as ImageProjectiveTransform expects
+    m = center @ rotation @ shift @ shearing @ zoom @ uncenter
+    x = tf.raw_ops.ImageProjectiveTransformV3(images=x, transforms=tf.reshape(m, [-1, 9])[:, :8],
+                                              output_shape=tf.shape(x)[1:3], fill_value=0.,
+                                              interpolation='BILINEAR', fill_mode=aug['fill_mode'].upper())
+    if aug['horizontal_flip']:
+        flip = tf.random.uniform([b]) < 0.5
+        x = tf.where(flip[:, None, None, None], tf.reverse(x, axis=[2]), x)
+    return x
+
+def prepare(x, img_size, augment):
+    x = tf.cast(x, tf.float32)
+    if x.shape[1] != img_size or x.shape[2] != img_size:
+        x = tf.image.resize(x, (img_size, img_size))
+    if augment:
+        x = random_affine(x)
+    return x * (1. / 255)
+
+def finish_batch(x, y, num_classes, img_size, augment):
+    return prepare(x, img_size, augment), tf.one_hot(y, num_classes)
+
+def load_image(path, img_size):
+    im = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    im = tf.image.resize(im, (img_size, img_size), method='nearest')  # flow_from_directory default
+    return tf.cast(im, tf.uint8)
+
+def directory_dataset(paths, labels, num_classes, batch_size, img_size, training, cache=None, seed=0):
+    """tf.data pipeline over image files: parallel decode, optional cache, batch-level augmentation, prefetch.
+
+    cache: None, 'ram' or a file prefix for tf.data's on-disk cache. The cache holds the
+    decoded, resized images, so augmentation still changes every epoch.
+    """
+    ds = tf.data.Dataset.from_tensor_slices((paths, tf.constant(labels, tf.int32)))
+    if training and not cache:
+        ds = ds.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)  # paths are cheap to shuffle
+    ds = ds.map(lambda path, label: (load_image(path, img_size), label), num_parallel_calls=AUTOTUNE)
+    if cache:
+        if cache != 'ram':
+            os.makedirs(os.path.dirname(os.path.abspath(cache)), exist_ok=True)
+        ds = ds.cache('' if cache == 'ram' else cache)
+        if training:
+            ds = ds.shuffle(min(len(paths), SHUFFLE_BUFFER), seed=seed, reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size)
+    ds = ds.map(lambda x, y: finish_batch(x, y, num_classes, img_size, training), num_parallel_calls=AUTOTUNE)
+    return ds.prefetch(AUTOTUNE)
+
+def packed_dataset(images, labels, num_classes, batch_size, img_size, training, seed=0):
+    """tf.data pipeline over a memmap pack: batches of indices gathered from the memmap."""
+    shape = images.shape[1:]
+
+    def gather(idx):
+        idx = np.sort(idx)  # sequential reads inside the batch
+        return images[idx], labels[idx].astype(np.int32)
+
+    def load(idx):
+        x, y = tf.numpy_function(gather, [idx], (tf.uint8, tf.int32))
+        x.set_shape((None,) + shape)
+        y.set_shape((None,))
+        return x, y
+
+    ds = tf.data.Dataset.range(len(labels))
+    if training:
+        ds = ds.shuffle(len(labels), seed=seed, reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size).map(load, num_parallel_calls=AUTOTUNE)
+    ds = ds.map(lambda x, y: finish_batch(x, y, num_classes, img_size, training), num_parallel_calls=AUTOTUNE)
+    return ds.prefetch(AUTOTUNE)
+
+class FeatureCache:
+    """Backbone embeddings on disk, keyed by image sha256.
+
+    cache_dir/features.f32 is a raw float32 rows x views x dim array (np.memmap), row r
+    belongs to the r-th sha256 in keys.csv and view 0 is the un-augmented image.
+    meta.json holds the row count and what the rows were computed with; a different
+    views/dim/img_size starts the cache over. Rows are only appended, one batch at a
+    time, so an interrupted run keeps what it embedded.
+    """
+    def __init__(self, cache_dir, views, dim, img_size):
+        self.dir = cache_dir
+        self.config = {'backbone': 'MobileNetV2/imagenet', 'views': views, 'dim': dim, 'img_size': img_size}
+        self.views = views
+        self.dim = dim
+        self.keys = {}
+        os.makedirs(cache_dir, exist_ok=True)
+        meta = {}
+        if os.path.exists(self._path('meta.json')):
+            with open(self._path('meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+        if meta.get('config') == self.config:
+            with open(self._path('keys.csv'), newline='', encoding='utf-8') as f:
+                for row, (sha,) in enumerate(csv.reader(f)):
+                    if row >= meta['rows']:
+                        break
+                    self.keys[sha] = row
+        elif meta:
+            print(f"[FEATURES] {cache_dir} was built with {meta.get('config')}, rebuilding")
+        # drop rows written after the last meta.json update (interrupted run)
+        with open(self._path('features.f32'), 'ab') as f:
+            f.truncate(len(self.keys) * self.views * self.dim * 4)
+        with open(self._path('keys.csv'), 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows([sha] for sha in self.keys)
+        self._write_meta()
+
+    def _path(self, name):
+        return os.path.join(self.dir, name)
+
+    def _write_meta(self):
+        tmp = self._path('meta.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'rows': len(self.keys), 'config': self.config}, f, indent=2)
+        os.replace(tmp, self._path('meta.json'))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def append(self, shas, feats):
+        feats = np.ascontiguousarray(feats, dtype=np.float32).reshape(len(shas), self.views, self.dim)
+        with open(self._path('features.f32'), 'ab') as f:
+            f.write(feats.tobytes())
+        with open(self._path('keys.csv'), 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows([sha] for sha in shas)
+        for sha in shas:
+            self.keys[sha] = len(self.keys)
+        self._write_meta()
+
+    def lookup(self, shas):
+        return np.array([self.keys[sha] for sha in shas], dtype=np.int64)
+
+    def open(self):
+        return np.memmap(self._path('features.f32'), dtype=np.float32, mode='r',
+                         shape=(len(self.keys), self.views, self.dim))
+
+class FeatureSequence(tf.keras.utils.Sequence):
+    """Batches of cached embeddings; while training each epoch draws a random view per image."""
+    def __init__(self, features, rows, labels, num_classes, batch_size, shuffle=False, seed=0):
+        super().__init__()
+        self.features = features
+        self.rows = rows
+        self.labels = labels
+        self.num_classes = num_classes
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.order = np.arange(len(rows))
+        self.view = np.zeros(len(rows), dtype=np.int64)
+        self.on_epoch_end()
+
+    def __len__(self):
+        return math.ceil(len(self.rows) / self.batch_size)
+
+    def __getitem__(self, i):
+        idx = self.order[i * self.batch_size:(i + 1) * self.batch_size]
+        x = self.features[self.rows[idx], self.view[idx]]
+        return x, tf.keras.utils.to_categorical(self.labels[idx], self.num_classes)
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.rng.shuffle(self.order)
+            self.view = self.rng.integers(0, self.features.shape[1], len(self.rows))
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def split_source(args, subset, class_names):
+    """(sha256 per image, labels, batches(indices) -> uint8 image batches) for one subset."""
+    if args.packed:
+        images, labels = load_packed(args.packed, subset)
+        with open(os.path.join(args.packed, subset, 'index.csv'), newline='', encoding='utf-8') as f:
+            shas = [row['sha256'] for row in csv.DictReader(f)]
+
+        def batches(indices):
+            for i in range(0, len(indices), args.batch):
+                yield images[indices[i:i + args.batch]]
+    else:
+        _, paths, labels = list_images(os.path.join(args.data_dir, subset), class_names)
+        labels = np.array(labels, dtype=np.int32)
+        shas = [file_sha256(p) for p in paths]
+
+        def batches(indices):
+            ds = tf.data.Dataset.from_tensor_slices([paths[i] for i in indices])
+            ds = ds.map(lambda path: load_image(path, args.img_size), num_parallel_calls=AUTOTUNE)
+            return ds.batch(args.batch).prefetch(AUTOTUNE)
+    return shas, labels, batches
+
+def embed_missing(cache, backbone, sources, args):
+    # only images whose sha256 is not cached yet go through the backbone, once per view
+    count = 0
+    for shas, _, batches in sources:
+        todo, seen = [], set()
+        for i, sha in enumerate(shas):
+            if sha not in cache.keys and sha not in seen:
+                seen.add(sha)
+                todo.append(i)
+        if not todo:
+            continue
+        done = 0
+        for x in batches(np.array(todo, dtype=np.int64)):
+            x = tf.convert_to_tensor(x)
+            feats = np.stack([backbone(prepare(x, args.img_size, augment=v > 0), training=False).numpy()
+                              for v in range(args.views)], axis=1)
+            cache.append([shas[i] for i in todo[done:done + len(feats)]], feats)
+            done += len(feats)
+        count += done
+    return count
+
+def train_cached(args):
+    """--cache_features: embed with the frozen backbone once, then train only the head on the vectors."""
+    if args.packed:
+        with open(os.path.join(args.packed, 'classes.json'), encoding='utf-8') as f:
+            class_names = json.load(f)
+    else:
+        class_names = list_images(os.path.join(args.data_dir, 'train'))[0]
+    num_classes = len(class_names)
+    train = split_source(args, 'train', class_names)
+    val = split_source(args, 'val', class_names)
+    if not train[0]:
+        raise SystemExit("no training images")
+
+    input_shape = (args.img_size, args.img_size, 3)
+    backbone = build_backbone(input_shape)
+    dim = backbone.output_shape[-1]
+    cache = FeatureCache(args.cache_features, args.views, dim, args.img_size)
+    start = time.perf_counter()
+    new = embed_missing(cache, backbone, [train, val], args)
+    print(f"[FEATURES] {new} new images x {args.views} views embedded in {time.perf_counter() - start:.1f}s, "
+          f"{len(cache) - new} reused from {args.cache_features}")
+
+    features = cache.open()
+    train_flow = FeatureSequence(features, cache.lookup(train[0]), np.asarray(train[1]), num_classes, args.batch,
+                                 shuffle=True)
+    val_data = None
+    if val[0]:
+        val_data = (np.asarray(features[cache.lookup(val[0]), 0]),
+                    tf.keras.utils.to_categorical(np.asarray(val[1]), num_classes))
+    print("Classes:", {name: i for i, name in enumerate(class_names)})
+
+    head = build_head(num_classes, dim)
+    monitor = 'val_loss' if val_data is not None else 'loss'
+    callbacks = [
+        ReduceLROnPlateau(monitor=monitor, factor=0.5, patience=3),
+        EarlyStopping(monitor=monitor, patience=6, restore_best_weights=True),
+        StepRate('features', args.batch)
+    ]
+    head.fit(train_flow, validation_data=val_data, epochs=args.epochs, callbacks=callbacks)
+
+    # same architecture as a normal run: backbone + the trained head weights
+    model = build_model(num_classes, input_shape=input_shape)
+    for dst, src in zip(model.layers[-HEAD_LAYERS:], head.layers[-HEAD_LAYERS:]):
+        dst.set_weights(src.get_weights())
+    model.save(args.out)
+    print("Model saved to", args.out)
+
+class StepRate(Callback):
+    """Logs training steps/s per epoch (validation excluded) to compare loaders."""
+    def __init__(self, name, batch_size):
+        super().__init__()
+        self.name = name
+        self.batch_size = batch_size
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.steps = 0
+        self.start = self.last = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.steps += 1
+        self.last = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = max(self.last - self.start, 1e-9)
+        print(f"[LOADER] {self.name} epoch {epoch + 1}: {self.steps} steps in {elapsed:.1f}s -> "
+              f"{self.steps / elapsed:.2f} steps/s ({self.steps * self.batch_size / elapsed:.1f} img/s)")
+
+def bench_loader(flow, steps, name, batch_size):
+    # input pipeline only, no model: the ceiling the loader puts on training speed
+    if isinstance(flow, tf.data.Dataset):
+        it = iter(flow.repeat())
+        batches = (next(it) for _ in range(steps + 1))
+    else:
+        batches = (flow[i % len(flow)] for i in range(steps + 1))
+    next(batches)  # warm-up: worker start, first file opens
+    start = time.perf_counter()
+    for _ in batches:
+        pass
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f"[LOADER] {name} (no model): {steps} steps in {elapsed:.1f}s -> "
+          f"{steps / elapsed:.2f} steps/s ({steps * batch_size / elapsed:.1f} img/s)")
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--data_dir', default='dataset_split', help='dataset split dir with train/val/test')
+    parser.add_argument('--packed', default=None,
+                        help='train from a memmap pack (dataset_packed/ from pack_shards.py) instead of --data_dir')
     parser.add_argument('--img_size', type=int, default=224)
     parser.add_argument('--batch', type=int, default=32)
     parser.add_argument('--epochs', type=int, default=15)
     parser.add_argument('--out', default='model.h5')
+    parser.add_argument('--loader', choices=['keras', 'tf.data'], default='keras',
+                        help='keras: ImageDataGenerator/Sequence; tf.data: parallel decode + batched augmentation')
+    parser.add_argument('--cache', default=None,
+                        help="tf.data only: cache decoded images in 'ram' or in a file prefix on disk")
+    parser.add_argument('--bench_loader', type=int, default=0,
+                        help='only time N training batches from the loader (no model) and exit')
+    parser.add_argument('--cache_features', default=None,
+                        help='embedding cache dir: embed new images once with the frozen backbone, train only the head')
+    parser.add_argument('--views', type=int, default=4,
+                        help='--cache_features: embeddings per image (view 0 plain, the rest augmented)')
     args = parser.parse_args()
 
+    if args.cache_features:
+        train_cached(args)
+        return
+
     train_dir = os.path.join(args.data_dir, 'train')
     val_dir = os.path.join(args.data_dir, 'val')
 
-    train_gen = ImageDataGenerator(rescale=1./255,
-                                   rotation_range=15,
-                                   width_shift_range=0.1,
-                                   height_shift_range=0.1,
-                                   shear_range=0.1,
-                                   zoom_range=0.1,
-                                   horizontal_flip=True,
-                                   fill_mode='nearest')
+    train_gen = ImageDataGenerator(rescale=1./255, **AUGMENT)
     val_gen = ImageDataGenerator(rescale=1./255)
 
-    train_flow = train_gen.flow_from_directory(train_dir, target_size=(args.img_size, args.img_size),
+    if args.packed:
+        with open(os.path.join(args.packed, 'classes.json'), encoding='utf-8') as f:
+            class_indices = {name: i for i, name in enumerate(json.load(f))}
+        num_classes = len(class_indices)
+        if args.loader == 'tf.data':
+            train_flow = packed_dataset(*load_packed(args.packed, 'train'), num_classes, args.batch, args.img_size,
+                                        training=True)
+            val_flow = packed_dataset(*load_packed(args.packed, 'val'), num_classes, args.batch, args.img_size,
+                                      training=False)
+        else:
+            train_flow = PackedSequence(*load_packed(args.packed, 'train'), num_classes, args.batch, args.img_size,
+                                        datagen=train_gen, shuffle=True)
+            val_flow = PackedSequence(*load_packed(args.packed, 'val'), num_classes, args.batch, args.img_size)
+    elif args.loader == 'tf.data':
+        class_names, train_paths, train_labels = list_images(train_dir)
+        _, val_paths, val_labels = list_images(val_dir, class_names)
+        class_indices = {name: i for i, name in enumerate(class_names)}
+        num_classes = len(class_indices)
+        print(f"Found {len(train_paths)} train / {len(val_paths)} val images belonging to {num_classes} classes.")
+        val_cache = args.cache if args.cache in (None, 'ram') else args.cache + '.val'
+        train_flow = directory_dataset(train_paths, train_labels, num_classes, args.batch, args.img_size,
+                                       training=True, cache=args.cache)
+        val_flow = directory_dataset(val_paths, val_labels, num_classes, args.batch, args.img_size,
+                                     training=False, cache=val_cache)
+    else:
+        train_flow = train_gen.flow_from_directory(train_dir, target_size=(args.img_size, args.img_size),
+                                                   batch_size=args.batch, class_mode='categorical')
+        val_flow = val_gen.flow_from_directory(val_dir, target_size=(args.img_size, args.img_size),
                                                batch_size=args.batch, class_mode='categorical')
-    val_flow = val_gen.flow_from_directory(val_dir, target_size=(args.img_size, args.img_size),
-                                           batch_size=args.batch, class_mode='categorical')
+        class_indices = train_flow.class_indices
+        num_classes = len(class_indices)
+
+    loader_name = args.loader + (' packed' if args.packed else '')
+    if args.bench_loader:
+        bench_loader(train_flow, args.bench_loader, loader_name, args.batch)
+        return
 
-    num_classes = len(train_flow.class_indices)
     model = build_model(num_classes, input_shape=(args.img_size, args.img_size, 3))
-    print("Classes:", train_flow.class_indices)
+    print("Classes:", class_indices)
 
     callbacks = [
         ModelCheckpoint(args.out, save_best_only=True, monitor='val_accuracy', mode='max'),
         ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=3),
-        EarlyStopping(monitor='val_loss', patience=6, restore_best_weights=True)
+        EarlyStopping(monitor='val_loss', patience=6, restore_best_weights=True),
+        StepRate(loader_name, args.batch)
     ]
 
     history = model.fit(train_flow, validation_data=val_flow, epochs=args.epochs, callbacks=callbacks)
     model.save(args.out)
     print("Model saved to", args.out)
 
+# ---------- EXPORT ----------
+# train_classifier.py export: model.h5 -> TFLite (float16, int8) and/or ONNX (float32, int8),
+# int8 calibrated on dataset_split/val, each format checked against the Keras model on
+# dataset_split/test and timed on CPU.
+EXPORT_FORMATS = ('tflite-fp16', 'tflite-int8', 'onnx', 'onnx-int8')
+EXPORT_FILES = {'tflite-fp16': 'model_fp16.tflite', 'tflite-int8': 'model_int8.tflite',
+                'onnx': 'model.onnx', 'onnx-int8': 'model_int8.onnx'}
+
+def load_split_images(split_dir, class_names, img_size, limit=0, seed=0):
+    # uint8 N x S x S x 3 in RAM (4x smaller than float); a seeded sample when limit < N
+    _, paths, labels = list_images(split_dir, class_names)
+    idx = np.arange(len(paths))
+    if limit and limit < len(paths):
+        idx = np.sort(np.random.default_rng(seed).choice(len(paths), limit, replace=False))
+    ds = tf.data.Dataset.from_tensor_slices([paths[i] for i in idx])
+    ds = ds.map(lambda path: load_image(path, img_size), num_parallel_calls=AUTOTUNE).batch(64)
+    images = np.concatenate([b.numpy() for b in ds]) if len(idx) else np.zeros((0, img_size, img_size, 3), np.uint8)
+    return images, np.array(labels, dtype=np.int32)[idx]
+
+def to_input(x):
+    # same input scaling as training: float32 in [0, 1]
+    return x.astype(np.float32) * (1. / 255)
+
+def export_tflite(model, path, quant, calib):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quant == 'fp16':
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        # full integer: uint8 input with scale 1/255 takes the raw pixels as they are
+        def representative():
+            for im in calib:
+                yield [to_input(im[None])]
+        converter.representative_dataset = representative
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8
+        converter.inference_output_type = tf.uint8
+    with open(path, 'wb') as f:
+        f.write(converter.convert())
+
+def export_onnx(model, path, img_size):
+    if not TF2ONNX_AVAILABLE:
+        raise SystemExit("onnx export needs tf2onnx (pip install tf2onnx)")
+    spec = [tf.TensorSpec((None, img_size, img_size, 3), tf.float32, name='input')]
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=13, output_path=path)
+
+def quantize_onnx(src, dst, calib):
+    if not ORT_AVAILABLE:
+        raise SystemExit("onnx-int8 needs onnxruntime (pip install onnxruntime)")
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self.name = ort.InferenceSession(src, providers=['CPUExecutionProvider']).get_inputs()[0].name
+            self.it = iter(calib)
+
+        def get_next(self):
+            im = next(self.it, None)
+            return None if im is None else {self.name: to_input(im[None])}
+
+    quantize_static(src, dst, Reader(), quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+
+class TFLiteRunner:
+    """float32 [0, 1] batch in, float32 probabilities out, whatever the model's I/O types."""
+    def __init__(self, path, threads):
+        self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=threads)
+        self.inp = self.interpreter.get_input_details()[0]
+        self.out = self.interpreter.get_output_details()[0]
+        self.batch = None
+        self.input_size = int(self.inp['shape'][1])
+
+    def __call__(self, x):
+        if x.shape[0] != self.batch:
+            self.interpreter.resize_tensor_input(self.inp['index'], list(x.shape))
+            self.interpreter.allocate_tensors()
+            self.batch = x.shape[0]
+        if self.inp['dtype'] != np.float32:
+            scale, zero = self.inp['quantization']
+            info = np.iinfo(self.inp['dtype'])
+            x = np.clip(np.round(x / scale + zero), info.min, info.max).astype(self.inp['dtype'])
+        self.interpreter.set_tensor(self.inp['index'], x)
+        self.interpreter.invoke()
+        y = self.interpreter.get_tensor(self.out['index'])
+        if self.out['dtype'] != np.float32:
+            scale, zero = self.out['quantization']
+            y = (y.astype(np.float32) - zero) * scale
+        return y
+
+def load_runner(fmt, path, threads):
+    """Callable float32 batch -> probabilities, with .input_size (the model's square input side)."""
+    if fmt == 'keras':
+        model = tf.keras.models.load_model(path, compile=False)
+
+        def runner(x):
+            return model(x, training=False).numpy()
+        runner.input_size = model.input_shape[1]
+        return runner
+    if fmt.startswith('tflite'):
+        return TFLiteRunner(path, threads)
+    if not ORT_AVAILABLE:
+        raise SystemExit("onnx models need onnxruntime (pip install onnxruntime)")
+    opts = ort.SessionOptions()
+    opts.intra_op_num_threads = threads
+    sess = ort.InferenceSession(path, sess_options=opts, providers=['CPUExecutionProvider'])
+    inp = sess.get_inputs()[0]
+
+    def runner(x):
+        return sess.run(None, {inp.name: x})[0]
+    runner.input_size = inp.shape[1]
+    return runner
+
+def predict_all(runner, images, batch):
+    return np.concatenate([runner(to_input(images[i:i + batch])) for i in range(0, len(images), batch)])
+
+def latency_ms(runner, x, runs, warmup=5):
+    for _ in range(warmup):
+        runner(x)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        runner(x)
+        times.append((time.perf_counter() - start) * 1000)
+    return np.percentile(times, 50), np.percentile(times, 99)
+
+def export_main(argv):
+    parser = argparse.ArgumentParser(prog='train_classifier.py export',
+                                     description='export model.h5 to TFLite/ONNX and benchmark CPU inference')
+    parser.add_argument('--model', default='model.h5')
+    parser.add_argument('--data_dir', default='dataset_split', help='dataset split dir with train/val/test')
+    parser.add_argument('--out_dir', default='export')
+    parser.add_argument('--formats', default='tflite-fp16,tflite-int8',
+                        help='comma list of ' + ','.join(EXPORT_FORMATS))
+    parser.add_argument('--calib_samples', type=int, default=200, help='val images used to calibrate int8')
+    parser.add_argument('--max_test', type=int, default=0, help='evaluate on at most N test images (0 = all)')
+    parser.add_argument('--max_drop', type=float, default=0.01,
+                        help='fail if test accuracy drops more than this (absolute) vs the Keras model')
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1, help='inference threads')
+    parser.add_argument('--runs', type=int, default=100, help='timed runs per latency figure')
+    parser.add_argument('--bench_batch', type=int, default=32, help='batch size of the batched latency')
+    parser.add_argument('--batch', type=int, default=32, help='batch size for the accuracy pass')
+    args = parser.parse_args(argv)
+
+    formats = [f for f in args.formats.split(',') if f]
+    unknown = sorted(set(formats) - set(EXPORT_FORMATS))
+    if unknown:
+        parser.error(f"unknown formats {unknown}, choose from {','.join(EXPORT_FORMATS)}")
+    if any(f.startswith('onnx') for f in formats) and not (TF2ONNX_AVAILABLE and ORT_AVAILABLE):
+        parser.error("onnx formats need tf2onnx and onnxruntime (pip install tf2onnx onnxruntime)")
+
+    model = tf.keras.models.load_model(args.model, compile=False)
+    img_size = model.input_shape[1]
+    train_dir = os.path.join(args.data_dir, 'train')
+    class_names = list_images(train_dir)[0] if os.path.isdir(train_dir) else None
+    calib, _ = load_split_images(os.path.join(args.data_dir, 'val'), class_names, img_size, args.calib_samples)
+    test_x, test_y = load_split_images(os.path.join(args.data_dir, 'test'), class_names, img_size, args.max_test)
+    if not len(test_x):
+        raise SystemExit(f"no test images in {args.data_dir}/test")
+    if any(f.endswith('int8') for f in formats) and not len(calib):
+        raise SystemExit(f"int8 needs calibration images in {args.data_dir}/val")
+    print(f"[EXPORT] {args.model}: {len(calib)} calibration / {len(test_x)} test images, {img_size}px")
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    paths = {'keras': args.model}
+    for fmt in formats:
+        path = paths[fmt] = os.path.join(args.out_dir, EXPORT_FILES[fmt])
+        start = time.perf_counter()
+        if fmt.startswith('tflite'):
+            export_tflite(model, path, fmt.split('-')[1], calib)
+        elif fmt == 'onnx':
+            export_onnx(model, path, img_size)
+        else:
+            fp32 = paths.get('onnx') or os.path.join(args.out_dir, EXPORT_FILES['onnx'])
+            if 'onnx' not in paths:
+                export_onnx(model, fp32, img_size)
+            quantize_onnx(fp32, path, calib)
+        print(f"[EXPORT] {fmt}: {path} in {time.perf_counter() - start:.1f}s")
+    del model
+
+    rows = []
+    single = to_input(test_x[:1])
+    batched = to_input(np.resize(test_x, (args.bench_batch,) + test_x.shape[1:]))
+    for fmt, path in paths.items():
+        start = time.perf_counter()
+        runner = load_runner(fmt, path, args.threads)
+        runner(single)  # the first call allocates tensors / builds kernels: part of a cold start
+        load = (time.perf_counter() - start) * 1000
+        acc = float(np.mean(np.argmax(predict_all(runner, test_x, args.batch), axis=1) == test_y))
+        p50, p99 = latency_ms(runner, single, args.runs)
+        b50, b99 = latency_ms(runner, batched, max(args.runs // 4, 5))
+        rows.append({'format': fmt, 'path': path, 'size_mb': os.path.getsize(path) / 2**20, 'load_ms': load,
+                     'accuracy': acc, 'p50_ms': p50, 'p99_ms': p99, 'batch': args.bench_batch,
+                     'batch_p50_ms': b50, 'batch_p99_ms': b99})
+
+    base = rows[0]['accuracy']
+    failed = []
+    print(f"{'format':12s} {'MB':>7s} {'load ms':>8s} {'acc':>7s} {'drop':>7s} {'p50 ms':>7s} {'p99 ms':>7s} "
+          f"{'b' + str(args.bench_batch) + ' p50':>9s} {'p99':>8s} {'img/s':>7s}")
+    for r in rows:
+        r['drop'] = base - r['accuracy']
+        r['ok'] = r['drop'] <= args.max_drop
+        if not r['ok']:
+            failed.append(r['format'])
+        print(f"{r['format']:12s} {r['size_mb']:7.2f} {r['load_ms']:8.0f} {r['accuracy']:7.4f} {r['drop']:+7.4f} "
+              f"{r['p50_ms']:7.2f} {r['p99_ms']:7.2f} {r['batch_p50_ms']:9.1f} {r['batch_p99_ms']:8.1f} "
+              f"{args.bench_batch * 1000 / r['batch_p50_ms']:7.1f}" + ('' if r['ok'] else '  FAIL'))
+    with open(os.path.join(args.out_dir, 'report.json'), 'w', encoding='utf-8') as f:
+        json.dump({'model': args.model, 'threads': args.threads, 'test_images': len(test_x),
+                   'max_drop': args.max_drop, 'results': rows}, f, indent=2)
+    if failed:
+        print(f"[EXPORT] accuracy drop above {args.max_drop} for: {', '.join(failed)}")
+        return 1
+    return 0
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'export':
+        sys.exit(export_main(sys.argv[2:]))
     main()
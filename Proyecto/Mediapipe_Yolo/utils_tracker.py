@@ -1,17 +1,257 @@
- utils_tracker.py
-from scipy.spatial import distance as dist
+# utils_tracker.py
+#
+# CentroidTracker compartido por streamlit_app.py y cualquier otro script.
+#
+# El estado de los tracks vive en arrays NumPy preasignados (crecen al doble solo si hay
+# más objetos simultáneos que capacidad); cada track tiene su historial como ring buffer
+# de max_history posiciones, así que la memoria queda acotada y no hay list.pop(0).
+#
+# Emparejamiento (update):
+#   - "greedy": el mismo criterio que el bucle original (filas por distancia mínima
+#     creciente, cada una toma su columna más cercana si sigue libre y está a menos de
+#     max_distance), pero vectorizado: por columna gana la fila con menor distancia.
+#   - "optimal": asignación óptima con scipy.optimize.linear_sum_assignment (Hungarian),
+#     con los pares a más de max_distance descartados. Cambia los ids respecto de greedy
+#     y con cientos de objetos es bastante más lento (ver --bench): no es el default.
+# Lo que no se emparejó sigue la regla original: si hay al menos tantos tracks como
+# detecciones, los tracks sin detección envejecen; si no, las detecciones sin track se
+# registran (nunca las dos cosas). Con greedy los ids son los mismos que con el bucle
+# original (LoopCentroidTracker) frame a frame. age_and_register=True hace siempre las dos.
+#
+# objects e history son vistas de solo lectura (id -> centroide, id -> array de
+# posiciones de la más vieja a la más nueva), compatibles con el uso anterior:
+#   objects = ct.update(rects); hist = ct.history.get(oid, [])
+#
+# Benchmark de latencia de update (loop = el CentroidTracker original, como referencia):
+#   python3 utils_tracker.py --bench --objects 10,100,1000 --assignments loop,greedy,optimal
 from collections import OrderedDict
+from collections.abc import Mapping
+import time
+import argparse
 import numpy as np
-import math
+
+# scipy es opcional: solo hace falta para assignment="optimal"
+try:
+    from scipy.optimize import linear_sum_assignment
+    from scipy.spatial import distance as dist
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+ASSIGNMENTS = ("greedy", "optimal")
+
+class _ObjectsView(Mapping):
+    """id -> centroide (cx, cy) de los tracks activos, en orden de id (de registro)."""
+    def __init__(self, tracker):
+        self._t = tracker
+
+    def __getitem__(self, oid):
+        slot = self._t._slot[oid]
+        return tuple(int(v) for v in self._t.centroids[slot])
+
+    def __iter__(self):
+        return iter(sorted(self._t._slot))
+
+    def __len__(self):
+        return len(self._t._slot)
+
+    def items(self):
+        t = self._t
+        ids = sorted(t._slot)
+        cents = t.centroids[[t._slot[i] for i in ids]].tolist()
+        return [(oid, tuple(c)) for oid, c in zip(ids, cents)]
+
+class _HistoryView(Mapping):
+    """id -> array (n, 2) con las últimas posiciones del track, de la más vieja a la más nueva."""
+    def __init__(self, tracker):
+        self._t = tracker
+
+    def __getitem__(self, oid):
+        return self._t.history_of(oid)
+
+    def __iter__(self):
+        return iter(sorted(self._t._slot))
+
+    def __len__(self):
+        return len(self._t._slot)
 
 class CentroidTracker:
-    def __init__(self, max_disappeared=50, max_distance=50):
+    def __init__(self, max_disappeared=50, max_distance=50, max_history=20, assignment="greedy", capacity=64,
+                 age_and_register=False):
+        if assignment not in ASSIGNMENTS:
+            raise ValueError(f"assignment must be one of {ASSIGNMENTS}")
+        if assignment == "optimal" and not SCIPY_AVAILABLE:
+            raise RuntimeError("assignment='optimal' necesita scipy (pip install scipy)")
+        self.nextObjectID = 0
+        self.maxDisappeared = max_disappeared
+        self.maxDistance = max_distance
+        self.maxHistory = max_history
+        self.assignment = assignment
+        self.ageAndRegister = age_and_register
+        self._slot = {}  # id -> fila en los arrays (solo se toca al registrar/borrar)
+        self._alloc(capacity)
+        self.objects = _ObjectsView(self)
+        self.history = _HistoryView(self)
+
+    def _alloc(self, capacity):
+        self.ids = np.full(capacity, -1, dtype=np.int64)            # -1 = fila libre
+        self.centroids = np.zeros((capacity, 2), dtype=np.int64)
+        self.disappeared = np.zeros(capacity, dtype=np.int64)
+        self.hist = np.zeros((capacity, self.maxHistory, 2), dtype=np.int64)
+        self.hist_len = np.zeros(capacity, dtype=np.int64)
+        self.hist_pos = np.zeros(capacity, dtype=np.int64)          # próxima posición a escribir
+
+    def _grow(self, needed):
+        old = (self.ids, self.centroids, self.disappeared, self.hist, self.hist_len, self.hist_pos)
+        capacity = len(self.ids)
+        while capacity < needed:
+            capacity *= 2
+        self._alloc(capacity)
+        n = len(old[0])
+        for new, prev in zip((self.ids, self.centroids, self.disappeared, self.hist, self.hist_len, self.hist_pos), old):
+            new[:n] = prev
+
+    def register(self, centroids):
+        """Registra uno o varios centroides nuevos (array (k, 2) o un solo (cx, cy))."""
+        centroids = np.asarray(centroids, dtype=np.int64).reshape(-1, 2)
+        k = len(centroids)
+        free = np.flatnonzero(self.ids < 0)
+        if len(free) < k:
+            self._grow(len(self._slot) + k)
+            free = np.flatnonzero(self.ids < 0)
+        slots = free[:k]
+        new_ids = np.arange(self.nextObjectID, self.nextObjectID + k)
+        self.ids[slots] = new_ids
+        self.centroids[slots] = centroids
+        self.disappeared[slots] = 0
+        self.hist[slots, 0] = centroids
+        self.hist_len[slots] = 1
+        self.hist_pos[slots] = 1 % self.maxHistory
+        self._slot.update(zip(new_ids.tolist(), slots.tolist()))
+        self.nextObjectID += k
+
+    def deregister(self, objectID):
+        slot = self._slot.pop(objectID, None)
+        if slot is not None:
+            self.ids[slot] = -1
+
+    def history_of(self, objectID):
+        slot = self._slot[objectID]
+        n, pos = self.hist_len[slot], self.hist_pos[slot]
+        if n < self.maxHistory:
+            return self.hist[slot, :n].copy()
+        return np.concatenate((self.hist[slot, pos:], self.hist[slot, :pos]))
+
+    def _age(self, slots):
+        # +1 frame sin ver a estos tracks; los que pasan maxDisappeared se borran
+        self.disappeared[slots] += 1
+        for slot in slots[self.disappeared[slots] > self.maxDisappeared].tolist():
+            self.deregister(int(self.ids[slot]))
+
+    def _match(self, D2):
+        """(filas, columnas) emparejadas con la matriz de distancias al cuadrado D2 (tracks x detecciones)."""
+        limit = float(self.maxDistance) ** 2
+        if self.assignment == "optimal":
+            # la suma a minimizar es de distancias (no de cuadrados); los pares imposibles
+            # llevan un costo alto para que la asignación no los prefiera
+            D = np.sqrt(D2)
+            cost = np.where(D2 > limit, self.maxDistance * 1e3 + D.max(initial=0), D)
+            rows, cols = linear_sum_assignment(cost)
+            keep = D2[rows, cols] <= limit
+            return rows[keep], cols[keep]
+        # el orden por distancia es el mismo que por distancia al cuadrado: sin sqrt
+        best = D2.argmin(axis=1)
+        best_d = D2[np.arange(len(D2)), best]
+        # mismo argsort que el bucle original (sobre todas las filas): los empates quedan igual
+        rows = best_d.argsort()
+        rows = rows[best_d[rows] <= limit]
+        # en orden de distancia, la primera fila que pide cada columna se la queda
+        cols, first = np.unique(best[rows], return_index=True)
+        return rows[first], cols
+
+    def update(self, rects):
+        active = np.flatnonzero(self.ids >= 0)
+        active = active[np.argsort(self.ids[active])]  # orden de id: los empates se resuelven igual que antes
+        if len(rects) == 0:
+            self._age(active)
+            return self.objects
+
+        r = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+        inputCentroids = ((r[:, :2] + r[:, 2:]) / 2.0).astype(np.int64)  # como int(): trunca hacia 0
+
+        if len(active) == 0:
+            self.register(inputCentroids)
+            return self.objects
+
+        # distancias al cuadrado por columnas: dos matrices 2D, sin el eje de tamaño 2
+        tracked = self.centroids[active].astype(np.float64)
+        inputs = inputCentroids.astype(np.float64)
+        dx = tracked[:, 0, None] - inputs[None, :, 0]
+        dy = tracked[:, 1, None] - inputs[None, :, 1]
+        dx *= dx
+        dy *= dy
+        dx += dy
+        rows, cols = self._match(dx)
+
+        # tracks emparejados: posición nueva + ring buffer del historial
+        slots = active[rows]
+        pos = self.hist_pos[slots]
+        self.centroids[slots] = inputCentroids[cols]
+        self.disappeared[slots] = 0
+        self.hist[slots, pos] = inputCentroids[cols]
+        self.hist_pos[slots] = (pos + 1) % self.maxHistory
+        self.hist_len[slots] = np.minimum(self.hist_len[slots] + 1, self.maxHistory)
+
+        # regla original: con D de tracks x detecciones, si D.shape[0] >= D.shape[1] envejecen
+        # los tracks sin detección; si no, se registran las detecciones sin track
+        if self.ageAndRegister or len(active) >= len(inputCentroids):
+            unmatched = np.ones(len(active), dtype=bool)
+            unmatched[rows] = False
+            self._age(active[unmatched])
+        if self.ageAndRegister or len(active) < len(inputCentroids):
+            # en el orden en que el bucle original recorría su set de columnas libres,
+            # para que los ids nuevos salgan iguales
+            new = list(set(range(len(inputCentroids))).difference(set(cols.tolist())))
+            if new:
+                self.register(inputCentroids[new])
+        return self.objects
+
+def calc_speed_m_s(history, pixels_to_m=0.005, window_seconds=0.5):
+    """
+    Calcula velocidad estimada basada en el historial de centroides.
+    pixels_to_m: Metros por cada pixel (calibración).
+    window_seconds: Tiempo aproximado entre frames para cálculo.
+    """
+    if len(history) < 2:
+        return 0.0
+
+    # Tomar punto actual y uno anterior
+    ptA = history[-1]
+    ptB = history[0] # O history[-5] para suavizar
+
+    d_pixels = np.linalg.norm(np.array(ptA) - np.array(ptB))
+    d_meters = d_pixels * pixels_to_m
+
+    # Esto es una estimación burda asumiendo FPS constantes
+    # En una app real usaríamos timestamps reales del history
+    speed = d_meters / window_seconds
+    return speed
+
+# ---------- BENCH ----------
+class LoopCentroidTracker:
+    """El CentroidTracker original (dicts + bucle en Python), solo como referencia de --bench.
+
+    Mismo código que antes de vectorizar, salvo el largo del historial (max_history en vez
+    de 20 fijo) y la matriz de distancias sin scipy cuando no está instalado.
+    """
+    def __init__(self, max_disappeared=50, max_distance=50, max_history=20):
         self.nextObjectID = 0
         self.objects = OrderedDict()
         self.disappeared = OrderedDict()
-        self.history = OrderedDict()  # Para guardar historial de posiciones
+        self.history = OrderedDict()
         self.maxDisappeared = max_disappeared
         self.maxDistance = max_distance
+        self.maxHistory = max_history
 
     def register(self, centroid):
         self.objects[self.nextObjectID] = centroid
@@ -43,8 +283,11 @@ class CentroidTracker:
                 self.register(inputCentroids[i])
         else:
             objectIDs = list(self.objects.keys())
-            objectCentroids = list(self.objects.values())
-            D = dist.cdist(np.array(objectCentroids), inputCentroids)
+            objectCentroids = np.array(list(self.objects.values()))
+            if SCIPY_AVAILABLE:
+                D = dist.cdist(objectCentroids, inputCentroids)
+            else:
+                D = np.linalg.norm(objectCentroids[:, None] - inputCentroids[None], axis=2)
             rows = D.min(axis=1).argsort()
             cols = D.argmin(axis=1)[rows]
             usedRows = set()
@@ -60,9 +303,8 @@ class CentroidTracker:
                 self.objects[objectID] = inputCentroids[col]
                 self.disappeared[objectID] = 0
 
-                # Actualizar historial
                 self.history[objectID].append(inputCentroids[col])
-                if len(self.history[objectID]) > 20: # Limitar historial
+                if len(self.history[objectID]) > self.maxHistory:
                     self.history[objectID].pop(0)
 
                 usedRows.add(row)
@@ -83,23 +325,48 @@ class CentroidTracker:
 
         return self.objects
 
-def calc_speed_m_s(history, pixels_to_m=0.005, window_seconds=0.5):
- """
-    Calcula velocidad estimada basada en el historial de centroides.
-    pixels_to_m: Metros por cada pixel (calibración).
-    window_seconds: Tiempo aproximado entre frames para cálculo.
-    """
-    if len(history) < 2:
-        return 0.0
-    
-    # Tomar punto actual y uno anterior
-    ptA = history[-1]
-    ptB = history[0] # O history[-5] para suavizar
-    
-    d_pixels = np.linalg.norm(np.array(ptA) - np.array(ptB))
-    d_meters = d_pixels * pixels_to_m
-    
-    # Esto es una estimación burda asumiendo FPS constantes
-    # En una app real usaríamos timestamps reales del history
-    speed = d_meters / window_seconds 
-    return speed
+def simulate(n, frames, seed=0, size=4000, step=3.0, miss=0.05, churn=0.01):
+    """Frames de detecciones de n objetos que se mueven poco, con detecciones perdidas y objetos que entran/salen."""
+    rng = np.random.default_rng(seed)
+    pos = rng.uniform(0, size, (n, 2))
+    out = []
+    for _ in range(frames):
+        pos += rng.normal(0, step, pos.shape)
+        leave = rng.random(n) < churn
+        pos[leave] = rng.uniform(0, size, (leave.sum(), 2))
+        seen = pos[rng.random(n) >= miss]
+        out.append(np.hstack([seen - 10, seen + 10]))
+    return out
+
+def bench(args):
+    for n in [int(v) for v in args.objects.split(",")]:
+        frames = simulate(n, args.frames, seed=n)
+        for assignment in args.assignments.split(","):
+            if assignment == "optimal" and not SCIPY_AVAILABLE:
+                print(f"[BENCH] {n:5d} objetos  optimal: sin scipy, omitido")
+                continue
+            if assignment == "loop":
+                ct = LoopCentroidTracker(max_disappeared=20, max_distance=80, max_history=30)
+            else:
+                ct = CentroidTracker(max_disappeared=20, max_distance=80, max_history=30, assignment=assignment)
+            ct.update(frames[0])
+            times = []
+            for rects in frames[1:]:
+                start = time.perf_counter()
+                ct.update(rects)
+                times.append((time.perf_counter() - start) * 1000)
+            print(f"[BENCH] {n:5d} objetos  {assignment:7s}: update p50 {np.percentile(times, 50):7.3f} ms  "
+                  f"p99 {np.percentile(times, 99):7.3f} ms  ({len(ct.objects)} tracks, {ct.nextObjectID} ids)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CentroidTracker vectorizado")
+    parser.add_argument("--bench", action="store_true", help="latencia de update con N objetos simultáneos")
+    parser.add_argument("--objects", default="10,100,1000")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--assignments", default="loop,greedy,optimal",
+                        help="loop (el tracker original, referencia), greedy y/o optimal")
+    args = parser.parse_args()
+    if args.bench:
+        bench(args)
+    else:
+        parser.print_help()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# bench_download.py
+#
+# Compara el rendimiento de los motores de descarga de downloaders.py contra
+# servidores locales (fixture_server.py), sin tocar internet. Cada servidor es un
+# "host" con su propia latencia; una fracción de respuestas son errores 500.
+# Con --mixed se sirven también miniaturas, PNGs y fotos enormes, y --reject full,early
+# compara el camino original (descargar todo + decodificar + reencodear) con el rechazo
+# temprano por header: bytes descargados y CPU gastada en procesar imágenes.
+#
+# Uso:
+#   python3 bench_download.py --urls 600 --latencies 0.02,0.1,0.3,1.0 --error-rate 0.05
+#   python3 bench_download.py --mixed --engines async --reject full,early
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+from fixture_server import start_server, make_images, make_mixed_images
+from label_quota import LabelQuota
+from metadata_sink import open_sink
+from downloaders import ThreadedDownloader, AsyncDownloader, MAX_BYTES
+
+LABEL = "bench"
+
+def run_engine(name, make, urls, workdir):
+    out = os.path.join(workdir, name)
+    quota = LabelQuota(out, [LABEL], per_label=len(urls) + 1)
+    sink = open_sink(os.path.join(workdir, f"{name}.csv"), ["filename", "label", "source_url", "width", "height", "sha256"])
+    d = make(quota, sink, out)
+    # silenciar los [SAVED]/[ERROR] por imagen durante la medición
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        d.start()
+        t0 = time.perf_counter()
+        for url in urls:
+            d.put((url, LABEL))
+        d.close()
+        elapsed = time.perf_counter() - t0
+    sink.close()
+    st = d.stats
+    print(f"[BENCH] {name:14s}: {st['saved']} guardadas, {st['skipped']} descartadas, {st['error']} errores "
+          f"en {elapsed:.2f}s -> {st['saved'] / elapsed:.1f} img/s, {len(urls) / elapsed:.1f} urls/s, "
+          f"{st['bytes'] / 2**20:.1f} MiB leídos, CPU imágenes {st['cpu']:.2f}s")
+    return elapsed, st
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--urls", type=int, default=600)
+    parser.add_argument("--latencies", default="0.02,0.1,0.3,1.0", help="latencia (s) de cada host simulado")
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--max-simultaneous", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--per-host", type=int, default=32)
+    parser.add_argument("--engines", default="threads,async")
+    parser.add_argument("--reject", default="early", help="early, full o full,early (ver ImageStream)")
+    parser.add_argument("--mixed", action="store_true", help="servir una mezcla de tamaños y formatos")
+    parser.add_argument("--max-bytes", type=int, default=MAX_BYTES)
+    args = parser.parse_args()
+
+    images = make_mixed_images() if args.mixed else make_images(32)
+    servers = [start_server(latency=float(l), jitter=float(l) * 0.2, error_rate=args.error_rate, images=images)
+               for l in args.latencies.split(",")]
+    urls = [f"{servers[i % len(servers)][1]}/img/{i}.jpg" for i in range(args.urls)]
+
+    def engine(name, early):
+        kw = dict(early_reject=early, max_bytes=args.max_bytes)
+        if name == "threads":
+            return lambda q, s, o: ThreadedDownloader(q, s, o, threads=args.threads,
+                                                      max_simultaneous=args.max_simultaneous, **kw)
+        return lambda q, s, o: AsyncDownloader(q, s, o, concurrency=args.concurrency, per_host=args.per_host, **kw)
+
+    reject_modes = args.reject.split(",")
+    workdir = tempfile.mkdtemp(prefix="bench_download_")
+    results = {}
+    try:
+        for name in args.engines.split(","):
+            for mode in reject_modes:
+                results[(name, mode)] = run_engine(f"{name}/{mode}", engine(name, mode == "early"), urls, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        for server, _ in servers:
+            server.shutdown()
+    for mode in reject_modes:
+        if ("threads", mode) in results:
+            for name in args.engines.split(","):
+                if name != "threads":
+                    print(f"[BENCH] {name} vs threads ({mode}): "
+                          f"{results[('threads', mode)][0] / results[(name, mode)][0]:.1f}x")
+    if {"full", "early"} <= set(reject_modes):
+        for name in args.engines.split(","):
+            (_, full), (_, early) = results[(name, "full")], results[(name, "early")]
+            print(f"[BENCH] {name}: rechazo temprano ahorra {1 - early['bytes'] / max(full['bytes'], 1):.0%} "
+                  f"de bytes y {1 - early['cpu'] / max(full['cpu'], 1e-9):.0%} de CPU en imágenes")
+
+if __name__ == "__main__":
+    main()
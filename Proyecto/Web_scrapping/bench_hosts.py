@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# bench_hosts.py
+#
+# Semáforo fijo (MAX_SIMULTANEOUS_DOWNLOADS + REQUEST_TIMEOUT) contra el control
+# adaptativo por host de host_control.py, con hosts simulados de latencias mezcladas:
+# CDNs rápidos, hosts lentos, uno inestable (muchos 500) y uno colgado que nunca responde.
+#
+# Cada host se describe como latencia[:tasa_de_error]; "hang" es un host que no contesta.
+#
+# Uso:
+#   python3 bench_hosts.py --urls 300 --hosts 0.02,0.02,0.3,2.5,0.1:0.5,hang
+#   python3 bench_hosts.py --engines async
+import sys
+import shutil
+import argparse
+import tempfile
+import threading
+from fixture_server import start_server, make_images
+from bench_download import run_engine
+from host_control import HostController
+from downloaders import ThreadedDownloader, AsyncDownloader
+
+HANG_SECONDS = 120  # "hang": más que cualquier timeout
+
+def parse_hosts(spec):
+    hosts = []
+    for item in spec.split(","):
+        if item == "hang":
+            hosts.append((HANG_SECONDS, 0.0))
+        else:
+            lat, _, err = item.partition(":")
+            hosts.append((float(lat), float(err or 0)))
+    return hosts
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--urls", type=int, default=300)
+    parser.add_argument("--hosts", default="0.02,0.02,0.3,2.5,0.1:0.5,hang")
+    parser.add_argument("--engines", default="threads,async")
+    parser.add_argument("--threads", type=int, default=32, help="hilos del motor threads (en los dos modos)")
+    parser.add_argument("--max-simultaneous", type=int, default=5, help="semáforo fijo")
+    parser.add_argument("--per-host", type=int, default=16, help="límite fijo por host del motor async")
+    parser.add_argument("--timeout", type=float, default=5.0, help="timeout fijo / máximo del adaptativo")
+    parser.add_argument("--rate", type=float, default=100.0, help="token bucket: peticiones/s por host")
+    parser.add_argument("--live", type=float, default=0.0, help="imprimir estadísticas por host cada N s")
+    args = parser.parse_args()
+
+    images = make_images(32)
+    servers = [start_server(latency=lat, jitter=lat * 0.2, error_rate=err, images=images)
+               for lat, err in parse_hosts(args.hosts)]
+    urls = [f"{servers[i % len(servers)][1]}/img/{i}.jpg" for i in range(args.urls)]
+
+    def make(engine, controller):
+        kw = dict(timeout=args.timeout, controller=controller)
+        if engine == "threads":
+            return lambda q, s, o: ThreadedDownloader(q, s, o, threads=args.threads,
+                                                      max_simultaneous=args.max_simultaneous, **kw)
+        return lambda q, s, o: AsyncDownloader(q, s, o, per_host=args.per_host, **kw)
+
+    workdir = tempfile.mkdtemp(prefix="bench_hosts_")
+    results = {}
+    try:
+        for engine in args.engines.split(","):
+            for mode in ("fixed", "adaptive"):
+                controller = None
+                if mode == "adaptive":
+                    controller = HostController(max_timeout=args.timeout, rate=args.rate, burst=args.rate)
+                stop = threading.Event()
+                if controller is not None and args.live:
+                    threading.Thread(target=live_report, args=(controller, stop, args.live), daemon=True).start()
+                elapsed, st = run_engine(f"{engine}/{mode}", make(engine, controller), urls, workdir)
+                stop.set()
+                results[(engine, mode)] = (elapsed, st)
+                if controller is not None:
+                    print(controller.report())
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        for server, _ in servers:
+            server.shutdown()
+    for engine in args.engines.split(","):
+        (ef, sf), (ea, sa) = results[(engine, "fixed")], results[(engine, "adaptive")]
+        # se informan también las guardadas: abandonar URLs (timeouts) también "acelera" una corrida
+        print(f"[BENCH] {engine}: adaptativo {sa['saved']} guardadas en {ea:.1f}s ({sa['saved'] / ea:.1f} img/s) "
+              f"vs fijo {sf['saved']} en {ef:.1f}s ({sf['saved'] / ef:.1f} img/s) "
+              f"-> {(sa['saved'] / ea) / max(sf['saved'] / ef, 1e-9):.1f}x")
+
+def live_report(controller, stop, interval):
+    # stdout está redirigido a /dev/null durante cada corrida: las estadísticas van por stderr
+    while not stop.wait(interval):
+        print(controller.report(), file=sys.stderr, flush=True)
+
+if __name__ == "__main__":
+    main()
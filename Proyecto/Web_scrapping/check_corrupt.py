@@ -1,19 +1,169 @@
 # check_corrupt.py
-check_corrupt.py
-from PIL import Image
+#
+# Escáner de imágenes dañadas por niveles, en un pool de hilos:
+#   - header (siempre): magic bytes conocidos, marcador final (EOI de JPEG, IEND de PNG)
+#     y dimensiones declaradas en la cabecera. No decodifica píxeles.
+#   - full (--full): además decodifica la imagen completa (Image.load()).
+#
+# Escribe un reporte de cuarentena (JSON o CSV según la extensión) con el motivo de
+# cada fallo; etl_pipeline.py y split_dataset.py lo leen con load_quarantine() para
+# saltar esos archivos sin volver a abrirlos. --move-to aparta los archivos malos.
+#
+# Uso:
+#   python3 check_corrupt.py --src dataset --report quarantine.json
+#   python3 check_corrupt.py --full --workers 16 --move-to dataset_quarantine
 import os
+import csv
+import json
+import shutil
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+SRC_DIR = 'dataset'
+REPORT = 'quarantine.json'
+MAX_PIXELS = 100_000_000  # cabeceras que declaran más que esto se consideran dañadas/maliciosas
+TAIL_BYTES = 1024
+
+# (prefijo, formato)
+MAGIC = [
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+    (b'BM', 'BMP'),
+]
+
+def sniff_format(head: bytes):
+    for prefix, fmt in MAGIC:
+        if head.startswith(prefix):
+            return fmt
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+def check_header(path):
+    """Nivel barato: devuelve None si está bien o el motivo del fallo."""
+    try:
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            head = f.read(16)
+            f.seek(max(0, size - TAIL_BYTES))
+            tail = f.read()
+    except OSError as e:
+        return f'unreadable: {e}'
+    if size == 0:
+        return 'empty file'
+    fmt = sniff_format(head)
+    if fmt is None:
+        return 'unknown magic bytes'
+    # algunos encoders dejan relleno después del marcador final, por eso se busca en la cola
+    if fmt == 'JPEG' and b'\xff\xd9' not in tail:
+        return 'truncated: missing JPEG EOI marker'
+    if fmt == 'PNG' and b'IEND' not in tail:
+        return 'truncated: missing PNG IEND chunk'
+    try:
+        # Image.open solo parsea la cabecera
+        with Image.open(path) as im:
+            w, h = im.size
+    except Exception as e:
+        return f'bad header: {e}'
+    if w <= 0 or h <= 0:
+        return f'bad dimensions: {w}x{h}'
+    if w * h > MAX_PIXELS:
+        return f'too many pixels: {w}x{h}'
+    return None
+
+def check_full(path):
+    try:
+        with Image.open(path) as im:
+            im.load()
+    except Exception as e:
+        return f'decode failed: {e}'
+    return None
+
+def check_file(path, full=False):
+    """Devuelve (tier, motivo) del primer nivel que falla, o None."""
+    reason = check_header(path)
+    if reason:
+        return 'header', reason
+    if full:
+        reason = check_full(path)
+        if reason:
+            return 'full', reason
+    return None
 
-bad = []
-for root, _, files in os.walk('dataset'):
-    for f in files:
-        path = os.path.join(root, f)
+def scan(src, full=False, workers=8):
+    paths = []
+    for root, dirs, files in os.walk(src):
+        dirs.sort()
+        paths.extend(os.path.join(root, f) for f in sorted(files))
+    bad = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for path, res in zip(paths, pool.map(lambda p: check_file(p, full), paths)):
+            if res:
+                tier, reason = res
+                bad.append({'path': path, 'relpath': os.path.relpath(path, src), 'tier': tier, 'reason': reason})
+    return paths, bad
+
+# ---------- REPORTE ----------
+def write_report(report_path, src, bad, full):
+    if report_path.lower().endswith('.csv'):
+        with open(report_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=['path', 'relpath', 'tier', 'reason', 'moved_to'], restval='')
+            writer.writeheader()
+            writer.writerows(bad)
+    else:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump({'src': src, 'full_decode': full, 'bad': bad}, f, indent=2, ensure_ascii=False)
+
+def load_quarantine(report_path):
+    """Rutas relativas (label/archivo) marcadas como dañadas en un reporte JSON o CSV.
+
+    Son relativas a la carpeta escaneada, así el mismo reporte sirve para dataset/
+    y para dataset_preprocessed/ (que conserva label/nombre).
+    """
+    if not report_path or not os.path.exists(report_path):
+        return set()
+    if report_path.lower().endswith('.csv'):
+        with open(report_path, newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+    else:
+        with open(report_path, encoding='utf-8') as f:
+            rows = json.load(f)['bad']
+    return {os.path.normpath(r['relpath']) for r in rows}
+
+def move_aside(bad, dst):
+    for entry in bad:
+        target = os.path.join(dst, entry['relpath'])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
         try:
-            # verify() detecta corrupciones; reabrimos para asegurar
-            with Image.open(path) as im:
-                im.verify()
-        except Exception as e:
-            bad.append(path)
-
-print('Corruptas:', len(bad))
-for p in bad[:50]:
-    print(p)
+            shutil.move(entry['path'], target)
+            entry['moved_to'] = target
+        except OSError as e:
+            print('No se pudo mover:', entry['path'], e)
+
+def main():
+    parser = argparse.ArgumentParser(description='detecta imágenes dañadas')
+    parser.add_argument('--src', default=SRC_DIR)
+    parser.add_argument('--full', action='store_true', help='además decodificar cada imagen completa')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--report', default=REPORT, help='reporte de cuarentena (.json o .csv)')
+    parser.add_argument('--move-to', help='mover los archivos dañados a esta carpeta (conserva label/)')
+    args = parser.parse_args()
+
+    paths, bad = scan(args.src, args.full, args.workers)
+    if args.move_to:
+        move_aside(bad, args.move_to)
+    write_report(args.report, args.src, bad, args.full)
+
+    by_reason = {}
+    for entry in bad:
+        key = entry['reason'].split(':')[0]
+        by_reason[key] = by_reason.get(key, 0) + 1
+    print(f'Revisadas: {len(paths)}  Corruptas: {len(bad)}  (reporte: {args.report})')
+    for reason, n in sorted(by_reason.items(), key=lambda kv: -kv[1]):
+        print(f'  {reason}: {n}')
+
+if __name__ == '__main__':
+    main()
@@ -1,49 +1,162 @@
 # dedupe_by_hash.py
+#
+# Elimina duplicados exactos (mismo contenido) dentro de dataset/.
+# Se conserva la primera ocurrencia en orden de ruta.
+#
+# Para no hashear todo el dataset en cada corrida:
+#   1. se agrupan los archivos por tamaño (un tamaño único no puede ser duplicado),
+#   2. entre los que comparten tamaño se calcula el sha256 de los primeros 64 KB,
+#   3. solo los que coinciden también en ese hash parcial se hashean completos.
+# Los hashes se calculan en un pool de hilos (hashlib libera el GIL) y se guardan
+# en una caché SQLite (path, size, mtime) -> hash, así una segunda corrida sobre
+# un árbol sin cambios no vuelve a leer ningún archivo.
+#
+# Uso:
+#   python3 dedupe_by_hash.py --src dataset --workers 8
+#   python3 dedupe_by_hash.py --dry-run
 import os
-import csv
+import sqlite3
 import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 
-meta_in = 'metadata.csv'
-seen = {}   # sha256 -> first filepath
-removed = []
+SRC_DIR = 'dataset'
+CACHE = 'hash_cache.sqlite'
+PARTIAL_BYTES = 64 * 1024
+CHUNK = 1 << 20
 
-def sha256_of_file(path):
+def sha256_of_file(path, limit=None):
     h = hashlib.sha256()
+    remaining = limit
     with open(path, 'rb') as f:
-        for chunk in iter(lambda: f.read(8192), b''):
+        while remaining is None or remaining > 0:
+            chunk = f.read(CHUNK if remaining is None else min(CHUNK, remaining))
+            if not chunk:
+                break
             h.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
     return h.hexdigest()
 
-# Leer metadata.csv y mapear sha -> file (ruta absoluta relativa a dataset/)
-if not os.path.exists(meta_in):
-    print(f"Error: {meta_in} no encontrado.")
-    raise SystemExit(1)
-
-with open(meta_in, newline='', encoding='utf-8') as f:
-    reader = csv.DictReader(f)
-    rows = list(reader)
-
-for row in rows:
-    filename = row['filename']
-    label = row['label']
-    filepath = os.path.join('dataset', label.replace(' ', '_'), filename)
-    h = row.get('sha256') or ''
-    if not h:
-        # si no hay hash en CSV, calculamos desde archivo si existe
-        if os.path.exists(filepath):
-            h = sha256_of_file(filepath)
+class HashCache:
+    """(path, size, mtime_ns) -> (partial, full) sha256, persistido en SQLite."""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS hashes ("
+                          "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, partial TEXT, full TEXT)")
+        self.rows = {r[0]: r[1:] for r in self.conn.execute(
+            "SELECT path, size, mtime_ns, partial, full FROM hashes")}
+
+    def get(self, path, size, mtime_ns):
+        row = self.rows.get(path)
+        if row is None or row[0] != size or row[1] != mtime_ns:
+            return None, None
+        return row[2], row[3]
+
+    def put(self, path, size, mtime_ns, partial=None, full=None):
+        old_partial, old_full = self.get(path, size, mtime_ns)
+        self.rows[path] = (size, mtime_ns, partial or old_partial, full or old_full)
+
+    def save(self, live_paths):
+        # las entradas de archivos que ya no existen se descartan
+        with self.conn:
+            self.conn.execute("DELETE FROM hashes")
+            self.conn.executemany("INSERT INTO hashes VALUES (?,?,?,?,?)",
+                                  [(p,) + r for p, r in self.rows.items() if p in live_paths])
+        self.conn.close()
+
+def scan(src):
+    """Lista (path, size, mtime_ns) de todos los archivos bajo src, en orden de ruta."""
+    entries = []
+    for root, dirs, _ in os.walk(src):
+        dirs.sort()
+        with os.scandir(root) as it:
+            files = sorted((e for e in it if e.is_file()), key=lambda e: e.name)
+        for e in files:
+            st = e.stat()
+            entries.append((e.path, st.st_size, st.st_mtime_ns))
+    return entries
+
+def _group(items, key):
+    groups = {}
+    for item in items:
+        groups.setdefault(key(item), []).append(item)
+    return [g for g in groups.values() if len(g) > 1]
+
+def _hash_stage(pool, cache, entries, stage):
+    """Devuelve {path: hash} para la etapa 'partial' o 'full', usando la caché cuando es válida."""
+    out, todo = {}, []
+    for path, size, mtime in entries:
+        partial, full = cache.get(path, size, mtime)
+        cached = partial if stage == 'partial' else full
+        # si el archivo cabe en el bloque parcial, el hash parcial ya es el completo
+        if cached is None and stage == 'full' and size <= PARTIAL_BYTES:
+            cached = partial
+        if cached is not None:
+            out[path] = cached
         else:
-            continue
-    if h in seen:
-        # duplicado: eliminar archivo actual (mantener primer ocurrencia)
+            todo.append((path, size, mtime))
+    limit = PARTIAL_BYTES if stage == 'partial' else None
+    futures = [(e, pool.submit(sha256_of_file, e[0], limit)) for e in todo]
+    for (path, size, mtime), fut in futures:
         try:
-            if os.path.exists(filepath):
+            h = fut.result()
+        except OSError as e:
+            print("No se pudo leer:", path, e)
+            continue
+        out[path] = h
+        if stage == 'partial':
+            cache.put(path, size, mtime, partial=h, full=h if size <= PARTIAL_BYTES else None)
+        else:
+            cache.put(path, size, mtime, full=h)
+    return out, len(todo)
+
+def find_duplicates(entries, cache, workers=8):
+    """Grupos de archivos con contenido idéntico (tamaño -> hash parcial -> sha256 completo)."""
+    by_size = _group(entries, key=lambda e: e[1])
+    candidates = [e for g in by_size for e in g]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        partial, n_partial = _hash_stage(pool, cache, candidates, 'partial')
+        by_partial = _group([e for e in candidates if e[0] in partial], key=lambda e: (e[1], partial[e[0]]))
+        suspects = [e for g in by_partial for e in g]
+        full, n_full = _hash_stage(pool, cache, suspects, 'full')
+    groups = _group([e for e in suspects if e[0] in full], key=lambda e: full[e[0]])
+    print(f"Archivos: {len(entries)}, mismo tamaño: {len(candidates)} (hash parcial: {n_partial} leídos), "
+          f"hash completo: {len(suspects)} ({n_full} leídos)")
+    return [sorted(e[0] for e in g) for g in groups]
+
+def main():
+    parser = argparse.ArgumentParser(description="elimina imágenes duplicadas (contenido idéntico)")
+    parser.add_argument('--src', default=SRC_DIR)
+    parser.add_argument('--cache', default=CACHE, help="caché SQLite de hashes")
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--dry-run', action='store_true', help="solo listar, no borrar")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.src):
+        print(f"Error: {args.src} no encontrado.")
+        raise SystemExit(1)
+
+    entries = scan(args.src)
+    cache = HashCache(args.cache)
+    groups = find_duplicates(entries, cache, args.workers)
+
+    removed = []
+    for group in groups:
+        # duplicado: eliminar todos menos la primera ocurrencia
+        for filepath in group[1:]:
+            if args.dry_run:
+                print("Duplicado:", filepath, "==", group[0])
+                continue
+            try:
                 os.remove(filepath)
                 removed.append(filepath)
-        except Exception as e:
-            print("No se pudo eliminar:", filepath, e)
-    else:
-        seen[h] = filepath
+            except Exception as e:
+                print("No se pudo eliminar:", filepath, e)
 
-print('Eliminados:', len(removed))
+    cache.save({e[0] for e in entries} - set(removed))
+    print('Eliminados:', len(removed))
 
+if __name__ == '__main__':
+    main()
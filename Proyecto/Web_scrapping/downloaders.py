@@ -0,0 +1,558 @@
+# downloaders.py
+#
+# Motores de descarga para scraper_dataset.py. Los dos exponen la misma interfaz:
+#   d.start(); d.put((url, label)); d.empty(); d.close(); d.stats
+#
+# - ThreadedDownloader: el camino original (N hilos + requests.get + Semaphore global).
+# - AsyncDownloader: un event loop asyncio en su propio hilo con un ClientSession de
+#   aiohttp compartido (keep-alive / reutilización de conexiones), límite global de
+#   conexiones y límite por host. Soporta cientos de descargas en vuelo; decodificar,
+#   reencodear y escribir a disco se hace en un ThreadPoolExecutor para no bloquear el loop.
+#
+# Las respuestas se leen por bloques a través de ImageStream: con los primeros KB se lee
+# el header (formato y dimensiones) y se corta la transferencia si la imagen es muy chica,
+# tiene demasiados píxeles o supera MAX_BYTES. Un JPEG RGB completo se guarda tal cual
+# (sin decodificar ni reencodear); el resto se decodifica y se reencoda a JPEG q85.
+#
+# Con controller (host_control.HostController) la concurrencia, el ritmo y el timeout
+# son por host y adaptativos, los hosts que fallan siempre se cortan (circuit breaker)
+# y los errores del host (timeouts, conexión, 5xx, 429) se reintentan con backoff y jitter.
+# Una URL cuyo host está cortado no falla: vuelve a "seen" en la frontera y se reencola
+# cuando el breaker deja pasar otra prueba (hasta MAX_DEFERS veces y si la espera no pasa
+# de MAX_DEFER_WAIT; si no, queda para la próxima corrida).
+#
+# Ambos usan LabelQuota (cupos por label) y MetadataSink (metadata en un solo hilo).
+# Con frontier (url_frontier.Frontier) registran el estado de cada URL y descartan,
+# antes de escribirlo, el contenido cuyo sha256 ya está en el dataset.
+import os
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from io import BytesIO
+from queue import Queue
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from PIL import Image
+from host_control import HostUnavailable
+
+# Optional: aiohttp para el motor asyncio
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except Exception:
+    AIOHTTP_AVAILABLE = False
+
+USER_AGENT = {"User-Agent": "Mozilla/5.0"}
+CHUNK_SIZE = 16 * 1024        # bloques chicos: el primero ya suele traer el header completo
+SNIFF_LIMIT = 256 * 1024      # si el header no apareció en estos bytes, se decide al final
+MAX_BYTES = 10 * 1024 * 1024  # respuestas más grandes se cortan
+MAX_PIXELS = 50_000_000       # ~7000x7000; más que esto se descarta sin descargar el resto
+MAX_DEFERS = 3                # veces que una URL vuelve a la cola por host cortado en una corrida
+MAX_DEFER_WAIT = 60.0         # segundos; un breaker abierto más tiempo deja la URL para otra corrida
+
+print_lock = threading.Lock()
+
+def log(msg):
+    with print_lock:
+        print(msg)
+
+def sha256_bytes(b):
+    m = hashlib.sha256()
+    m.update(b)
+    return m.hexdigest()
+
+class Rejected(Exception):
+    """La imagen se descargó pero no sirve para el dataset (p. ej. demasiado pequeña)."""
+
+def prepare_image(body, min_width, min_height):
+    """Decodifica, valida tamaño y reencoda a JPEG q85; devuelve (bytes, w, h, sha256)."""
+    img = Image.open(BytesIO(body)).convert("RGB")
+    w, h = img.size
+    if w < min_width or h < min_height:
+        raise Rejected(f"too small {w}x{h}")
+    img_bytes = BytesIO()
+    img.save(img_bytes, format="JPEG", quality=85)
+    b = img_bytes.getvalue()
+    return b, w, h, sha256_bytes(b)
+
+def _http_status(e):
+    resp = getattr(e, "response", None)  # requests.HTTPError
+    if resp is not None:
+        return resp.status_code
+    return getattr(e, "status", None)    # aiohttp.ClientResponseError
+
+def host_fault(e):
+    """El error es del host (cuenta para AIMD / breaker y se reintenta): timeouts, conexión, 5xx, 429."""
+    status = _http_status(e)
+    if status is not None:
+        return status >= 500 or status == 429
+    return True
+
+def _jpeg_complete(body):
+    # termina en EOI (algunos servidores agregan relleno después)
+    return body.rstrip(b"\x00\r\n ").endswith(b"\xff\xd9")
+
+class ImageStream:
+    """Acumula el cuerpo de una respuesta y la rechaza lo antes posible.
+
+    feed() lanza Rejected apenas el header (o el tamaño acumulado) descarta la imagen;
+    finish() devuelve (bytes, w, h, sha256). Con early=False se comporta como el camino
+    original: descarga todo, decodifica y reencoda siempre (útil para comparar).
+    """
+
+    def __init__(self, min_width, min_height, max_bytes=MAX_BYTES, max_pixels=MAX_PIXELS,
+                 early=True, content_length=None):
+        self.min_width = min_width
+        self.min_height = min_height
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.early = early
+        self.buf = bytearray()
+        self.format = self.mode = self.size = None
+        self.cpu = 0.0  # segundos de CPU en sniff + decode/encode + hash
+        if early and content_length and int(content_length) > max_bytes:
+            raise Rejected(f"too large ({content_length} bytes)")
+
+    @property
+    def received(self):
+        return len(self.buf)
+
+    def feed(self, chunk):
+        self.buf += chunk
+        if not self.early:
+            return
+        if len(self.buf) > self.max_bytes:
+            raise Rejected(f"too large (> {self.max_bytes} bytes)")
+        if self.size is None and len(self.buf) <= SNIFF_LIMIT:
+            self._sniff()
+
+    def _sniff(self):
+        t0 = time.thread_time()
+        try:
+            # Image.open es perezoso: solo parsea el header, no decodifica píxeles
+            im = Image.open(BytesIO(self.buf))
+            self.format, self.mode, self.size = im.format, im.mode, im.size
+        except Image.DecompressionBombError as e:
+            raise Rejected(str(e))
+        except Exception:
+            return  # header todavía incompleto (o formato que Pillow no reconoce): seguir leyendo
+        finally:
+            self.cpu += time.thread_time() - t0
+        w, h = self.size
+        if w < self.min_width or h < self.min_height:
+            raise Rejected(f"too small {w}x{h}")
+        if w * h > self.max_pixels:
+            raise Rejected(f"too many pixels {w}x{h}")
+
+    def finish(self):
+        body = bytes(self.buf)
+        if self.early:
+            if self.size is None:
+                self._sniff()
+            # un JPEG RGB completo ya sirve: se guardan los bytes originales
+            if self.format == "JPEG" and self.mode == "RGB" and _jpeg_complete(body):
+                t0 = time.thread_time()
+                sha = sha256_bytes(body)
+                self.cpu += time.thread_time() - t0
+                return body, self.size[0], self.size[1], sha
+        t0 = time.thread_time()
+        try:
+            return prepare_image(body, self.min_width, self.min_height)
+        finally:
+            self.cpu += time.thread_time() - t0
+
+class _BaseDownloader:
+    def __init__(self, quota, sink, output_dir, min_width=200, min_height=200, timeout=15, frontier=None,
+                 max_bytes=MAX_BYTES, max_pixels=MAX_PIXELS, early_reject=True, controller=None, retries=2):
+        self.quota = quota
+        self.frontier = frontier
+        self.sink = sink
+        self.output_dir = output_dir
+        self.min_width = min_width
+        self.min_height = min_height
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.early_reject = early_reject
+        self.controller = controller
+        # sin controller se mantiene el comportamiento original: un intento, timeout fijo
+        self.retries = retries if controller is not None else 0
+        self.stats_lock = threading.Lock()
+        # bytes: bytes de cuerpo leídos; cpu: segundos de CPU procesando imágenes (ImageStream)
+        self.stats = {"saved": 0, "error": 0, "skipped": 0, "cancelled": 0, "duplicate": 0,
+                      "breaker": 0, "retries": 0, "bytes": 0, "cpu": 0.0}
+        self.defers = {}  # url -> veces que se reencoló por host cortado
+
+    def _count(self, key, n=1):
+        with self.stats_lock:
+            self.stats[key] += n
+
+    def _new_stream(self, content_length):
+        return ImageStream(self.min_width, self.min_height, self.max_bytes, self.max_pixels,
+                           self.early_reject, content_length)
+
+    def _account(self, stream):
+        if stream is not None:
+            self._count("bytes", stream.received)
+            self._count("cpu", stream.cpu)
+
+    def _finish(self, stream):
+        cpu = stream.cpu  # lo anterior (sniff) ya se contó en _account
+        try:
+            return stream.finish()
+        finally:
+            self._count("cpu", stream.cpu - cpu)
+
+    def _timeout(self, host):
+        return self.timeout if self.controller is None else self.controller.timeout(host)
+
+    def _backoff(self, attempt):
+        self._count("retries")
+        return self.controller.backoff(attempt)
+
+    def _attempt(self, url):
+        if self.frontier is not None:
+            self.frontier.attempt(url)
+
+    def _failed(self, url, reason):
+        if self.frontier is not None:
+            self.frontier.fail(url, reason)
+
+    def _deferred(self, url, e):
+        """Host cortado: la URL vuelve a 'seen'; segundos hasta reencolarla, o None si no se reencola."""
+        if self.frontier is not None:
+            self.frontier.defer(url)
+        self._count("breaker")
+        with self.stats_lock:
+            n = self.defers.get(url, 0) + 1
+            if n > MAX_DEFERS or e.retry_after > MAX_DEFER_WAIT:
+                self.defers.pop(url, None)
+                return None
+            self.defers[url] = n
+        # un poco de jitter para que las URLs del mismo host no vuelvan todas juntas
+        return e.retry_after + random.uniform(0, 1)
+
+    def _save(self, label, url, b, w, h, hsh):
+        """Asigna nombre (commit de la reserva) y escribe; False si el cupo se llenó o el contenido ya existe."""
+        if self.frontier is not None and not self.frontier.claim_content(hsh, label, url):
+            log(f"[DUP] {url} (contenido ya en el dataset)")
+            self.quota.release(label)
+            self.frontier.fail(url, "duplicate content")
+            self._count("duplicate")
+            return False
+        filename = self.quota.commit(label)
+        if filename is None:
+            log(f"[DONE] {label} se completó, descartando {url}")
+            if self.frontier is not None:
+                self.frontier.unclaim_content(hsh)
+                self.frontier.fail(url, "cancelled")
+            self._count("cancelled")
+            return False
+        path = os.path.join(self.output_dir, self.quota.folder(label), filename)
+        with open(path, "wb") as f:
+            f.write(b)
+        self.sink.write([filename, label, url, w, h, hsh])
+        if self.frontier is not None:
+            self.frontier.set_filename(hsh, filename)
+            self.frontier.done(url, hsh)
+        self._count("saved")
+        log(f"[SAVED] {path} from {url}")
+        return True
+
+# ---------- HILOS ----------
+class ThreadedDownloader(_BaseDownloader):
+    def __init__(self, quota, sink, output_dir, threads=8, max_simultaneous=5, **kw):
+        super().__init__(quota, sink, output_dir, **kw)
+        self.threads = threads
+        self.semaphore = threading.Semaphore(max_simultaneous)
+        self.queue = Queue()
+        self.workers = []
+        self.waiting = 0  # URLs postergadas por host cortado que todavía no volvieron a la cola
+        self.closing = False
+
+    def start(self):
+        for _ in range(self.threads):
+            t = threading.Thread(target=self._worker, daemon=True)
+            t.start()
+            self.workers.append(t)
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def empty(self):
+        with self.stats_lock:
+            return self.queue.empty() and self.waiting == 0
+
+    def close(self):
+        # las postergadas que no volvieron siguen en "seen": se retoman en la próxima corrida
+        with self.stats_lock:
+            self.closing = True
+        for _ in self.workers:
+            self.queue.put(None)
+        self.queue.join()
+        for t in self.workers:
+            t.join(timeout=1)
+
+    def _requeue_later(self, item, delay):
+        with self.stats_lock:
+            if self.closing:
+                return
+            self.waiting += 1
+        timer = threading.Timer(delay, self._requeue, (item,))
+        timer.daemon = True
+        timer.start()
+
+    def _requeue(self, item):
+        with self.stats_lock:
+            self.waiting -= 1
+            # después de close() los workers ya recibieron su None: no se encola nada más
+            if not self.closing:
+                self.queue.put(item)
+
+    def _read_body(self, resp, label, stream):
+        """Lee la respuesta por bloques en stream; False si el label se completó mientras tanto."""
+        for chunk in resp.iter_content(CHUNK_SIZE):
+            if self.quota.is_done(label):
+                return False
+            stream.feed(chunk)
+        return True
+
+    def _acquire(self, host):
+        """Espera un lugar para host; True si la petición es la prueba half-open del breaker."""
+        if self.controller is None:
+            self.semaphore.acquire()
+            return False
+        while True:
+            wait, probe = self.controller.acquire(host)  # HostUnavailable si el breaker está abierto
+            if not wait:
+                return probe
+            time.sleep(wait)
+
+    def _release(self, host, latency, ok, probe=False):
+        if self.controller is None:
+            self.semaphore.release()
+        else:
+            self.controller.release(host, latency, ok, probe)
+
+    def _fetch(self, url, label):
+        """Descarga url en un ImageStream (con reintentos); None si el label se completó mientras tanto."""
+        host = urlsplit(url).netloc
+        for attempt in range(self.retries + 1):
+            probe = self._acquire(host)
+            stream = None
+            ok = True
+            t0 = time.monotonic()
+            try:
+                # al salir del with se cierra la conexión aunque el cuerpo no se haya leído entero
+                with requests.get(url, timeout=self._timeout(host), headers=USER_AGENT, stream=True) as resp:
+                    resp.raise_for_status()
+                    stream = self._new_stream(resp.headers.get("Content-Length"))
+                    return stream if self._read_body(resp, label, stream) else None
+            except Rejected:
+                raise
+            except Exception as e:
+                ok = not host_fault(e)
+                if ok or attempt == self.retries:
+                    raise
+            finally:
+                self._release(host, time.monotonic() - t0, ok, probe)
+                self._account(stream)
+            time.sleep(self._backoff(attempt))
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            url, label = item
+            # sin cupo (guardadas + en vuelo) no se descarga nada
+            if not self.quota.reserve(label):
+                self.queue.task_done()
+                continue
+            saved = False
+            self._attempt(url)
+            try:
+                try:
+                    stream = self._fetch(url, label)
+                    if stream is None:
+                        log(f"[CANCEL] {url} ({label} ya completo)")
+                        self._failed(url, "cancelled")
+                        self._count("cancelled")
+                        continue
+                    b, w, h, hsh = self._finish(stream)
+                except Rejected as e:
+                    log(f"[SKIP] {url} ({e})")
+                    self._failed(url, e)
+                    self._count("skipped")
+                    continue
+                except HostUnavailable as e:
+                    delay = self._deferred(url, e)
+                    log(f"[HOST] {url} ({e}){'' if delay is None else f', reintento en {delay:.0f}s'}")
+                    if delay is not None:
+                        self._requeue_later(item, delay)
+                    continue
+                except Exception as e:
+                    log(f"[ERROR] descargar {url}: {e}")
+                    self._failed(url, e)
+                    self._count("error")
+                    continue
+
+                # _save() consume la reserva (commit o release) en todos los casos
+                saved = True
+                self._save(label, url, b, w, h, hsh)
+            finally:
+                if not saved:
+                    self.quota.release(label)
+                self.queue.task_done()
+
+# ---------- ASYNCIO ----------
+class AsyncDownloader(_BaseDownloader):
+    def __init__(self, quota, sink, output_dir, concurrency=256, per_host=16, decode_workers=None, **kw):
+        if not AIOHTTP_AVAILABLE:
+            raise RuntimeError("el motor async necesita aiohttp (pip install aiohttp)")
+        super().__init__(quota, sink, output_dir, **kw)
+        self.concurrency = concurrency
+        # con controller el límite por host lo decide él; el connector solo pone el techo
+        self.per_host = per_host if self.controller is None else self.controller.max_limit
+        self.executor = ThreadPoolExecutor(max_workers=decode_workers or os.cpu_count() or 4)
+        self.loop = None
+        self.q = None
+        self.thread = None
+        self.ready = threading.Event()
+        self.queued = 0  # items aceptados por put() que ningún worker tomó todavía
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run_loop, daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    def put(self, item):
+        with self.stats_lock:
+            self.queued += 1
+        self.loop.call_soon_threadsafe(self.q.put_nowait, item)
+
+    def empty(self):
+        with self.stats_lock:
+            return self.queued == 0
+
+    def close(self):
+        # los workers terminan con su None; las reencoladas pendientes (call_later) se
+        # descartan al cerrar el loop y siguen en "seen" para la próxima corrida
+        for _ in range(self.concurrency):
+            self.loop.call_soon_threadsafe(self.q.put_nowait, None)
+        self.thread.join()
+        self.executor.shutdown()
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._main())
+        finally:
+            self.loop.close()
+
+    async def _main(self):
+        self.q = asyncio.Queue()
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=USER_AGENT) as session:
+            workers = [asyncio.create_task(self._worker(session)) for _ in range(self.concurrency)]
+            self.ready.set()
+            await asyncio.gather(*workers)
+
+    async def _worker(self, session):
+        while True:
+            item = await self.q.get()
+            if item is None:
+                return
+            with self.stats_lock:
+                self.queued -= 1
+            await self._download(session, *item)
+
+    async def _read_body(self, resp, label, stream):
+        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+            if self.quota.is_done(label):
+                return False
+            stream.feed(chunk)
+        return True
+
+    async def _acquire(self, host):
+        """Espera un lugar para host; True si la petición es la prueba half-open del breaker."""
+        if self.controller is None:
+            return False  # el TCPConnector ya limita por host
+        while True:
+            wait, probe = self.controller.acquire(host)  # HostUnavailable si el breaker está abierto
+            if not wait:
+                return probe
+            await asyncio.sleep(wait)
+
+    async def _fetch(self, session, url, label):
+        """Descarga url en un ImageStream (con reintentos); None si el label se completó mientras tanto."""
+        host = urlsplit(url).netloc
+        for attempt in range(self.retries + 1):
+            probe = await self._acquire(host)
+            stream = None
+            ok = True
+            t0 = time.monotonic()
+            try:
+                # al salir del async with sin leer todo el cuerpo, aiohttp cierra esa conexión
+                timeout = aiohttp.ClientTimeout(total=self._timeout(host))
+                async with session.get(url, timeout=timeout) as resp:
+                    resp.raise_for_status()
+                    stream = self._new_stream(resp.content_length)
+                    return stream if await self._read_body(resp, label, stream) else None
+            except Rejected:
+                raise
+            except Exception as e:
+                ok = not host_fault(e)
+                if ok or attempt == self.retries:
+                    raise
+            finally:
+                if self.controller is not None:
+                    self.controller.release(host, time.monotonic() - t0, ok, probe)
+                self._account(stream)
+            await asyncio.sleep(self._backoff(attempt))
+
+    async def _download(self, session, url, label):
+        if not self.quota.reserve(label):
+            return
+        saved = False
+        self._attempt(url)
+        loop = asyncio.get_running_loop()
+        try:
+            try:
+                stream = await self._fetch(session, url, label)
+                if stream is None:
+                    log(f"[CANCEL] {url} ({label} ya completo)")
+                    self._failed(url, "cancelled")
+                    self._count("cancelled")
+                    return
+                b, w, h, hsh = await loop.run_in_executor(self.executor, self._finish, stream)
+            except Rejected as e:
+                log(f"[SKIP] {url} ({e})")
+                self._failed(url, e)
+                self._count("skipped")
+                return
+            except HostUnavailable as e:
+                delay = self._deferred(url, e)
+                log(f"[HOST] {url} ({e}){'' if delay is None else f', reintento en {delay:.0f}s'}")
+                if delay is not None:
+                    # cuenta como encolada desde ya: empty() no da True mientras espera
+                    with self.stats_lock:
+                        self.queued += 1
+                    loop.call_later(delay, self.q.put_nowait, (url, label))
+                return
+            except Exception as e:
+                log(f"[ERROR] descargar {url}: {e!r}")
+                self._failed(url, repr(e))
+                self._count("error")
+                return
+            saved = True
+            await loop.run_in_executor(self.executor, self._save, label, url, b, w, h, hsh)
+        finally:
+            if not saved:
+                self.quota.release(label)
@@ -0,0 +1,193 @@
+"""
+etl_manifest.py
+
+Persistent manifest for incremental ETL runs (etl_pipeline.py --incremental).
+
+One SQLite row per source image, keyed on src_path and carrying the size,
+mtime and sha256 of the source plus the outcome of its last transform
+(status, dst_path and the metadata_processed.csv columns). Multi-size runs
+(--sizes) also keep the size spec and the [dst_path, sha256] of every extra
+variant (JSON in the extra column).
+
+- check(): tells whether one extracted task is unchanged since the last run;
+  the streaming extract stage calls it per file, plan() does a whole list.
+- prune(): finds manifest entries whose source disappeared (or was quarantined).
+- tasks(): yields the known sources, so a run can use the manifest as its work list.
+- record(): called by the writer after an output is saved; commits every
+  COMMIT_EVERY records so a crash only loses the tail of the run, which is
+  simply reprocessed next time.
+- export_rows(): yields the rows to rebuild metadata_processed.csv from.
+"""
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+
+COMMIT_EVERY = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    src_path   TEXT PRIMARY KEY,
+    label      TEXT NOT NULL,
+    size       INTEGER NOT NULL,
+    mtime_ns   INTEGER NOT NULL,
+    src_sha256 TEXT,
+    status     TEXT NOT NULL,
+    resized    INTEGER,
+    dst_path   TEXT,
+    width      INTEGER,
+    height     INTEGER,
+    sha256     TEXT,
+    phash      TEXT,
+    spec       TEXT,
+    extra      TEXT
+)
+"""
+# columns added after the first release, created on older manifests
+ADDED_COLUMNS = {"spec": "TEXT", "extra": "TEXT"}
+
+def _sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class Manifest:
+    def __init__(self, path: str):
+        self.path = path
+        # the thread executor records from several worker threads
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(SCHEMA)
+        have = {row[1] for row in self.conn.execute("PRAGMA table_info(files)")}
+        for name, decl in ADDED_COLUMNS.items():
+            if name not in have:
+                self.conn.execute(f"ALTER TABLE files ADD COLUMN {name} {decl}")
+        self.conn.commit()
+        self.lock = threading.Lock()
+        self.stats = {}      # src_path -> (size, mtime_ns) captured by check(), until record()
+        self.uncommitted = 0
+
+    def check(self, task, size: int, st=None, spec=None) -> bool:
+        """Return True when task is unchanged since the last run and can be skipped.
+
+        A task is unchanged when its last run used the same target size (and --sizes spec) and the
+        source has the same size+mtime, or the same sha256 (touched but identical).
+        Sources that are going to be reprocessed get their old output removed so a
+        modified source replaces it instead of colliding with it. st is the source's
+        os.stat() result when the caller already has it (os.scandir DirEntry.stat()).
+        """
+        src_path = task[0]
+        if st is None:
+            st = os.stat(src_path)
+        with self.lock:
+            prev = self.conn.execute("SELECT size, mtime_ns, src_sha256, resized, dst_path, spec, extra "
+                                     "FROM files WHERE src_path=?", (src_path,)).fetchone()
+            if prev is not None and prev[3] == size and prev[5] == spec:
+                old_size, old_mtime, old_sha = prev[0], prev[1], prev[2]
+                if (old_size, old_mtime) == (st.st_size, st.st_mtime_ns):
+                    return True
+                if old_size == st.st_size and old_sha and _sha256_file(src_path) == old_sha:
+                    self.conn.execute("UPDATE files SET mtime_ns=? WHERE src_path=?",
+                                      (st.st_mtime_ns, src_path))
+                    self._wrote()
+                    return True
+            self.stats[src_path] = (st.st_size, st.st_mtime_ns)
+        if prev is not None:
+            self._remove_outputs(prev[4], prev[6])
+        return False
+
+    def plan(self, tasks, size: int):
+        """Return (todo, unchanged) task lists (check() over a whole list)."""
+        todo, unchanged = [], []
+        for task in tasks:
+            (unchanged if self.check(task, size) else todo).append(task)
+        return todo, unchanged
+
+    def prune(self, src_dir: str, quarantined=()) -> int:
+        """Drop entries (and their outputs) under src_dir whose source no longer exists or is quarantined.
+
+        quarantined holds paths relative to src_dir, as in a check_corrupt.py report.
+        """
+        prefix = os.path.join(src_dir, "")
+        stale = [(src, dst, extra) for src, dst, extra in self._read(
+                     "SELECT src_path, dst_path, extra FROM files WHERE substr(src_path, 1, ?) = ?",
+                     (len(prefix), prefix))
+                 if not os.path.exists(src) or os.path.relpath(src, src_dir) in quarantined]
+        with self.lock:
+            for src, dst, extra in stale:
+                self._remove_outputs(dst, extra)
+                self.conn.execute("DELETE FROM files WHERE src_path=?", (src,))
+            self.conn.commit()
+        return len(stale)
+
+    def tasks(self):
+        """Yield (src_path, label) for every source in the manifest, in path order."""
+        yield from self._read("SELECT src_path, label FROM files ORDER BY src_path")
+
+    def _read(self, sql, params=()):
+        # stream from a second connection: WAL gives it a snapshot, so the writer can keep
+        # recording on self.conn while the rows are consumed one at a time
+        with self.lock:
+            self.conn.commit()
+            self.uncommitted = 0
+        conn = sqlite3.connect(self.path)
+        try:
+            yield from conn.execute(sql, params)
+        finally:
+            conn.close()
+
+    def record(self, result: dict, dst_path, resized: int, extra=(), spec=None):
+        """extra: [(dst_path, sha256)] of the variants after the first one (--sizes)."""
+        src_path = result["src_path"]
+        with self.lock:
+            size, mtime_ns = self.stats.pop(src_path, None) or (0, 0)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files (src_path, label, size, mtime_ns, src_sha256, status, resized, "
+                "dst_path, width, height, sha256, phash, spec, extra) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                (src_path, result["label"], size, mtime_ns, result.get("src_sha256"), result["status"],
+                 resized, dst_path, result.get("width"), result.get("height"),
+                 result.get("sha256"), result.get("phash"), spec, json.dumps(list(extra)) if extra else None))
+            self._wrote()
+
+    def _wrote(self):
+        # called with self.lock held
+        self.uncommitted += 1
+        if self.uncommitted >= COMMIT_EVERY:
+            self.conn.commit()
+            self.uncommitted = 0
+
+    def export_rows(self):
+        """Yield the metadata_processed rows of every successfully processed entry.
+
+        Extra variants are appended to the row as dst_path, sha256 pairs.
+        """
+        with self.lock:
+            self.conn.commit()
+            self.uncommitted = 0
+        for row in self.conn.execute(
+                "SELECT dst_path, label, width, height, resized, sha256, phash, src_path, extra "
+                "FROM files WHERE status='ok' ORDER BY dst_path"):
+            yield list(row[:8]) + [v for pair in json.loads(row[8] or "[]") for v in pair]
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+    @classmethod
+    def _remove_outputs(cls, dst_path, extra):
+        cls._remove_output(dst_path)
+        for extra_path, _ in json.loads(extra or "[]"):
+            cls._remove_output(extra_path)
+
+    @staticmethod
+    def _remove_output(dst_path):
+        if dst_path and os.path.exists(dst_path):
+            try:
+                os.remove(dst_path)
+            except OSError as e:
+                print(f"[MANIFEST] could not remove {dst_path}: {e}")
@@ -3,36 +3,102 @@
 etl_pipeline.py
 
 ETL pipeline for the dataset:
-- EXTRACT: build task queue from current dataset/ folders or metadata.csv
-- TRANSFORM: multithreaded image validation, normalization (RGB), resize to 256x256,
-             compute sha256, optionally compute small perceptual hash,
-             and save to dataset_preprocessed/
+- EXTRACT: a producer thread streams tasks from the dataset/ folders (os.scandir) or from
+           a work list (--worklist metadata.csv or an etl_manifest.sqlite) into a bounded
+           queue, dropping files listed in a check_corrupt.py quarantine report (--quarantine)
+- TRANSFORM: multithreaded image validation, normalization (RGB), resize to 256x256
+             (or to every --sizes variant from the same decode), compute sha256,
+             optionally compute small perceptual hash, and save to dataset_preprocessed/
 - LOAD: write metadata_processed.csv and prepare dataset_split/ (optional separate script)
+- PACK: optionally also write packed training shards (--pack tar,memmap, see pack_shards.py)
+- MERGE: combine the metadata of a sharded run into one sorted file (merge subcommand)
 
 Usage:
     python3 etl_pipeline.py --workers 8 --maxsim 4 --size 256
+    python3 etl_pipeline.py --executor process --workers 32 --batch 16
+    python3 etl_pipeline.py --worklist metadata.csv
+    python3 etl_pipeline.py --sizes 224,256,96:webp
+    python3 etl_pipeline.py --size 224 --pack tar,memmap
+    python3 etl_pipeline.py --shard-index 2 --num-shards 8     # on each node, index 0..7
+    python3 etl_pipeline.py merge --num-shards 8 --check-src
 
 Notes:
-- Designed for I/O-bound workload: uses threading + Queue.
-- Uses a Semaphore (maxsim) to limit simultaneous open-image operations to avoid IO thrash.
-- Uses Lock to protect metadata writes and counters (mutex).
+- Default executor (thread) is designed for I/O-bound workload: uses threading + Queue.
+- Extraction never builds the full task list: transforms start as soon as the first file
+  is found, and the queue holds at most --queue-size tasks (put() blocks when it is full),
+  so memory stays flat however many files there are.
+- The process executor runs the CPU-bound transform (decode, resize, JPEG encode,
+  sha256, phash) in a ProcessPoolExecutor over batches of paths; workers return
+  encoded bytes + metadata and a single writer in the parent saves them.
+- Uses a Semaphore (maxsim) to limit simultaneous open-image operations to avoid IO thrash
+  (shared across processes in process mode).
+- Metadata rows go through a MetadataSink (metadata_sink.py): one writer thread batches
+  them to CSV, Parquet or SQLite (--metaformat), so workers never wait on a metadata lock.
+- Uses Lock to protect counters (mutex).
+- Prints images/sec at the end so both executors can be compared.
+- Large JPEGs are decoded at a reduced DCT scale before the LANCZOS resize
+  (image_resize.py); --exact-resize restores the full-decode path.
+- --codec picks the decode/resize/encode backend (image_codec.py): pillow (default),
+  opencv or turbojpeg.
+- --sizes SIZE[:FORMAT],... (FORMAT jpeg, png or webp; default jpeg) decodes each source
+  once and writes every variant to its own tree: the first one to --dst/<label>/ as
+  without --sizes (what split_dataset.py reads by default), each of the others to a
+  sibling tree --dst_<size>[_<format>]/<label>/ (e.g. dataset_preprocessed_96_webp/).
+  The metadata keeps one row per source: the usual columns describe the first variant and
+  dst_path_<tag>, sha256_<tag> columns are appended for each of the others.
+- --pack tar,memmap also writes the first variant to --pack-dir as WebDataset tar shards
+  and/or a uint8 memmap (pack_shards.py), already split into train/val/test with
+  split_dataset.subset_for(source sha256), so training can skip the per-file tree entirely.
+  classes.json lists every label folder of --src. Not with --num-shards > 1 (merge does
+  not combine packs): run pack_shards.py convert on the merged result instead.
+- --shard-index/--num-shards split the sources by a stable hash of label/filename, so
+  nodes sharing one dataset (e.g. over NFS) each process a disjoint part. Images go to
+  the shared --dst tree; metadata (and the --incremental manifest) go to per-shard files
+  (metadata_processed.shard-00002-of-00008.csv) plus a .done.json marker with the
+  shard's counts. merge checks every shard finished and accounted for its rows, resolves
+  sources or outputs reported twice, and writes the rows sorted by dst_path: the merged
+  file is byte-identical whatever the number of shards.
+- --incremental keeps a SQLite manifest (etl_manifest.py) keyed on source path, size,
+  mtime and sha256: unchanged sources are skipped, modified ones reprocessed, outputs of
+  deleted sources removed, and metadata_processed.csv is rebuilt from the manifest.
 """
 import os
+import sys
+import csv
+import json
+import shutil
 import argparse
+import tempfile
+import numpy as np
 import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from queue import Queue
 from PIL import Image
 import hashlib
-from io import BytesIO
-import csv
 import time
+from etl_manifest import Manifest
+from metadata_sink import open_sink, backend_for_path, read_rows, BACKENDS, BATCH_SIZE
+from image_codec import get_codec, CODECS
+from near_dupes import dhash_batch, hash_to_hex
+from check_corrupt import load_quarantine
+from label_quota import LabelQuota
+from split_dataset import subset_for
+from pack_shards import PackWriter, label_folders, FORMATS as PACK_FORMATS
 
 # ---------- CONFIG ----------
 SRC_DIR = "dataset"               # source raw images (already deduped)
 DST_DIR = "dataset_preprocessed"  # output normalized images
 META_OUT = "metadata_processed.csv"
+MANIFEST = "etl_manifest.sqlite"
+META_HEADER = ["dst_path","label","orig_width","orig_height","resized","sha256","phash","src_path"]
 MIN_WIDTH = 32
 MIN_HEIGHT = 32
+QUEUE_SIZE = 1024                 # max tasks extracted ahead of the transforms
+# --sizes formats -> file extension (None keeps the source file name); encoded by the codec
+VARIANT_FORMATS = {"jpeg": None, "png": ".png", "webp": ".webp"}
+PACK_EXT = {"jpeg": "jpg", "png": "png", "webp": "webp"}  # tar member extension per format
+PACK_DIR = "dataset_packed"
 
 # ---------- HELPERS ----------
 def sha256_bytes_data(b: bytes) -> str:
@@ -47,179 +113,616 @@ def compute_sha256_file(path: str) -> str:
             h.update(chunk)
     return h.hexdigest()
 
-# optional simple perceptual-ish hash (dHash-like small)
+# optional simple perceptual-ish hash (dHash-like small); vectorized in near_dupes.py
 def quick_phash(img: Image.Image, hash_size=8) -> str:
-    # convert to grayscale and resize
-    img = img.convert("L").resize((hash_size+1, hash_size), Image.LANCZOS)
-    pixels = list(img.getdata())
-    # compare columns
-    diff = []
-    for row in range(hash_size):
-        for col in range(hash_size):
-            left = pixels[row * (hash_size+1) + col]
-            right = pixels[row * (hash_size+1) + col + 1]
-            diff.append(1 if left > right else 0)
-    # pack to hex
-    value = 0
-    for bit in diff:
-        value = (value << 1) | bit
-    return format(value, 'x')
-# ---------- Worker ----------
-def worker_thread(q: Queue, sem: threading.Semaphore, meta_lock: threading.Lock, args):
-    while True:
-        item = q.get()
-        if item is None:
-            q.task_done()
-            break
-        src_path, label = item
-        rel_path = os.path.relpath(src_path)
+    return hash_to_hex(dhash_batch([img], hash_size)[0])
+
+# ---------- VARIANTS ----------
+def parse_sizes(spec: str) -> list:
+    """'224,256,96:webp' -> [(224, 'jpeg'), (256, 'jpeg'), (96, 'webp')]"""
+    variants = []
+    for item in spec.split(","):
+        size, _, fmt = item.strip().partition(":")
+        fmt = (fmt or "jpeg").lower()
+        if fmt == "jpg":
+            fmt = "jpeg"
+        if fmt not in VARIANT_FORMATS:
+            raise ValueError(f"unknown format {fmt!r} in --sizes (choose from {', '.join(VARIANT_FORMATS)})")
+        if (int(size), fmt) in variants:
+            raise ValueError(f"{item!r} appears twice in --sizes")
+        variants.append((int(size), fmt))
+    return variants
+
+def variant_tag(size: int, fmt: str) -> str:
+    return str(size) if fmt == "jpeg" else f"{size}_{fmt}"
+
+def meta_header(args) -> list:
+    """META_HEADER plus a dst_path/sha256 column pair for every variant after the first."""
+    return META_HEADER + [f"{col}_{variant_tag(size, fmt)}"
+                          for size, fmt in args.variants[1:] for col in ("dst_path", "sha256")]
+
+# ---------- SHARDS ----------
+def shard_of(task, num_shards: int) -> int:
+    """Shard owning a (src_path, label) task: stable across runs, machines and mount points."""
+    src_path, label = task
+    key = os.path.join(label, os.path.basename(src_path)).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big") % num_shards
+
+def shard_path(path: str, index: int, num_shards: int) -> str:
+    """Per-shard name of an output file: metadata_processed.csv -> metadata_processed.shard-00002-of-00008.csv"""
+    if num_shards <= 1:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}.shard-{index:05d}-of-{num_shards:05d}{ext}"
+
+def done_path(meta_path: str) -> str:
+    return meta_path + ".done.json"
+
+# ---------- EXTRACT ----------
+def scan_source(src_dir: str):
+    """Yield ((src_path, label), DirEntry) for every file under src_dir/<label>/, in sorted order.
+
+    os.scandir returns the file type with each entry, so there is no isfile() stat per
+    file, and the DirEntry goes along so the manifest can reuse its cached stat().
+    Only the listing of the current label folder is held in memory.
+    """
+    with os.scandir(src_dir) as it:
+        labels = sorted(entry.name for entry in it if entry.is_dir())
+    for label in labels:
+        with os.scandir(os.path.join(src_dir, label)) as it:
+            entries = sorted((entry for entry in it if entry.is_file()), key=lambda entry: entry.name)
+        for entry in entries:
+            yield (entry.path, label), entry
+
+def read_worklist(path: str, src_dir: str):
+    """Yield ((src_path, label), None) from a work list instead of walking src_dir.
+
+    - *.sqlite / *.db: an etl_manifest.py manifest (every source it has seen)
+    - otherwise a CSV: the scraper's metadata.csv (filename, label -> src_dir/<label folder>/filename)
+      or any CSV with src_path and label columns
+    """
+    if path.endswith((".sqlite", ".db")):
+        manifest = Manifest(path)
         try:
-            # Limit concurrent heavy I/O ops (control file descriptors)
-            sem.acquire()
+            for task in manifest.tasks():
+                yield task, None
+        finally:
+            manifest.close()
+        return
+    with open(path, newline="", encoding="utf-8") as f:
+        # metadata.csv starts with a comment line and a blank line before the header
+        for row in csv.DictReader(line for line in f if line.strip() and not line.startswith("#")):
+            if row.get("src_path"):
+                yield (row["src_path"], row["label"]), None
+            else:
+                folder = LabelQuota.folder(row["label"])
+                yield (os.path.join(src_dir, folder, row["filename"]), folder), None
+
+def extract_tasks(args, quarantined, counts: dict, manifest=None):
+    """EXTRACT: lazily yield the (src_path, label) tasks to transform.
+
+    counts gets the quarantined / unchanged / missing / enqueued totals as it goes
+    (of this shard's files only, when the run is sharded).
+    """
+    source = read_worklist(args.worklist, args.src) if args.worklist else scan_source(args.src)
+    for task, entry in source:
+        if args.num_shards > 1 and shard_of(task, args.num_shards) != args.shard_index:
+            continue
+        src_path, label = task
+        if quarantined and os.path.join(label, os.path.basename(src_path)) in quarantined:
+            counts["quarantined"] += 1
+            continue
+        if manifest is not None:
             try:
-                with Image.open(src_path) as im:
-                    im.load()  # ensure loaded
-                    im_rgb = im.convert("RGB")
-            finally:
-                sem.release()
+                unchanged = manifest.check(task, args.size, entry.stat() if entry is not None else None,
+                                           args.sizes)
+            except FileNotFoundError:
+                # listed in the work list but gone from disk
+                counts["missing"] += 1
+                continue
+            if unchanged:
+                counts["unchanged"] += 1
+                continue
+        counts["enqueued"] += 1
+        yield task
+        if args.limit and counts["enqueued"] >= args.limit:
+            return
+
+class Producer(threading.Thread):
+    """Run the extract generator on its own thread, feeding a bounded Queue.
+
+    put() blocks while the queue is full, so extraction stays at most maxsize tasks
+    ahead of the transforms; n_stop None sentinels mark the end of the stream.
+    """
+
+    def __init__(self, tasks, maxsize: int, n_stop: int):
+        super().__init__(daemon=True)
+        self.tasks = tasks
+        self.queue = Queue(maxsize=maxsize)
+        self.n_stop = n_stop
+        self.error = None
+
+    def run(self):
+        try:
+            for task in self.tasks:
+                self.queue.put(task)
         except Exception as e:
-            # corrupt or unreadable
-            print(f"[SKIP][ERROR] {rel_path} -> {e}")
-            q.task_done()
-            continue
+            # re-raised by the main thread once the consumers have drained what was queued
+            self.error = e
+        finally:
+            for _ in range(self.n_stop):
+                self.queue.put(None)
 
-        # Validate size
-        w,h = im_rgb.size
-        if w < args.minsize or h < args.minsize:
-            print(f"[SKIP][TOO_SMALL] {rel_path} ({w}x{h})")
-            q.task_done()
-            continue
+# ---------- TRANSFORM ----------
+def transform_image(src_path: str, label: str, args, sem=None) -> dict:
+    """Decode, validate, resize and encode one image (args: variants, minsize, exact_resize, codec).
 
-        # Transform: resize to target
+    The source is decoded once and every (size, format) variant is resized and encoded
+    from that decode: data/sha256 are the first variant's, extra holds (data, sha256)
+    of the others. Never raises: failures are returned as {"status": "error"|"too_small", ...}
+    so the result can travel back from a worker process and be reported by the writer.
+    """
+    result = {"src_path": src_path, "label": label}
+    try:
+        # Limit concurrent heavy I/O ops (control file descriptors)
+        if sem is not None:
+            sem.acquire()
         try:
-            im_resized = im_rgb.resize((args.size, args.size), Image.LANCZOS)
-            out_folder = os.path.join(DST_DIR, label)
-            os.makedirs(out_folder, exist_ok=True)
-            # filename: keep original name to traceability
-            filename = os.path.basename(src_path)
-            dst_path = os.path.join(out_folder, filename)
-            # Save to bytes first to compute sha256
-            buf = BytesIO()
-            im_resized.save(buf, format="JPEG", quality=90)
-            b = buf.getvalue()
-            sha = sha256_bytes_data(b)
-            phash = quick_phash(im_resized)
-            # write file (if exists with same sha skip)
-            if os.path.exists(dst_path):
-                # If file exists, check if same content
-                existing_sha = compute_sha256_file(dst_path)
-                if existing_sha == sha:
-                    print(f"[DUP_DEST] already exists identical: {dst_path}")
-                    # still record metadata but skip overwrite
-                    pass
-                else:
-                    # create unique filename
-                    base, ext = os.path.splitext(filename)
-                    dst_path = os.path.join(out_folder, f"{base}_{sha[:8]}{ext}")
-            with open(dst_path, "wb") as fo:
-                fo.write(b)
+            # read once: the same bytes give the source sha256 (manifest key) and the decode
+            with open(src_path, "rb") as f:
+                raw = f.read()
+            result["src_sha256"] = sha256_bytes_data(raw)
+            # fast path decodes JPEGs at a reduced DCT scale (see image_resize.py), big enough
+            # for the largest variant
+            codec = get_codec(args.codec, args.exact_resize)
+            draft_size = max(size for size, _ in args.variants)
+            im_rgb, (w, h) = codec.decode(raw, draft_size)
+        finally:
+            if sem is not None:
+                sem.release()
+    except Exception as e:
+        # corrupt or unreadable
+        result.update(status="error", reason=str(e))
+        return result
+
+    # Validate size (on the original dimensions, im_rgb may be a reduced decode)
+    result.update(width=w, height=h)
+    if w < args.minsize or h < args.minsize:
+        result["status"] = "too_small"
+        return result
+
+    try:
+        outputs = []
+        for size, fmt in args.variants:
+            im_resized = codec.resize(im_rgb, size)
+            if not outputs:
+                phash = quick_phash(codec.to_pil(im_resized))
+                if "memmap" in args.pack:
+                    result["pixels"] = np.asarray(codec.to_pil(im_resized))
+            # Encode to bytes first to compute sha256
+            b = codec.encode(im_resized, fmt)
+            outputs.append((b, sha256_bytes_data(b)))
+        (b, sha), extra = outputs[0], outputs[1:]
+        result.update(status="ok", data=b, sha256=sha, phash=phash, extra=extra)
+    except Exception as e:
+        result.update(status="error", reason=str(e))
+    return result
 
+# ---------- LOAD ----------
+def save_output(result: dict, dst_dir: str, data: bytes, sha: str, ext=None) -> str:
+    """Write one encoded image under dst_dir/<label>/ and return the final path."""
+    out_folder = os.path.join(dst_dir, result["label"])
+    os.makedirs(out_folder, exist_ok=True)
+    # filename: keep original name to traceability (ext swaps the extension for png/webp variants)
+    filename = os.path.basename(result["src_path"])
+    if ext:
+        filename = os.path.splitext(filename)[0] + ext
+    dst_path = os.path.join(out_folder, filename)
+    # write file (if exists with same sha skip)
+    if os.path.exists(dst_path):
+        # If file exists, check if same content
+        existing_sha = compute_sha256_file(dst_path)
+        if existing_sha == sha:
+            print(f"[DUP_DEST] already exists identical: {dst_path}")
+            # still record metadata but skip overwrite
+            return dst_path
+        # create unique filename
+        base, ext = os.path.splitext(filename)
+        dst_path = os.path.join(out_folder, f"{base}_{sha[:8]}{ext}")
+    with open(dst_path, "wb") as fo:
+        fo.write(data)
+    return dst_path
+
+def write_result(result: dict, args, stats_lock: threading.Lock, stats: dict, sink, manifest=None, packer=None):
+    """Report one transform result, save its output and queue its metadata row on the sink.
+
+    With a manifest the row goes to the manifest instead (the metadata file is rebuilt from it).
+    With a packer the first variant is also appended to the packed shards of its subset.
+    """
+    rel_path = os.path.relpath(result["src_path"])
+    status = result["status"]
+    dst_path = None
+    if status == "error":
+        print(f"[SKIP][ERROR] {rel_path} -> {result['reason']}")
+    elif status == "too_small":
+        print(f"[SKIP][TOO_SMALL] {rel_path} ({result['width']}x{result['height']})")
+    else:
+        try:
+            dst_path = save_output(result, args.dst_dirs[0], result["data"], result["sha256"],
+                                   VARIANT_FORMATS[args.variants[0][1]])
+            extra = []
+            for (size, fmt), out_dir, (data, sha) in zip(args.variants[1:], args.dst_dirs[1:], result["extra"]):
+                extra.append((os.path.relpath(save_output(result, out_dir, data, sha, VARIANT_FORMATS[fmt])), sha))
         except Exception as e:
             print(f"[ERROR_SAVE] {rel_path} -> {e}")
-q.task_done()
+            status = "error"
+        else:
+            dst_path = os.path.relpath(dst_path)
+            if manifest is not None:
+                manifest.record(result, dst_path, args.size, extra, args.sizes)
+            else:
+                sink.write([dst_path, result["label"], result["width"], result["height"],
+                            args.size, result["sha256"], result["phash"], result["src_path"]]
+                           + [v for pair in extra for v in pair])
+            if packer is not None:
+                # split keyed on the source bytes, like split_dataset.py: reprocessing with
+                # another codec/size must not move an image between train/val/test
+                packer.add(subset_for(result["src_sha256"]), result["label"], dst_path, result["sha256"],
+                           result["data"], result.get("pixels"), PACK_EXT[args.variants[0][1]])
+            print(f"[OK] {result['label']} <- {dst_path} (sha={result['sha256'][:8]})")
+    if manifest is not None and result["status"] != "ok":
+        # remember failures too, so unchanged bad files are not retried every run
+        manifest.record(result, None, args.size, spec=args.sizes)
+    with stats_lock:
+        stats[status] = stats.get(status, 0) + 1
+
+# ---------- Worker ----------
+def worker_thread(q: Queue, sem: threading.Semaphore, stats_lock: threading.Lock, stats: dict, args,
+                  sink, manifest=None, packer=None):
+    while True:
+        item = q.get()
+        if item is None:
+            break
+        src_path, label = item
+        result = transform_image(src_path, label, args, sem)
+        write_result(result, args, stats_lock, stats, sink, manifest, packer)
+
+# semaphore inherited by each pool process (set by _init_process_worker)
+_process_sem = None
+
+def _init_process_worker(sem):
+    global _process_sem
+    _process_sem = sem
+
+def transform_batch(batch, args) -> list:
+    return [transform_image(src_path, label, args, _process_sem) for src_path, label in batch]
+
+def run_threads(producer: Producer, args, stats_lock: threading.Lock, stats: dict, sink, manifest=None,
+                packer=None):
+    # Start workers (the producer ends the stream with one None per worker)
+    sem = threading.Semaphore(args.maxsim)
+    workers = []
+    for i in range(args.workers):
+        t = threading.Thread(target=worker_thread,
+                             args=(producer.queue, sem, stats_lock, stats, args, sink, manifest, packer),
+                             daemon=True)
+        t.start()
+        workers.append(t)
+    producer.start()
+
+    # Wait until done
+    for t in workers:
+        t.join()
+
+def run_processes(producer: Producer, args, stats_lock: threading.Lock, stats: dict, sink, manifest=None,
+                  packer=None):
+    sem = multiprocessing.Semaphore(args.maxsim)
+    # keep a bounded number of batches in flight so encoded bytes don't pile up in memory;
+    # while we wait on them the producer blocks on its full queue
+    max_pending = args.workers * 2
+    pending = set()
+
+    def drain(futures):
+        for fut in futures:
+            for result in fut.result():
+                write_result(result, args, stats_lock, stats, sink, manifest, packer)
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_process_worker,
+                             initargs=(sem,)) as pool:
+        producer.start()
+        batch = []
+        while True:
+            task = producer.queue.get()
+            if task is not None:
+                batch.append(task)
+            if batch and (task is None or len(batch) >= args.batch):
+                pending.add(pool.submit(transform_batch, batch, args))
+                batch = []
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    drain(done)
+            if task is None:
+                break
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            drain(done)
+
+# ---------- MERGE ----------
+def write_metadata(path: str, rows, meta_format: str, header=META_HEADER) -> int:
+    """Rewrite a whole metadata file atomically; returns the number of rows written.
+
+    Rows go in fixed-size batches straight to the backend (no timed flushes), so the
+    bytes only depend on the rows. The file is built in a temp dir under its final
+    basename (the sqlite backend names its table after it) and then swapped in.
+    """
+    out_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        tmp = os.path.join(out_dir, os.path.basename(path))
+        backend = BACKENDS[meta_format](tmp, header)
+        n = 0
+        batch = []
+        for row in rows:
+            batch.append(list(row))
+            if len(batch) >= BATCH_SIZE:
+                backend.write_rows(batch)
+                n += len(batch)
+                batch = []
+        if batch:
+            backend.write_rows(batch)
+            n += len(batch)
+        backend.close()
+        os.replace(tmp, path)
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    return n
+
+def merge(args) -> int:
+    """Combine the per-shard metadata files into args.metaout, sorted by dst_path.
+
+    Returns the number of problems found; the merged file is only written when there
+    are none (or with --force).
+    """
+    dst_col, label_col, sha_col, src_col = (META_HEADER.index(c) for c in ("dst_path", "label", "sha256", "src_path"))
+    n = args.num_shards
+    meta_format = args.metaformat or backend_for_path(args.metaout)
+    problems = 0
+    files_seen = 0
+    header = None
+    by_src = {}   # src_path -> (owned by the shard it came from, row)
+    duplicates = 0
+    for k in range(n):
+        path = shard_path(args.metaout, k, n)
+        if not os.path.exists(path):
+            print(f"[MERGE][MISSING] shard {k}: {path}")
+            problems += 1
             continue
+        marker = None
+        if os.path.exists(done_path(path)):
+            with open(done_path(path), encoding="utf-8") as f:
+                marker = json.load(f)
+        if marker is None or marker.get("num_shards") != n:
+            print(f"[MERGE][INCOMPLETE] shard {k} did not finish a {n}-shard run ({done_path(path)})")
+            problems += 1
+        elif header is not None and marker.get("header", META_HEADER) != header:
+            print(f"[MERGE][MISMATCH] shard {k} has different columns (another --sizes?): {marker.get('header')}")
+            problems += 1
+        elif marker.get("limit"):
+            print(f"[MERGE][INCOMPLETE] shard {k} ran with --limit {marker['limit']}")
+            problems += 1
+        rows = 0
+        for row in read_rows(path, meta_format):
+            rows += 1
+            src_path = row[src_col]
+            owned = n <= 1 or shard_of((src_path, row[label_col]), n) == k
+            prev = by_src.get(src_path)
+            if prev is None or (owned and not prev[0]):
+                by_src[src_path] = (owned, row)
+            if prev is not None:
+                duplicates += 1
+            if not owned:
+                print(f"[MERGE][FOREIGN] shard {k} has {src_path} (hashed to another shard: mismatched --num-shards?)")
+        if marker is not None:
+            header = header or marker.get("header", META_HEADER)
+            files_seen += sum(marker["counts"].get(c, 0) for c in ("quarantined", "unchanged", "enqueued"))
+            if rows != marker.get("rows"):
+                print(f"[MERGE][INCOMPLETE] shard {k}: {rows} rows in {path}, {marker.get('rows')} written")
+                problems += 1
+    if duplicates:
+        print(f"[MERGE][CONFLICT] {duplicates} sources reported by more than one shard (kept the owning shard's row)")
+
+    # two sources saved to the same file: only the one whose bytes are on disk survived
+    by_dst = {}
+    for owned, row in by_src.values():
+        by_dst.setdefault(row[dst_col], []).append(row)
+    merged = []
+    for dst_path, rows in by_dst.items():
+        if len(rows) > 1:
+            on_disk = compute_sha256_file(dst_path) if os.path.exists(dst_path) else None
+            rows.sort(key=lambda row: (row[sha_col] != on_disk, str(row[src_col])))
+            for lost in rows[1:]:
+                print(f"[MERGE][CONFLICT] {dst_path}: output of {lost[src_col]} was overwritten by {rows[0][src_col]}")
+                problems += 1
+        merged.append(rows[0])
 
-        # Update metadata under lock
-        with meta_lock:
-            with open(META_OUT, "a", newline="", encoding="utf-8") as mf:
-                writer = csv.writer(mf)
-                writer.writerow([os.path.relpath(dst_path), label, w, h, args.size, sha, phash, src_path])
-        print(f"[OK] {label} <- {os.path.relpath(dst_path)} (sha={sha[:8]})")
-        q.task_done()
+    if args.check_src:
+        expected = sum(1 for _ in scan_source(args.src))
+        if expected != files_seen:
+            print(f"[MERGE][INCOMPLETE] {args.src} has {expected} files, the shards accounted for {files_seen}")
+            problems += 1
+
+    if problems and not args.force:
+        print(f"[MERGE] {problems} problems, {args.metaout} not written (--force to write it anyway)")
+        return problems
+
+    merged.sort(key=lambda row: (str(row[dst_col]), str(row[src_col])))
+    write_metadata(args.metaout, merged, meta_format, header or META_HEADER)
+    print(f"[MERGE] {len(merged)} rows from {n} shards -> {args.metaout} ({problems} problems)")
+    return problems
+
+def merge_main(argv):
+    parser = argparse.ArgumentParser(prog="etl_pipeline.py merge",
+                                     description="merge the metadata files of a sharded ETL run")
+    parser.add_argument("--num-shards", type=int, required=True)
+    parser.add_argument("--metaout", type=str, default=META_OUT, help="merged metadata file (shards are named after it)")
+    parser.add_argument("--metaformat", choices=("csv", "parquet", "sqlite"), default=None,
+                        help="metadata backend (default: from the --metaout extension, else csv)")
+    parser.add_argument("--src", type=str, default=SRC_DIR, help="source dataset folder (for --check-src)")
+    parser.add_argument("--check-src", action="store_true",
+                        help="also check that the shards together accounted for every file under --src")
+    parser.add_argument("--force", action="store_true", help="write the merged file even if problems were found")
+    args = parser.parse_args(argv)
+    return 1 if merge(args) else 0
 
 # ---------- MAIN ----------
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "merge":
+        sys.exit(merge_main(sys.argv[2:]))
     parser = argparse.ArgumentParser(description="ETL pipeline: extract -> transform (multithread) -> load")
-    parser.add_argument("--workers", type=int, default=8, help="number of worker threads")
+    parser.add_argument("--workers", type=int, default=8, help="number of worker threads (or processes)")
     parser.add_argument("--maxsim", type=int, default=4, help="semaphore: max simultaneous image open/save")
+    parser.add_argument("--executor", choices=("thread", "process"), default="thread",
+                        help="run the transform stage on threads or on a process pool")
+    parser.add_argument("--batch", type=int, default=16, help="paths per task in process mode")
     parser.add_argument("--size", type=int, default=256, help="resize target (square)")
+    parser.add_argument("--sizes", type=str, default=None,
+                        help="several targets from one decode, e.g. 224,256,96:webp (the first in --dst, "
+                             "the others in --dst_<size>[_<format>]; overrides --size)")
     parser.add_argument("--minsize", type=int, default=MIN_WIDTH, help="min width/height to accept")
+    parser.add_argument("--exact-resize", action="store_true",
+                        help="disable the reduced-scale JPEG decode + reducing_gap fast path (bit-exact output)")
+    parser.add_argument("--codec", choices=tuple(CODECS), default="pillow",
+                        help="image decode/resize/encode backend (image_codec.py)")
     parser.add_argument("--src", type=str, default=SRC_DIR, help="source dataset folder")
     parser.add_argument("--dst", type=str, default=DST_DIR, help="destination preprocessed folder")
-    parser.add_argument("--metaout", type=str, default=META_OUT, help="output metadata CSV")
+    parser.add_argument("--metaout", type=str, default=META_OUT, help="output metadata file")
+    parser.add_argument("--metaformat", choices=("csv", "parquet", "sqlite"), default=None,
+                        help="metadata backend (default: from the --metaout extension, else csv)")
+    parser.add_argument("--worklist", type=str, default=None,
+                        help="take the files from metadata.csv (or a CSV with src_path,label) or an "
+                             "etl_manifest.sqlite instead of walking --src")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                        help="max tasks extracted ahead of the transforms (backpressure)")
     parser.add_argument("--limit", type=int, default=0, help="limit total files processed (0 = all)")
+    parser.add_argument("--quarantine", type=str, default=None,
+                        help="check_corrupt.py report: skip the files it lists without opening them")
+    parser.add_argument("--incremental", action="store_true",
+                        help="skip sources unchanged since the last run (tracked in --manifest)")
+    parser.add_argument("--manifest", type=str, default=MANIFEST, help="SQLite manifest for --incremental")
+    parser.add_argument("--pack", type=str, default="",
+                        help="also write packed training shards: tar, memmap or tar,memmap (pack_shards.py)")
+    parser.add_argument("--pack-dir", type=str, default=PACK_DIR, help="where --pack writes train/val/test")
+    parser.add_argument("--shard-index", type=int, default=0, help="which shard this node processes (0-based)")
+    parser.add_argument("--num-shards", type=int, default=1,
+                        help="split the sources across this many nodes; join them with the merge subcommand")
     args = parser.parse_args()
+    if not 0 <= args.shard_index < args.num_shards:
+        parser.error("--shard-index must be in [0, --num-shards)")
+    if args.sizes:
+        try:
+            args.variants = parse_sizes(args.sizes)
+        except ValueError as e:
+            parser.error(str(e))
+        # normalized, so the manifest sees the same spec however it was typed
+        args.sizes = ",".join(str(size) if fmt == "jpeg" else f"{size}:{fmt}" for size, fmt in args.variants)
+        args.size = args.variants[0][0]
+        # extra variants go next to --dst, not inside it: a folder in --dst is a label
+        dst = os.path.normpath(args.dst)
+        args.dst_dirs = [args.dst] + [f"{dst}_{variant_tag(size, fmt)}" for size, fmt in args.variants[1:]]
+    else:
+        args.variants = [(args.size, "jpeg")]
+        args.dst_dirs = [args.dst]
+    args.pack = tuple(f for f in args.pack.split(",") if f)
+    if set(args.pack) - set(PACK_FORMATS):
+        parser.error(f"--pack takes {', '.join(PACK_FORMATS)}")
+    if args.pack and args.incremental:
+        # an incremental run only sees the changed sources; pack the full tree instead
+        parser.error("--pack needs a full run; pack an incremental dataset with pack_shards.py convert")
+    if args.pack and args.num_shards > 1:
+        # merge does not combine packs: each shard would leave a partial pack of its own
+        parser.error("--pack needs a single-shard run; pack a sharded dataset with pack_shards.py convert")
+    try:
+        # fail now rather than once per image if the backend is not installed
+        get_codec(args.codec, args.exact_resize)
+    except RuntimeError as e:
+        parser.error(str(e))
 
     # Use local variables assigned from args (avoid globals)
     src_dir = args.src
     dst_dir = args.dst
-    meta_out = args.metaout
+    # a sharded run only owns its own metadata file and manifest
+    meta_out = shard_path(args.metaout, args.shard_index, args.num_shards)
+    args.manifest = shard_path(args.manifest, args.shard_index, args.num_shards)
 
     # Prepare output
     os.makedirs(dst_dir, exist_ok=True)
 
-    # Initialize metadata CSV (use the local meta_out path)
-    with open(meta_out, "w", newline="", encoding="utf-8") as mf:
-        w = csv.writer(mf)
-        w.writerow(["dst_path","label","orig_width","orig_height","resized","sha256","phash","src_path"])
-
-    # Build queue (EXTRACT)
-    q = Queue()
-    total = 0
-    for label in sorted(os.listdir(src_dir)):
-        label_dir = os.path.join(src_dir, label)
-        if not os.path.isdir(label_dir):
-            continue
-        for fn in sorted(os.listdir(label_dir)):
-            src_path = os.path.join(label_dir, fn)
-            if not os.path.isfile(src_path):
-                continue
-            q.put((src_path, label))
-            total += 1
-            if args.limit and total >= args.limit:
-                break
-        if args.limit and total >= args.limit:
-            break
-
-    print(f"[EXTRACT] Enqueued {total} files from {src_dir}")
+    # Initialize metadata output (use the local meta_out path); incremental runs rebuild it at the end
+    meta_format = args.metaformat or backend_for_path(meta_out)
+    sink = None
+    if not args.incremental:
+        sink = open_sink(meta_out, meta_header(args), backend=meta_format)
 
-    # Start workers
-    meta_lock = threading.Lock()
-    sem = threading.Semaphore(args.maxsim)
-    workers = []
-    for i in range(args.workers):
-        t = threading.Thread(target=worker_thread, args=(q, sem, meta_lock, args), daemon=True)
-        t.start()
- workers.append(t)
+    manifest = None
+    if args.incremental:
+        manifest = Manifest(args.manifest)
+    packer = None
+    if args.pack:
+        # classes from the --src label folders: a --limit / --worklist run may not see them all
+        classes = label_folders(args.src) if os.path.isdir(args.src) else None
+        packer = PackWriter(args.pack_dir, args.pack, args.size, classes=classes)
 
-    # Wait until done
-    q.join()
-    # stop workers
-    for _ in workers:
-        q.put(None)
-    for t in workers:
-        t.join(timeout=1)
+    # EXTRACT runs on the producer thread while the transforms consume its queue
+    quarantined = load_quarantine(args.quarantine)
+    counts = {"quarantined": 0, "unchanged": 0, "missing": 0, "enqueued": 0}
+    tasks = extract_tasks(args, quarantined, counts, manifest)
+    producer = Producer(tasks, args.queue_size, args.workers if args.executor == "thread" else 1)
 
-    print("[ETL] Completed.")
+    stats_lock = threading.Lock()
+    stats = {}
+    t0 = time.perf_counter()
+    if args.executor == "process":
+        run_processes(producer, args, stats_lock, stats, sink, manifest, packer)
+    else:
+        run_threads(producer, args, stats_lock, stats, sink, manifest, packer)
+    producer.join()
 
-    # Start workers
-    meta_lock = threading.Lock()
-    sem = threading.Semaphore(args.maxsim)
-    workers = []
-    for i in range(args.workers):
-        t = threading.Thread(target=worker_thread, args=(q, sem, meta_lock, args), daemon=True)
-        t.start()
-        workers.append(t)
+    if quarantined:
+        print(f"[EXTRACT] Skipped {counts['quarantined']} quarantined files ({args.quarantine})")
+    if counts["missing"]:
+        print(f"[EXTRACT] Skipped {counts['missing']} work list entries missing on disk")
+    shard = f" (shard {args.shard_index}/{args.num_shards})" if args.num_shards > 1 else ""
+    print(f"[EXTRACT] Enqueued {counts['enqueued']} files from {args.worklist or src_dir}{shard}")
 
-    # Wait until done
-    q.join()
-    # stop workers
-    for _ in workers:
-        q.put(None)
-    for t in workers:
-        t.join(timeout=1)
+    if manifest is not None:
+        # a --limit run (or a failed extract) only sees part of the tree, so it can't tell what was deleted
+        removed = 0 if args.limit or producer.error else manifest.prune(src_dir, quarantined)
+        print(f"[MANIFEST] {counts['unchanged']} unchanged, {counts['enqueued']} processed, {removed} removed")
+        # rebuild the metadata file from the manifest, then swap it in atomically
+        rows_written = write_metadata(meta_out, manifest.export_rows(), meta_format, meta_header(args))
+        manifest.close()
+    else:
+        sink.close()
+        rows_written = sink.rows_written
+    if packer is not None:
+        packed = packer.close()
+        print(f"[PACK] {', '.join(f'{s}={n}' for s, n in sorted(packed.items()))} -> {packer.out_dir} "
+              f"[{','.join(args.pack)}]")
+    elapsed = time.perf_counter() - t0
+    if producer.error is not None:
+        # outputs of the files extracted before the failure are saved and recorded
+        raise producer.error
+    # the marker merge checks for: the shard finished, with these counts
+    with open(done_path(meta_out), "w", encoding="utf-8") as f:
+        json.dump({"shard_index": args.shard_index, "num_shards": args.num_shards, "limit": args.limit,
+                   "worklist": args.worklist, "header": meta_header(args), "counts": counts, "stats": stats,
+                   "rows": rows_written},
+                  f, indent=2, sort_keys=True)
 
-    print("[ETL] Completed.")
+    done = sum(stats.values())
+    rate = done / elapsed if elapsed > 0 else 0.0
+    print(f"[ETL] Completed. {done} images in {elapsed:.2f}s -> {rate:.1f} img/s "
+          f"(executor={args.executor}, workers={args.workers}, ok={stats.get('ok', 0)}, "
+          f"too_small={stats.get('too_small', 0)}, error={stats.get('error', 0)})")
 
 if __name__ == "__main__":
     main()
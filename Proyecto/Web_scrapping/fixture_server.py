@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# fixture_server.py
+#
+# Servidor HTTP local que hace de "internet" para probar y medir el scraper sin red.
+#   GET /img/<n>.jpg   imagen JPEG de prueba (generada, determinista)
+#   GET /static/<ruta> archivo de --static (p. ej. páginas HTML grabadas en fixtures/)
+#                      en los .html se reemplaza {{BASE}} por la URL del servidor y
+#                      {{Q}} por el parámetro q de la petición
+# Con latencia configurable (+ jitter), tasa de errores HTTP 500 y HTTP/1.1 keep-alive.
+# Varios servidores en puertos distintos simulan hosts distintos.
+#
+# Uso:
+#   python3 fixture_server.py --port 8000 --latency 0.2 --error-rate 0.05
+#   from fixture_server import start_server; server, base = start_server(latency=0.1)
+import os
+import time
+import random
+import argparse
+import threading
+from io import BytesIO
+from urllib.parse import urlsplit, parse_qs, quote_plus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image, ImageDraw
+
+def make_images(n=16, size=(640, 480), seed=0, fmt="JPEG"):
+    """Imágenes de prueba distintas entre sí (y deterministas); JPEG q90 o PNG."""
+    rnd = random.Random(seed)
+    out = []
+    for i in range(n):
+        im = Image.new("RGB", size, tuple(rnd.randrange(256) for _ in range(3)))
+        d = ImageDraw.Draw(im)
+        for _ in range(12):
+            x0, y0 = rnd.randrange(size[0]), rnd.randrange(size[1])
+            d.rectangle([x0, y0, x0 + rnd.randrange(20, 200), y0 + rnd.randrange(20, 200)],
+                        fill=tuple(rnd.randrange(256) for _ in range(3)))
+        buf = BytesIO()
+        if fmt == "JPEG":
+            im.save(buf, format="JPEG", quality=90)
+        else:
+            im.save(buf, format=fmt)
+        out.append(buf.getvalue())
+    return out
+
+def make_mixed_images(seed=0):
+    """Mezcla como la de una búsqueda real: JPEGs normales, miniaturas, PNGs, fotos grandes y enormes."""
+    return (make_images(16, (640, 480), seed)            # sirven tal cual
+            + make_images(8, (150, 100), seed + 1)       # demasiado chicas
+            + make_images(4, (800, 600), seed + 2, "PNG")  # hay que reencodear
+            + make_images(4, (3000, 2000), seed + 3)     # grandes pero aceptables
+            + make_images(2, (9000, 6000), seed + 4))    # demasiados píxeles
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive: permite medir reutilización de conexiones
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code, body=b"", ctype="application/octet-stream"):
+        self.send_response(code)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        srv = self.server
+        delay = srv.latency + (random.uniform(-srv.jitter, srv.jitter) if srv.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+        with srv.lock:
+            srv.requests += 1
+        if srv.error_rate and random.random() < srv.error_rate:
+            return self._send(500, b"fixture error", "text/plain")
+        parts = urlsplit(self.path)
+        path = parts.path
+        if path.startswith("/img/"):
+            try:
+                n = int(os.path.splitext(os.path.basename(path))[0])
+            except ValueError:
+                return self._send(404)
+            return self._send(200, srv.images[n % len(srv.images)], "image/jpeg")
+        if path.startswith("/static/") and srv.static_dir:
+            rel = os.path.normpath(path[len("/static/"):]).lstrip(os.sep)
+            full = os.path.join(srv.static_dir, rel)
+            if os.path.isfile(full) and not rel.startswith(".."):
+                with open(full, "rb") as f:
+                    body = f.read()
+                if not full.endswith(".html"):
+                    return self._send(200, body)
+                q = parse_qs(parts.query).get("q", [""])[0]
+                body = body.replace(b"{{BASE}}", f"http://{self.headers.get('Host')}".encode()) \
+                           .replace(b"{{Q}}", quote_plus(q).encode())
+                return self._send(200, body, "text/html; charset=utf-8")
+        return self._send(404)
+
+def start_server(port=0, latency=0.0, jitter=0.0, error_rate=0.0, images=None, static_dir=None,
+                 host="127.0.0.1"):
+    """Arranca un servidor en un hilo daemon; devuelve (server, base_url). server.shutdown() lo para."""
+    server = ThreadingHTTPServer((host, port), FixtureHandler)
+    server.daemon_threads = True
+    server.request_queue_size = 1024
+    server.latency = latency
+    server.jitter = jitter
+    server.error_rate = error_rate
+    server.images = images or make_images()
+    server.static_dir = static_dir
+    server.lock = threading.Lock()
+    server.handle_error = lambda request, client_address: None  # clientes que cortan la conexión
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="servidor HTTP local con imágenes/HTML de prueba")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="segundos por respuesta")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fracción de respuestas 500")
+    parser.add_argument("--static", default=None, help="carpeta servida bajo /static/")
+    args = parser.parse_args()
+    server, base = start_server(args.port, args.latency, args.jitter, args.error_rate, static_dir=args.static)
+    print(f"[FIXTURE] sirviendo en {base}/img/<n>.jpg" + (f" y {base}/static/" if args.static else ""))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,226 @@
+# host_control.py
+#
+# Control adaptativo de concurrencia por host para downloaders.py.
+#
+# En lugar de un Semaphore global fijo (MAX_SIMULTANEOUS_DOWNLOADS) y un timeout fijo
+# (REQUEST_TIMEOUT), cada host tiene su propio estado:
+#   - límite de descargas simultáneas AIMD con slow start como TCP: +1 por respuesta
+#     (se duplica por ventana) hasta la primera señal de congestión, después +1 por ventana;
+#     /2 (como mucho una vez por RTT) ante errores, timeouts o cuando la latencia sube
+#     a más de latency_factor veces la mínima reciente del host (se está encolando).
+#     La referencia es la del propio host: uno lento pero estable no se penaliza.
+#   - token bucket: como mucho rate peticiones/s con ráfagas de burst
+#   - circuit breaker: tras failure_threshold fallos seguidos el host queda "abierto"
+#     open_seconds (se duplica en cada reapertura); al vencer se deja pasar una sola
+#     prueba (half-open) y si sale bien se cierra
+#   - timeout adaptativo estilo TCP: max(srtt + 4 * rttvar, 2 * srtt), acotado a
+#     [min_timeout, max_timeout]
+#
+# Lo usan los dos motores de descarga (ver downloaders.py, parámetro controller):
+#   wait, probe = controller.acquire(host)   # wait 0 -> adelante; > 0 -> reintentar en wait s
+#   ...                                      # HostUnavailable si el breaker está abierto
+#   controller.release(host, latency, ok, probe)
+#
+# probe es True solo para la petición de prueba del half-open: solo al liberarla a ella se
+# permite otra prueba, y solo su resultado cierra o reabre el breaker (una petición que ya
+# estaba en vuelo cuando se abrió no cuenta).
+#
+# controller.report() devuelve una tabla con las estadísticas en vivo de cada host.
+import time
+import random
+import threading
+
+POLL_INTERVAL = 0.02  # espera sugerida cuando el host está en su límite de concurrencia
+
+class HostUnavailable(Exception):
+    """El circuit breaker del host está abierto: no se intenta la descarga.
+
+    retry_after: segundos hasta que el host vuelva a aceptar una petición (aproximado).
+    """
+    def __init__(self, msg, retry_after=0.0):
+        super().__init__(msg)
+        self.retry_after = retry_after
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def wait_time(self, now):
+        """Segundos hasta que haya un token (0 si ya hay)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class HostState:
+    def __init__(self, initial, rate, burst):
+        self.limit = float(initial)
+        self.in_flight = 0
+        self.bucket = TokenBucket(rate, burst)
+        self.srtt = None
+        self.rttvar = 0.0
+        self.min_rtt = None         # mínima reciente (sube 1% por muestra para olvidar lo viejo)
+        self.last_decrease = 0.0
+        self.slow_start = True
+        self.failures = 0           # fallos seguidos
+        self.open_until = 0.0       # breaker abierto hasta
+        self.open_count = 0
+        self.probing = False        # half-open: hay una prueba en vuelo
+        self.ok = 0
+        self.errors = 0
+        self.rejected = 0           # peticiones no hechas por breaker abierto
+
+    def state(self, now):
+        if self.open_until > now:
+            return "open"
+        if self.open_count:
+            return "half-open"
+        return "closed"
+
+class HostController:
+    def __init__(self, initial=4, min_limit=1, max_limit=32, rate=10.0, burst=10,
+                 latency_factor=2.0, latency_floor=0.5,
+                 failure_threshold=5, open_seconds=30.0, max_open_seconds=600.0,
+                 min_timeout=3.0, max_timeout=15.0, backoff_base=0.5, backoff_cap=10.0):
+        self.initial = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.rate = rate
+        self.burst = burst
+        self.latency_factor = latency_factor
+        self.latency_floor = latency_floor  # por debajo de esto nunca se considera "lento"
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def _host(self, host):
+        st = self.hosts.get(host)
+        if st is None:
+            st = self.hosts[host] = HostState(self.initial, self.rate, self.burst)
+        return st
+
+    def acquire(self, host):
+        """Pide un lugar para descargar de host: (0, probe) si se concedió, o (segundos a esperar, False).
+
+        probe es True si la petición concedida es la prueba del half-open: hay que pasarlo a release().
+        """
+        now = time.monotonic()
+        with self.lock:
+            st = self._host(host)
+            if st.open_until > now:
+                st.rejected += 1
+                raise HostUnavailable(f"circuit open for {host} ({st.open_until - now:.0f}s)", st.open_until - now)
+            if st.open_count:
+                # half-open: una sola prueba a la vez hasta que una salga bien
+                if st.probing:
+                    st.rejected += 1
+                    # la prueba en vuelo termina como mucho en su timeout
+                    raise HostUnavailable(f"circuit half-open for {host}", self._timeout(st))
+            elif st.in_flight >= int(st.limit):
+                return POLL_INTERVAL, False
+            wait = st.bucket.wait_time(now)
+            if wait > 0:
+                return wait, False
+            st.bucket.take()
+            st.in_flight += 1
+            probe = bool(st.open_count)
+            if probe:
+                st.probing = True
+            return 0.0, probe
+
+    def release(self, host, latency, ok, probe=False):
+        """Resultado de una petición: ok=False para timeouts, errores de conexión, 5xx y 429.
+
+        probe: el segundo valor que devolvió acquire() para esta petición.
+        """
+        now = time.monotonic()
+        with self.lock:
+            st = self._host(host)
+            st.in_flight -= 1
+            if probe:
+                st.probing = False
+            elif st.open_count:
+                # empezó antes de que se abriera el breaker: cuenta en las estadísticas, pero
+                # con el breaker abierto/half-open solo la prueba decide si se cierra o se reabre
+                if ok:
+                    st.ok += 1
+                else:
+                    st.errors += 1
+                return
+            if ok:
+                st.ok += 1
+                st.failures = 0
+                st.open_count = 0
+                # estimación de RTT como TCP (RFC 6298)
+                if st.srtt is None:
+                    st.srtt, st.rttvar = latency, latency / 2
+                else:
+                    st.rttvar = 0.75 * st.rttvar + 0.25 * abs(st.srtt - latency)
+                    st.srtt = 0.875 * st.srtt + 0.125 * latency
+                st.min_rtt = latency if st.min_rtt is None else min(latency, st.min_rtt * 1.01)
+                if latency <= max(self.latency_floor, self.latency_factor * st.min_rtt):
+                    st.limit = min(self.max_limit, st.limit + (1.0 if st.slow_start else 1.0 / st.limit))
+                else:
+                    self._decrease(st, now)
+            else:
+                st.errors += 1
+                st.failures += 1
+                self._decrease(st, now)
+                if st.failures >= self.failure_threshold or st.open_count:
+                    open_for = min(self.max_open_seconds, self.open_seconds * 2 ** st.open_count)
+                    st.open_until = now + open_for
+                    st.open_count += 1
+
+    def _decrease(self, st, now):
+        # como mucho una reducción por RTT: una ráfaga de errores de la misma ventana cuenta una vez
+        if now - st.last_decrease >= (st.srtt or 1.0):
+            st.limit = max(self.min_limit, st.limit / 2)
+            st.last_decrease = now
+        st.slow_start = False
+
+    def _timeout(self, st):
+        if st is None or st.srtt is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, st.srtt + 4 * st.rttvar, 2 * st.srtt))
+
+    def timeout(self, host):
+        with self.lock:
+            return self._timeout(self.hosts.get(host))
+
+    def backoff(self, attempt):
+        """Espera antes del reintento attempt (0, 1, ...): backoff exponencial con full jitter."""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self.lock:
+            return {host: {"state": st.state(now), "limit": int(st.limit), "in_flight": st.in_flight,
+                           "ok": st.ok, "errors": st.errors, "rejected": st.rejected,
+                           "srtt": st.srtt, "timeout": None if st.srtt is None else self._timeout(st)}
+                    for host, st in self.hosts.items()}
+
+    def report(self, top=10):
+        """Tabla de los hosts con más peticiones (estadísticas en vivo)."""
+        snap = sorted(self.snapshot().items(), key=lambda kv: -(kv[1]["ok"] + kv[1]["errors"]))
+        lines = [f"{'host':32s} {'estado':9s} {'límite':>6s} {'vuelo':>5s} {'ok':>6s} {'err':>5s} "
+                 f"{'cortadas':>8s} {'srtt':>7s} {'timeout':>7s}"]
+        for host, s in snap[:top]:
+            srtt = "-" if s["srtt"] is None else f"{s['srtt']:.2f}s"
+            tmo = "-" if s["timeout"] is None else f"{s['timeout']:.1f}s"
+            lines.append(f"{host[:32]:32s} {s['state']:9s} {s['limit']:6d} {s['in_flight']:5d} {s['ok']:6d} "
+                         f"{s['errors']:5d} {s['rejected']:8d} {srtt:>7s} {tmo:>7s}")
+        return "\n".join(lines)
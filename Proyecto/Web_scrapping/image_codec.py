@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+image_codec.py
+
+Pluggable decode / resize / encode backends for etl_pipeline.py and
+preprocess_resize.py (--codec).
+
+Backends:
+- pillow    : image_resize.py (draft() reduced-scale JPEG decode + reducing_gap LANCZOS).
+              Default; output is identical to the pre-codec pipeline.
+- opencv    : cv2.imdecode (IMREAD_REDUCED_COLOR_2/4/8 for big JPEGs), cv2.resize
+              (INTER_AREA down, LANCZOS4 up), cv2.imencode. Releases the GIL, so the
+              thread executor scales across cores.
+- turbojpeg : libjpeg-turbo through PyTurboJPEG for JPEG decode (DCT scaling) and
+              encode; other formats decode with Pillow; resize with OpenCV if present,
+              else Pillow.
+
+Every backend hands back RGB (OpenCV's BGR is converted), keeps the stored pixel
+orientation (EXIF rotation is ignored, like Pillow), drops alpha and returns the
+original (width, height) even when the decode was reduced. Pillow images and
+numpy RGB arrays are the two in-memory types; codec.to_pil() gives a PIL image
+for the hashing helpers.
+
+    codec = get_codec("opencv")
+    img, (w, h) = codec.decode(raw_bytes, 256)
+    data = codec.encode(codec.resize(img, 256), "jpeg")
+
+Consistency check and micro-benchmark on a synthetic image set:
+    python3 image_codec.py --check
+    python3 image_codec.py --bench --n 100 --width 1600 --height 1200 --size 256
+"""
+import time
+import argparse
+from io import BytesIO
+import numpy as np
+from PIL import Image
+from image_resize import open_rgb, resize_square
+
+# Optional: OpenCV backend
+try:
+    import cv2
+    CV2_AVAILABLE = True
+except Exception:
+    CV2_AVAILABLE = False
+
+# Optional: libjpeg-turbo backend (needs the PyTurboJPEG package and the libturbojpeg library)
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJSAMP_420, TJCS_CMYK, TJCS_YCCK
+    TURBOJPEG_AVAILABLE = True
+except Exception:
+    TURBOJPEG_AVAILABLE = False
+
+JPEG_QUALITY = 90
+WEBP_QUALITY = 90
+FORMATS = ("jpeg", "png", "webp")
+
+def _is_jpeg(data: bytes) -> bool:
+    return data[:3] == b"\xff\xd8\xff"
+
+def _reduce_factor(w: int, h: int, size: int) -> int:
+    """Largest 1/2/4/8 DCT scale that keeps both sides >= size (what Image.draft picks)."""
+    for f in (8, 4, 2):
+        if w // f >= size and h // f >= size:
+            return f
+    return 1
+
+# ---------- BACKENDS ----------
+class PillowCodec:
+    name = "pillow"
+
+    def __init__(self, exact: bool = False):
+        self.exact = exact
+
+    def decode(self, data: bytes, size: int = 0):
+        """Return (rgb_image, (orig_width, orig_height)); size lets JPEGs decode at a reduced scale."""
+        return open_rgb(BytesIO(data), size, self.exact)
+
+    def resize(self, img, size: int):
+        return resize_square(img, size, self.exact)
+
+    def encode(self, img, fmt: str = "jpeg") -> bytes:
+        buf = BytesIO()
+        if fmt == "jpeg":
+            img.save(buf, format="JPEG", quality=JPEG_QUALITY)
+        elif fmt == "webp":
+            img.save(buf, format="WEBP", quality=WEBP_QUALITY)
+        elif fmt == "png":
+            img.save(buf, format="PNG")
+        else:
+            raise ValueError(f"unknown format {fmt!r} (choose from {', '.join(FORMATS)})")
+        return buf.getvalue()
+
+    @staticmethod
+    def to_pil(img) -> Image.Image:
+        return img
+
+    @staticmethod
+    def dims(img):
+        return img.size
+
+class OpenCVCodec:
+    name = "opencv"
+
+    def __init__(self, exact: bool = False):
+        if not CV2_AVAILABLE:
+            raise RuntimeError("the opencv codec needs OpenCV (pip install opencv-python-headless)")
+        self.exact = exact
+        # the ETL already runs one transform per worker: keep each call single-threaded
+        cv2.setNumThreads(1)
+
+    def decode(self, data: bytes, size: int = 0):
+        # the header gives the original size without decoding anything
+        with Image.open(BytesIO(data)) as im:
+            orig_size = im.size
+        flags = cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION
+        if size and not self.exact and _is_jpeg(data):
+            f = _reduce_factor(orig_size[0], orig_size[1], size)
+            flags = {8: cv2.IMREAD_REDUCED_COLOR_8, 4: cv2.IMREAD_REDUCED_COLOR_4,
+                     2: cv2.IMREAD_REDUCED_COLOR_2}.get(f, cv2.IMREAD_COLOR) | cv2.IMREAD_IGNORE_ORIENTATION
+        bgr = cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+        if bgr is None:
+            raise ValueError("cv2.imdecode could not decode the image")
+        return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB), orig_size
+
+    def resize(self, img, size: int):
+        h, w = img.shape[:2]
+        interp = cv2.INTER_AREA if w >= size and h >= size else cv2.INTER_LANCZOS4
+        return cv2.resize(img, (size, size), interpolation=interp)
+
+    def encode(self, img, fmt: str = "jpeg") -> bytes:
+        bgr = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+        if fmt == "jpeg":
+            ok, buf = cv2.imencode(".jpg", bgr, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        elif fmt == "webp":
+            ok, buf = cv2.imencode(".webp", bgr, [cv2.IMWRITE_WEBP_QUALITY, WEBP_QUALITY])
+        elif fmt == "png":
+            ok, buf = cv2.imencode(".png", bgr)
+        else:
+            raise ValueError(f"unknown format {fmt!r} (choose from {', '.join(FORMATS)})")
+        if not ok:
+            raise ValueError(f"cv2.imencode could not encode {fmt}")
+        return buf.tobytes()
+
+    @staticmethod
+    def to_pil(img) -> Image.Image:
+        return Image.fromarray(img)
+
+    @staticmethod
+    def dims(img):
+        return img.shape[1], img.shape[0]
+
+class TurboJPEGCodec:
+    name = "turbojpeg"
+
+    def __init__(self, exact: bool = False):
+        if not TURBOJPEG_AVAILABLE:
+            raise RuntimeError("the turbojpeg codec needs PyTurboJPEG and libturbojpeg (pip install PyTurboJPEG)")
+        self.exact = exact
+        try:
+            self.jpeg = TurboJPEG()
+        except (OSError, RuntimeError) as e:
+            raise RuntimeError(f"the turbojpeg codec could not load libturbojpeg: {e}") from e
+        self.fallback = PillowCodec(exact)
+        self.resizer = OpenCVCodec(exact) if CV2_AVAILABLE else None
+
+    def decode(self, data: bytes, size: int = 0):
+        if not _is_jpeg(data):
+            im, orig_size = self.fallback.decode(data, size)
+            return np.asarray(im), orig_size
+        w, h, _, colorspace = self.jpeg.decode_header(data)
+        if colorspace in (TJCS_CMYK, TJCS_YCCK):
+            # libjpeg-turbo can't convert CMYK to RGB; Pillow can
+            im, orig_size = self.fallback.decode(data, size)
+            return np.asarray(im), orig_size
+        scale = (1, 1)
+        if size and not self.exact:
+            f = _reduce_factor(w, h, size)
+            if (1, f) in self.jpeg.scaling_factors:
+                scale = (1, f)
+        # no flags: EXIF orientation is not applied; grayscale comes back as RGB
+        return self.jpeg.decode(data, pixel_format=TJPF_RGB, scaling_factor=scale), (w, h)
+
+    def resize(self, img, size: int):
+        if self.resizer is not None:
+            return self.resizer.resize(img, size)
+        return np.asarray(self.fallback.resize(Image.fromarray(img), size))
+
+    def encode(self, img, fmt: str = "jpeg") -> bytes:
+        if fmt == "jpeg":
+            # 4:2:0 like Pillow and OpenCV (TurboJPEG's own default is 4:2:2)
+            return self.jpeg.encode(np.ascontiguousarray(img), quality=JPEG_QUALITY,
+                                    pixel_format=TJPF_RGB, jpeg_subsample=TJSAMP_420)
+        return self.fallback.encode(Image.fromarray(img), fmt)
+
+    @staticmethod
+    def to_pil(img) -> Image.Image:
+        return Image.fromarray(img)
+
+    @staticmethod
+    def dims(img):
+        return img.shape[1], img.shape[0]
+
+CODECS = {"pillow": PillowCodec, "opencv": OpenCVCodec, "turbojpeg": TurboJPEGCodec}
+_instances = {}
+
+def get_codec(name: str = "pillow", exact: bool = False):
+    """Shared codec instance per (name, exact); raises RuntimeError if the backend is not installed."""
+    key = (name, exact)
+    codec = _instances.get(key)
+    if codec is None:
+        if name not in CODECS:
+            raise ValueError(f"unknown codec {name!r} (choose from {', '.join(CODECS)})")
+        codec = _instances[key] = CODECS[name](exact)
+    return codec
+
+def available_codecs() -> list:
+    names = []
+    for name in CODECS:
+        try:
+            get_codec(name)
+        except RuntimeError:
+            continue
+        names.append(name)
+    return names
+
+# ---------- SYNTHETIC IMAGES ----------
+def synthetic_photo(width: int, height: int, seed: int) -> Image.Image:
+    """Smooth colour gradients plus noise: compresses like a photo, unlike flat test patterns."""
+    rng = np.random.default_rng(seed)
+    small = (rng.random((max(2, height // 32), max(2, width // 32), 3)) * 255).astype(np.uint8)
+    im = Image.fromarray(small).resize((width, height), Image.BICUBIC)
+    noise = rng.normal(0, 6, (height, width, 3))
+    return Image.fromarray(np.clip(np.asarray(im, dtype=np.float32) + noise, 0, 255).astype(np.uint8))
+
+def _encoded(im: Image.Image, fmt: str, **kw) -> bytes:
+    buf = BytesIO()
+    im.save(buf, format=fmt, **kw)
+    return buf.getvalue()
+
+def check_cases() -> list:
+    """(name, encoded bytes) covering the colour modes and layouts the dataset actually has."""
+    photo = synthetic_photo(1600, 1200, 0)
+    exif = Image.Exif()
+    exif[0x0112] = 6  # orientation: rotate 90 CW on display
+    rgba = photo.resize((300, 200)).convert("RGBA")
+    rgba.putalpha(128)
+    return [
+        ("jpeg 1600x1200", _encoded(photo, "JPEG", quality=90)),
+        ("jpeg 120x90", _encoded(photo.resize((120, 90)), "JPEG", quality=90)),
+        ("jpeg grayscale", _encoded(photo.convert("L"), "JPEG", quality=90)),
+        ("jpeg cmyk", _encoded(photo.resize((400, 300)).convert("CMYK"), "JPEG", quality=95)),
+        ("jpeg exif rotated", _encoded(photo.resize((400, 300)), "JPEG", quality=90, exif=exif)),
+        ("jpeg pure red", _encoded(Image.new("RGB", (300, 300), (255, 0, 0)), "JPEG", quality=95)),
+        ("png rgba", _encoded(rgba, "PNG")),
+        ("png palette", _encoded(photo.resize((300, 200)).convert("P"), "PNG")),
+        ("webp", _encoded(photo.resize((500, 400)), "WEBP", quality=90)),
+    ]
+
+# ---------- CHECK ----------
+def check(size: int, tolerance: float) -> int:
+    """Compare every available backend against Pillow; returns the number of mismatches."""
+    names = available_codecs()
+    ref_codec = get_codec("pillow")
+    problems = 0
+    print(f"[CHECK] backends: {', '.join(names)} (not available: "
+          f"{', '.join(n for n in CODECS if n not in names) or 'none'})")
+    for case, data in check_cases():
+        ref_img, ref_orig = ref_codec.decode(data, size)
+        ref = np.asarray(ref_codec.resize(ref_img, size), dtype=np.float32)
+        for name in names:
+            codec = get_codec(name)
+            try:
+                img, orig = codec.decode(data, size)
+                out = codec.resize(img, size)
+                back = Image.open(BytesIO(codec.encode(out, "jpeg")))
+            except Exception as e:
+                print(f"[CHECK][FAIL] {name:9s} {case}: {e}")
+                problems += 1
+                continue
+            arr = np.asarray(codec.to_pil(out), dtype=np.float32)
+            diff = float(np.abs(arr - ref).mean()) if arr.shape == ref.shape else float("inf")
+            errors = []
+            if orig != ref_orig:
+                errors.append(f"orig size {orig} != {ref_orig}")
+            if arr.shape != (size, size, 3):
+                errors.append(f"shape {arr.shape}")
+            if back.size != (size, size) or back.mode != "RGB":
+                errors.append(f"encoded {back.mode} {back.size}")
+            if diff > tolerance:
+                errors.append(f"mean abs diff {diff:.2f} > {tolerance}")
+            status = "FAIL" if errors else "OK"
+            problems += bool(errors)
+            print(f"[CHECK][{status}] {name:9s} {case:18s} diff={diff:5.2f} {'; '.join(errors)}")
+    return problems
+
+# ---------- BENCHMARK ----------
+def bench(n: int, width: int, height: int, size: int, exact: bool, fmt: str):
+    data = [_encoded(synthetic_photo(width, height, seed), "JPEG", quality=90) for seed in range(n)]
+    print(f"[BENCH] {n} synthetic {width}x{height} JPEGs -> {size}x{size} {fmt}"
+          f"{' (full decode)' if exact else ''}")
+    for name in available_codecs():
+        codec = get_codec(name, exact)
+        t_dec = t_res = t_enc = 0.0
+        for raw in data:
+            t0 = time.perf_counter()
+            img, _ = codec.decode(raw, size)
+            t1 = time.perf_counter()
+            out = codec.resize(img, size)
+            t2 = time.perf_counter()
+            codec.encode(out, fmt)
+            t3 = time.perf_counter()
+            t_dec += t1 - t0
+            t_res += t2 - t1
+            t_enc += t3 - t2
+        total = t_dec + t_res + t_enc
+        print(f"[BENCH] {name:9s}: decode {t_dec / n * 1000:6.2f} ms, resize {t_res / n * 1000:6.2f} ms, "
+              f"encode {t_enc / n * 1000:6.2f} ms -> {total / n * 1000:6.2f} ms/img ({n / total:.1f} img/s)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="image codec backends: consistency check and micro-benchmark")
+    parser.add_argument("--check", action="store_true", help="compare dimensions and colours against Pillow")
+    parser.add_argument("--bench", action="store_true", help="decode/resize/encode time per backend")
+    parser.add_argument("--n", type=int, default=100, help="synthetic images for --bench")
+    parser.add_argument("--width", type=int, default=1600)
+    parser.add_argument("--height", type=int, default=1200)
+    parser.add_argument("--size", type=int, default=256)
+    parser.add_argument("--format", choices=FORMATS, default="jpeg", help="encode format for --bench")
+    parser.add_argument("--exact", action="store_true", help="full-size decode (no reduced JPEG scale)")
+    parser.add_argument("--tolerance", type=float, default=4.0,
+                        help="max mean abs pixel difference vs Pillow (0-255 scale) for --check")
+    args = parser.parse_args()
+    if not (args.check or args.bench):
+        args.check = args.bench = True
+    failed = 0
+    if args.check:
+        failed = check(args.size, args.tolerance)
+    if args.bench:
+        bench(args.n, args.width, args.height, args.size, args.exact, args.format)
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+image_resize.py
+
+Decode + resize helpers shared by etl_pipeline.py and preprocess_resize.py.
+
+Fast path (default):
+- JPEG: Image.draft() asks libjpeg to decode at the smallest 1/2, 1/4 or 1/8
+  DCT scale that is still >= the target size, so a 4000px photo is never
+  fully decoded just to end up at 256x256.
+- any format: resize(..., reducing_gap=3.0) does a cheap integer reduce()
+  first and finishes with LANCZOS on an image at most 3x the target.
+exact=True keeps the original full-decode + plain LANCZOS path (bit-exact with
+older outputs).
+
+Quality check / benchmark (each mode runs in its own process so peak RSS is
+comparable):
+    python3 image_resize.py --src dataset --size 256 --limit 300
+"""
+import os
+import time
+import argparse
+import multiprocessing
+from PIL import Image
+
+REDUCING_GAP = 3.0
+
+def open_rgb(fp, size: int = 0, exact: bool = False):
+    """Open fp and return (rgb_image, (orig_width, orig_height)).
+
+    With size and not exact, JPEGs are decoded at a reduced DCT scale that keeps
+    both sides >= size. The original dimensions are returned separately because
+    the decoded image may be smaller than the file.
+    """
+    with Image.open(fp) as im:
+        orig_size = im.size
+        if size and not exact:
+            im.draft("RGB", (size, size))
+        im.load()  # ensure loaded
+        return im.convert("RGB"), orig_size
+
+def resize_square(im: Image.Image, size: int, exact: bool = False) -> Image.Image:
+    return im.resize((size, size), Image.LANCZOS, reducing_gap=None if exact else REDUCING_GAP)
+
+def load_resized(fp, size: int, exact: bool = False):
+    """open_rgb + resize_square; returns (resized_image, (orig_width, orig_height))."""
+    im, orig_size = open_rgb(fp, size, exact)
+    return resize_square(im, size, exact), orig_size
+
+def psnr(a: Image.Image, b: Image.Image) -> float:
+    import numpy as np
+    x = np.asarray(a, dtype=np.float64)
+    y = np.asarray(b, dtype=np.float64)
+    mse = np.mean((x - y) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+# ---------- BENCHMARK ----------
+def list_images(src: str, limit: int):
+    paths = []
+    for root, _, files in os.walk(src):
+        for fn in sorted(files):
+            paths.append(os.path.join(root, fn))
+            if limit and len(paths) >= limit:
+                return paths
+    return paths
+
+def peak_rss_mib() -> float:
+    # VmHWM is per address space; ru_maxrss would carry over the parent's peak through fork+exec
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+def _bench_worker(paths, size, exact, out):
+    t0 = time.perf_counter()
+    n = 0
+    for p in paths:
+        try:
+            load_resized(p, size, exact)
+            n += 1
+        except Exception:
+            continue
+    elapsed = time.perf_counter() - t0
+    out.put((n, elapsed, peak_rss_mib()))
+
+def bench(paths, size):
+    ctx = multiprocessing.get_context("spawn")
+    for exact in (True, False):
+        q = ctx.Queue()
+        p = ctx.Process(target=_bench_worker, args=(paths, size, exact, q))
+        p.start()
+        n, elapsed, rss = q.get()
+        p.join()
+        label = "exact" if exact else "fast"
+        per_img = elapsed / n * 1000 if n else 0.0
+        print(f"[BENCH] {label:5s}: {n} images, {per_img:.2f} ms/img, peak RSS {rss:.1f} MiB")
+
+def quality(paths, size):
+    values = []
+    for p in paths:
+        try:
+            ref, _ = load_resized(p, size, exact=True)
+            fast, _ = load_resized(p, size, exact=False)
+        except Exception:
+            continue
+        values.append(psnr(ref, fast))
+    if not values:
+        print("[PSNR] no readable images")
+        return
+    finite = sorted(v for v in values if v != float("inf"))
+    identical = len(values) - len(finite)
+    if finite:
+        print(f"[PSNR] fast vs exact over {len(values)} images: mean={sum(finite) / len(finite):.2f} dB, "
+              f"min={finite[0]:.2f} dB, identical={identical}")
+    else:
+        print(f"[PSNR] fast vs exact over {len(values)} images: all identical")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PSNR + speed/RSS comparison of fast vs exact decode-resize")
+    parser.add_argument("--src", default="dataset")
+    parser.add_argument("--size", type=int, default=256)
+    parser.add_argument("--limit", type=int, default=300)
+    args = parser.parse_args()
+    paths = list_images(args.src, args.limit)
+    quality(paths, args.size)
+    bench(paths, args.size)
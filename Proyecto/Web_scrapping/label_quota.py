@@ -0,0 +1,96 @@
+# label_quota.py
+#
+# Cupos por label para scraper_dataset.py, en memoria.
+#
+# Cada label tiene tres contadores protegidos por un lock: guardadas (committed),
+# reservadas (descargas en vuelo) y el siguiente índice de archivo. Se inicializan
+# una sola vez leyendo OUTPUT_DIR/<label>/; después ningún hilo vuelve a listar
+# el directorio.
+#
+#   if quota.reserve(label):          # hay cupo -> descargar
+#       ...
+#       filename = quota.commit(label)  # nombre secuencial label_00042.jpg (None si ya se llenó)
+#   o bien
+#       quota.release(label)          # la descarga falló / se descartó
+#
+# overbook permite algunas reservas más que el cupo restante (muchas URLs fallan);
+# cuando el label se completa, las descargas sobrantes en vuelo ven is_done() y se cancelan.
+import os
+import re
+import threading
+
+class LabelQuota:
+    def __init__(self, output_dir, labels, per_label, overbook=0):
+        self.output_dir = output_dir
+        self.per_label = per_label
+        self.overbook = overbook
+        self.lock = threading.Lock()
+        self.committed = {}
+        self.reserved = {}
+        self.next_index = {}
+        for label in labels:
+            self._load(label)
+
+    @staticmethod
+    def folder(label):
+        return label.replace(" ", "_")
+
+    def _load(self, label):
+        prefix = self.folder(label)
+        label_dir = os.path.join(self.output_dir, prefix)
+        os.makedirs(label_dir, exist_ok=True)
+        pattern = re.compile(rf"^{re.escape(prefix)}_(\d+)\.jpg$")
+        count, last = 0, 0
+        with os.scandir(label_dir) as it:
+            for e in it:
+                if not e.is_file():
+                    continue
+                count += 1
+                m = pattern.match(e.name)
+                if m:
+                    last = max(last, int(m.group(1)))
+        self.committed[label] = count
+        self.reserved[label] = 0
+        # continuar después del índice más alto para no pisar archivos si hay huecos
+        self.next_index[label] = max(last, count) + 1
+
+    def reserve(self, label):
+        """Aparta un lugar para una descarga; False si el cupo ya está cubierto (guardadas + en vuelo)."""
+        with self.lock:
+            if self.committed[label] >= self.per_label or \
+                    self.committed[label] + self.reserved[label] >= self.per_label + self.overbook:
+                return False
+            self.reserved[label] += 1
+            return True
+
+    def commit(self, label):
+        """Convierte una reserva en imagen guardada y devuelve su nombre de archivo.
+
+        Devuelve None (y libera la reserva) si el cupo se llenó mientras tanto.
+        """
+        with self.lock:
+            self.reserved[label] -= 1
+            if self.committed[label] >= self.per_label:
+                return None
+            self.committed[label] += 1
+            idx = self.next_index[label]
+            self.next_index[label] += 1
+        return f"{self.folder(label)}_{idx:05d}.jpg"
+
+    def release(self, label):
+        with self.lock:
+            self.reserved[label] -= 1
+
+    def count(self, label):
+        with self.lock:
+            return self.committed[label]
+
+    def is_full(self, label):
+        """Ya no se aceptan más reservas (el resto del cupo está en vuelo)."""
+        with self.lock:
+            return self.committed[label] >= self.per_label or \
+                self.committed[label] + self.reserved[label] >= self.per_label + self.overbook
+
+    def is_done(self, label):
+        with self.lock:
+            return self.committed[label] >= self.per_label
@@ -0,0 +1,200 @@
+"""
+metadata_sink.py
+
+Single-writer metadata sink shared by scraper_dataset.py and etl_pipeline.py.
+
+Workers call sink.write(row) (a non-blocking Queue.put); one writer thread
+drains the queue and flushes rows in batches to the selected backend, so the
+output file is opened once per run instead of once per image and no worker
+waits on a metadata lock.
+
+Backends:
+- csv     : plain CSV with header (default)
+- parquet : one row group per batch (needs pyarrow)
+- sqlite  : one table named after the file, one transaction per batch
+
+Usage:
+    sink = open_sink("metadata.csv", ["filename", "label", ...])
+    sink.write([...])
+    sink.close()   # flushes pending rows and stops the writer thread
+
+    for row in read_rows("metadata.csv"): ...   # read back any backend's file
+"""
+import os
+import csv
+import sqlite3
+import time
+import threading
+from queue import Queue, Empty
+
+# Optional: pyarrow for the Parquet backend
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except Exception:
+    PYARROW_AVAILABLE = False
+
+BATCH_SIZE = 256
+FLUSH_INTERVAL = 1.0  # seconds; max time a row waits in the queue
+_NO_ROW = object()
+
+# ---------- BACKENDS ----------
+class CsvBackend:
+    def __init__(self, path, header, append=False):
+        write_header = not (append and os.path.exists(path) and os.path.getsize(path) > 0)
+        self.f = open(path, "a" if append else "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.f)
+        if write_header:
+            self.writer.writerow(header)
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+class ParquetBackend:
+    def __init__(self, path, header, append=False):
+        if not PYARROW_AVAILABLE:
+            raise RuntimeError("the parquet metadata backend needs pyarrow (pip install pyarrow)")
+        if append and os.path.exists(path):
+            raise RuntimeError(f"parquet files can't be appended to: {path}")
+        self.path = path
+        self.header = list(header)
+        self.writer = None  # schema is taken from the first batch
+
+    def write_rows(self, rows):
+        columns = {name: [row[i] for row in rows] for i, name in enumerate(self.header)}
+        if self.writer is None:
+            table = pa.table(columns)
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        else:
+            table = pa.table(columns).cast(self.writer.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is None:
+            # no rows: still leave a readable (empty) file behind
+            self.writer = pq.ParquetWriter(self.path, pa.schema([(name, pa.string()) for name in self.header]))
+        self.writer.close()
+
+class SqliteBackend:
+    def __init__(self, path, header, append=False):
+        self.table = sqlite_table(path)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        cols = ", ".join(f'"{name}"' for name in header)
+        if not append:
+            self.conn.execute(f'DROP TABLE IF EXISTS "{self.table}"')
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS "{self.table}" ({cols})')
+        self.insert = f'INSERT INTO "{self.table}" VALUES ({", ".join("?" * len(header))})'
+        self.conn.commit()
+
+    def write_rows(self, rows):
+        with self.conn:
+            self.conn.executemany(self.insert, rows)
+
+    def close(self):
+        self.conn.close()
+
+def sqlite_table(path) -> str:
+    return os.path.splitext(os.path.basename(path))[0] or "metadata"
+
+BACKENDS = {"csv": CsvBackend, "parquet": ParquetBackend, "sqlite": SqliteBackend}
+EXTENSIONS = {".csv": "csv", ".parquet": "parquet", ".pq": "parquet", ".sqlite": "sqlite", ".db": "sqlite"}
+
+# ---------- SINK ----------
+class MetadataSink:
+    def __init__(self, backend, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.q = Queue()
+        self.rows_written = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, row):
+        self.q.put(list(row))
+
+    def _run(self):
+        batch = []
+        deadline = 0.0
+        while True:
+            # block until the first row of a batch, then wait at most flush_interval for the rest
+            timeout = max(0.0, deadline - time.monotonic()) if batch else None
+            try:
+                item = self.q.get(timeout=timeout)
+            except Empty:
+                item = _NO_ROW
+            if item is None:
+                break
+            if item is not _NO_ROW:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+            if len(batch) >= self.batch_size or (batch and time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+        if batch:
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            self.backend.write_rows(batch)
+            self.rows_written += len(batch)
+        except Exception as e:
+            # keep draining so producers never block; report on close()
+            self.error = e
+            print(f"[META][ERROR] could not write {len(batch)} rows: {e}")
+
+    def close(self):
+        self.q.put(None)
+        self.thread.join()
+        self.backend.close()
+        if self.error is not None:
+            raise RuntimeError(f"metadata sink failed: {self.error}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def backend_for_path(path) -> str:
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower(), "csv")
+
+def open_sink(path, header, backend=None, append=False, batch_size=BATCH_SIZE,
+              flush_interval=FLUSH_INTERVAL) -> MetadataSink:
+    """Open a MetadataSink on path; backend defaults to the one matching the file extension."""
+    if backend is None:
+        backend = backend_for_path(path)
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown metadata backend: {backend} (choose from {', '.join(BACKENDS)})")
+    return MetadataSink(BACKENDS[backend](path, header, append=append), batch_size, flush_interval)
+
+# ---------- READER ----------
+def read_rows(path, backend=None):
+    """Yield the data rows (lists, header excluded) of a file written by a MetadataSink."""
+    if backend is None:
+        backend = backend_for_path(path)
+    if backend == "csv":
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            yield from reader
+    elif backend == "parquet":
+        if not PYARROW_AVAILABLE:
+            raise RuntimeError("the parquet metadata backend needs pyarrow (pip install pyarrow)")
+        table = pq.read_table(path)
+        yield from (list(row) for row in zip(*(col.to_pylist() for col in table.columns)))
+    elif backend == "sqlite":
+        conn = sqlite3.connect(path)
+        try:
+            yield from (list(row) for row in conn.execute(f'SELECT * FROM "{sqlite_table(path)}" ORDER BY rowid'))
+        finally:
+            conn.close()
+    else:
+        raise ValueError(f"unknown metadata backend: {backend} (choose from {', '.join(BACKENDS)})")
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+near_dupes.py
+
+Perceptual hashing + near-duplicate search for the dataset.
+
+- dhash_batch / phash_batch: NumPy-vectorized 64-bit dHash / pHash over a batch
+  of PIL images (only the tiny grayscale resize is done per image).
+- HashIndex: multi-index hashing (MIH). Each 64-bit hash is split into m chunks;
+  two hashes within Hamming distance k share at least one chunk within distance
+  k // m (pigeonhole), so a query only probes m small hash tables and verifies
+  the few candidates with a vectorized popcount instead of scanning everything.
+- near_dupes CLI: clusters near-duplicates per label or across labels, writes a
+  report and optionally removes everything but the first image of each cluster.
+
+Usage:
+    python3 near_dupes.py --src dataset --distance 4                  # report per label
+    python3 near_dupes.py --src dataset --scope global --report nd.csv
+    python3 near_dupes.py --meta metadata_processed.csv --remove       # reuse the ETL phash column
+"""
+import os
+import csv
+import argparse
+from itertools import combinations
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from image_resize import open_rgb
+
+HASH_BITS = 64
+
+# ---------- HASHING ----------
+def _pack_bits(bits: np.ndarray) -> np.ndarray:
+    """(N, 64) bool -> (N,) uint64, first bit is the most significant."""
+    return np.packbits(bits.astype(np.uint8), axis=1).view(">u8").ravel().astype(np.uint64)
+
+def _gray_stack(images, size) -> np.ndarray:
+    return np.stack([np.asarray(im.convert("L").resize(size, Image.LANCZOS), dtype=np.float32)
+                     for im in images])
+
+def dhash_batch(images, hash_size=8) -> np.ndarray:
+    """Difference hash: is each pixel brighter than its right neighbour (hash_size+1 x hash_size grid)."""
+    px = _gray_stack(images, (hash_size + 1, hash_size))
+    bits = px[:, :, :-1] > px[:, :, 1:]
+    return _pack_bits(bits.reshape(len(px), -1))
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m
+
+def phash_batch(images, hash_size=8, highfreq_factor=4) -> np.ndarray:
+    """DCT hash: low-frequency 8x8 block of a 32x32 DCT compared against its median."""
+    n = hash_size * highfreq_factor
+    px = _gray_stack(images, (n, n))
+    c = _dct_matrix(n).astype(np.float32)
+    dct = np.einsum("ij,njk,lk->nil", c, px, c)[:, :hash_size, :hash_size]
+    flat = dct.reshape(len(px), -1)
+    bits = flat > np.median(flat, axis=1, keepdims=True)
+    return _pack_bits(bits)
+
+HASHERS = {"dhash": dhash_batch, "phash": phash_batch}
+
+def hash_to_hex(h) -> str:
+    return format(int(h), "x")
+
+def hex_to_hash(s: str) -> int:
+    return int(s, 16)
+
+# ---------- POPCOUNT ----------
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def hamming(a, b) -> np.ndarray:
+    """Hamming distance between uint64 arrays (broadcasting)."""
+    x = np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64))
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        return np.bitwise_count(x)
+    x = np.ascontiguousarray(x)
+    return _POPCOUNT8[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1)
+
+# ---------- INDEX ----------
+class HashIndex:
+    def __init__(self, hashes, num_chunks=4):
+        # equal chunks are what makes the pigeonhole bound (k // m per chunk) hold
+        if num_chunks < 1 or HASH_BITS % num_chunks:
+            raise ValueError(f"num_chunks must divide {HASH_BITS}, got {num_chunks}")
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.num_chunks = num_chunks
+        self.chunk_bits = HASH_BITS // num_chunks
+        self.mask = (1 << self.chunk_bits) - 1
+        self.tables = []
+        for c in range(num_chunks):
+            keys = self._chunk(self.hashes, c)
+            # sort once and keep (key -> slice) so each probe is a dict lookup
+            order = np.argsort(keys, kind="stable")
+            uniq, starts = np.unique(keys[order], return_index=True)
+            ends = np.append(starts[1:], len(order))
+            self.tables.append((order, {int(k): (s, e) for k, s, e in zip(uniq, starts, ends)}))
+        self._flips = {}
+
+    def _chunk(self, h, c):
+        shift = np.uint64(c * self.chunk_bits)
+        return ((np.asarray(h, dtype=np.uint64) >> shift) & np.uint64(self.mask)).astype(np.int64)
+
+    def _flip_masks(self, r):
+        """All chunk-sized masks with popcount <= r."""
+        if r not in self._flips:
+            masks = [0]
+            for bits in range(1, r + 1):
+                for combo in combinations(range(self.chunk_bits), bits):
+                    masks.append(sum(1 << b for b in combo))
+            self._flips[r] = masks
+        return self._flips[r]
+
+    def query(self, h, k: int) -> np.ndarray:
+        """Indices of every indexed hash within Hamming distance k of h."""
+        r = k // self.num_chunks
+        candidates = []
+        for c, (order, table) in enumerate(self.tables):
+            key = int(self._chunk(h, c))
+            for m in self._flip_masks(r):
+                hit = table.get(key ^ m)
+                if hit is not None:
+                    candidates.append(order[hit[0]:hit[1]])
+        if not candidates:
+            return np.empty(0, dtype=np.int64)
+        cand = np.unique(np.concatenate(candidates))
+        return cand[hamming(self.hashes[cand], np.uint64(h)) <= k]
+
+    def pairs(self, k: int):
+        """Yield (i, j), i < j, for every pair within distance k."""
+        for i, h in enumerate(self.hashes):
+            for j in self.query(h, k):
+                if j > i:
+                    yield i, int(j)
+
+def clusters(hashes, k: int, num_chunks=4):
+    """Group indices into near-duplicate clusters (union-find over index pairs); singletons dropped."""
+    parent = list(range(len(hashes)))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for i, j in HashIndex(hashes, num_chunks).pairs(k):
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+    groups = {}
+    for i in range(len(hashes)):
+        groups.setdefault(find(i), []).append(i)
+    return [g for g in groups.values() if len(g) > 1]
+
+# ---------- INPUT ----------
+def _load_small(path):
+    im, _ = open_rgb(path, 64)  # reduced JPEG decode: hashes only need a tiny image
+    return im
+
+def hash_files(paths, algo="dhash", batch=256, workers=8):
+    """Hash image files in batches; returns (hashes, ok) where ok is False for unreadable files."""
+    hasher = HASHERS[algo]
+    out = np.zeros(len(paths), dtype=np.uint64)
+    ok = np.ones(len(paths), dtype=bool)
+    blank = Image.new("RGB", (8, 8))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(paths), batch):
+            chunk = paths[start:start + batch]
+            images = []
+            for i, fut in enumerate([pool.submit(_load_small, p) for p in chunk]):
+                try:
+                    images.append(fut.result())
+                except Exception as e:
+                    print(f"[SKIP][ERROR] {chunk[i]} -> {e}")
+                    images.append(blank)
+                    ok[start + i] = False
+            out[start:start + len(chunk)] = hasher(images)
+    return out, ok
+
+def _dir_entries(src):
+    entries = []
+    for label in sorted(os.listdir(src)):
+        label_dir = os.path.join(src, label)
+        if not os.path.isdir(label_dir):
+            continue
+        for fn in sorted(os.listdir(label_dir)):
+            path = os.path.join(label_dir, fn)
+            if os.path.isfile(path):
+                entries.append((path, label))
+    return entries
+
+def _meta_entries(meta_path):
+    entries, hashes = [], []
+    with open(meta_path, newline="", encoding="utf-8") as f:
+        # the sample metadata files start with a comment line
+        reader = csv.DictReader(line for line in f if line.strip() and not line.startswith("#"))
+        for row in reader:
+            if row.get("phash") and os.path.exists(row["dst_path"]):
+                entries.append((row["dst_path"], row["label"]))
+                hashes.append(hex_to_hash(row["phash"]))
+    return entries, np.array(hashes, dtype=np.uint64)
+
+# ---------- MAIN ----------
+def main():
+    parser = argparse.ArgumentParser(description="find (and optionally remove) near-duplicate images")
+    src = parser.add_mutually_exclusive_group()
+    src.add_argument("--src", default="dataset", help="dataset folder (<label>/<file>) to hash")
+    src.add_argument("--meta", help="metadata_processed.csv: reuse its phash column (dHash) instead of hashing")
+    parser.add_argument("--algo", choices=sorted(HASHERS), default="dhash", help="hash used with --src")
+    parser.add_argument("--distance", "-k", type=int, default=4, help="max Hamming distance (of 64 bits)")
+    parser.add_argument("--scope", choices=("label", "global"), default="label",
+                        help="cluster within each label or across all labels")
+    parser.add_argument("--chunks", type=int, default=4, help="MIH chunks (64 must be divisible by it)")
+    parser.add_argument("--workers", type=int, default=8, help="decode threads when hashing")
+    parser.add_argument("--report", help="write clusters to this CSV")
+    parser.add_argument("--remove", action="store_true", help="delete every file but the first of each cluster")
+    args = parser.parse_args()
+    if args.chunks < 1 or HASH_BITS % args.chunks:
+        parser.error(f"--chunks must divide {HASH_BITS} (1, 2, 4, 8, 16, 32 or 64)")
+
+    if args.meta:
+        entries, hashes = _meta_entries(args.meta)
+    else:
+        entries = _dir_entries(args.src)
+        hashes, ok = hash_files([p for p, _ in entries], args.algo, workers=args.workers)
+        entries = [e for e, good in zip(entries, ok) if good]
+        hashes = hashes[ok]
+    print(f"[HASH] {len(entries)} images")
+
+    if args.scope == "global":
+        groups = [list(range(len(entries)))]
+    else:
+        by_label = {}
+        for i, (_, label) in enumerate(entries):
+            by_label.setdefault(label, []).append(i)
+        groups = list(by_label.values())
+
+    found = []
+    for members in groups:
+        for cl in clusters(hashes[members], args.distance, args.chunks):
+            found.append(sorted(members[i] for i in cl))
+
+    removed = 0
+    report = None
+    if args.report:
+        report = open(args.report, "w", newline="", encoding="utf-8")
+        writer = csv.writer(report)
+        writer.writerow(["cluster", "path", "label", "hash", "keep"])
+    for cid, cl in enumerate(found):
+        keep = cl[0]
+        labels = sorted({entries[i][1] for i in cl})
+        print(f"[CLUSTER {cid}] {len(cl)} images, labels={','.join(labels)}, keep={entries[keep][0]}")
+        for i in cl:
+            path, label = entries[i]
+            if report:
+                writer.writerow([cid, path, label, hash_to_hex(hashes[i]), int(i == keep)])
+            if args.remove and i != keep:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError as e:
+                    print("No se pudo eliminar:", path, e)
+    if report:
+        report.close()
+
+    dupes = sum(len(cl) - 1 for cl in found)
+    print(f"[NEAR_DUPES] {len(found)} clusters, {dupes} redundant images, removed={removed}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+pack_shards.py
+
+Packed training formats, so an epoch is a few sequential reads instead of one
+open + stat + decode per small JPEG:
+
+- tar    : WebDataset-style shards (shard-000000.tar, ...). Each sample is
+           <key>.jpg (or .png/.webp: the encoded bytes, untouched) + <key>.json
+           ({"label", "src_path", "sha256"}). Read them as a stream (tarfile "r|").
+- memmap : images.u8, a raw C-order uint8 array N x S x S x 3 (already decoded and
+           resized), plus labels.npy (int32 class index) and index.csv (row -> label,
+           src_path, sha256). np.memmap slicing is zero-copy.
+
+Layout (one folder per subset, classes in Keras flow_from_directory order):
+    dataset_packed/classes.json
+    dataset_packed/train/{shard-000000.tar, ..., images.u8, labels.npy, index.csv, meta.json}
+    dataset_packed/val/...  dataset_packed/test/...
+
+Producers:
+- etl_pipeline.py --pack tar,memmap writes them while it runs; the subset of each
+  image is split_dataset.subset_for(sha256 of the source image), the same split
+  split_dataset.py makes.
+  Samples are in completion order: shuffle when reading (memmap_batches does).
+- convert: from an existing dataset_split/ tree, shuffled once at write time.
+
+Usage:
+    python3 pack_shards.py convert --src dataset_split --out dataset_packed --formats tar,memmap --size 224
+    python3 pack_shards.py bench --src dataset_split --packed dataset_packed --size 224
+
+Readers: iter_tar(), open_memmap() + memmap_batches(); train_classifier.py --packed.
+"""
+import os
+import io
+import csv
+import json
+import time
+import random
+import tarfile
+import hashlib
+import argparse
+import threading
+import numpy as np
+from image_codec import get_codec, CODECS
+
+SUBSETS = ("train", "val", "test")
+FORMATS = ("tar", "memmap")
+SHARD_MAX_COUNT = 5000          # samples per tar shard
+SHARD_MAX_BYTES = 512 << 20     # or bytes per tar shard, whichever comes first
+IMAGES = "images.u8"
+LABELS = "labels.npy"
+INDEX = "index.csv"
+META = "meta.json"
+CLASSES = "classes.json"
+
+# ---------- WRITER ----------
+class _SubsetWriter:
+    def __init__(self, out_dir: str, formats, size, shard_max_count: int, shard_max_bytes: int):
+        self.out_dir = out_dir
+        os.makedirs(out_dir, exist_ok=True)
+        self.formats = formats
+        self.size = size
+        self.shard_max_count = shard_max_count
+        self.shard_max_bytes = shard_max_bytes
+        self.count = 0
+        self.labels = []        # label names, mapped to class indices on close
+        self.shards = []
+        self.tar = None
+        self.shard_count = self.shard_bytes = 0
+        self.images = open(os.path.join(out_dir, IMAGES), "wb") if "memmap" in formats else None
+        self.index_f = open(os.path.join(out_dir, INDEX), "w", newline="", encoding="utf-8")
+        self.index = csv.writer(self.index_f)
+        self.index.writerow(["i", "label", "src_path", "sha256"])
+
+    def add(self, label: str, src_path: str, sha: str, data: bytes, pixels, ext: str):
+        key = f"{self.count:09d}"
+        if self.tar is not None and (self.shard_count >= self.shard_max_count
+                                     or self.shard_bytes >= self.shard_max_bytes):
+            self.tar.close()
+            self.tar = None
+        if "tar" in self.formats:
+            if self.tar is None:
+                name = f"shard-{len(self.shards):06d}.tar"
+                self.shards.append(name)
+                self.tar = tarfile.open(os.path.join(self.out_dir, name), "w")
+                self.shard_count = self.shard_bytes = 0
+            info = json.dumps({"label": label, "src_path": src_path, "sha256": sha}, sort_keys=True).encode("utf-8")
+            _add_member(self.tar, f"{key}.{ext}", data)
+            _add_member(self.tar, key + ".json", info)
+            self.shard_count += 1
+            self.shard_bytes += len(data) + len(info) + 2048  # + two 512-byte headers and padding
+        if self.images is not None:
+            if pixels.shape != (self.size, self.size, 3) or pixels.dtype != np.uint8:
+                raise ValueError(f"memmap pack needs {self.size}x{self.size}x3 uint8, got {pixels.shape} {pixels.dtype}")
+            self.images.write(np.ascontiguousarray(pixels).tobytes())
+        self.index.writerow([self.count, label, src_path, sha])
+        self.labels.append(label)
+        self.count += 1
+
+    def close(self, class_index: dict):
+        if self.tar is not None:
+            self.tar.close()
+        if self.images is not None:
+            self.images.close()
+        self.index_f.close()
+        np.save(os.path.join(self.out_dir, LABELS), np.array([class_index[l] for l in self.labels], dtype=np.int32))
+        meta = {"count": self.count, "formats": list(self.formats), "shards": self.shards,
+                "shape": [self.count, self.size, self.size, 3] if self.images is not None else None}
+        with open(os.path.join(self.out_dir, META), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+
+def _add_member(tar, name: str, data: bytes):
+    # fixed owner/mtime: the same samples give the same shard bytes
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = 0o644
+    info.mtime = 0
+    tar.addfile(info, io.BytesIO(data))
+
+def label_folders(src: str) -> list:
+    """Sorted label folder names of a <label>/<file> tree (flow_from_directory class order)."""
+    with os.scandir(src) as it:
+        return sorted(entry.name for entry in it if entry.is_dir())
+
+class PackWriter:
+    """Thread-safe writer of packed subsets; add() from any worker, close() once at the end.
+
+    pixels (S x S x 3 uint8) are only needed when "memmap" is in formats.
+    classes: the full class list (e.g. label_folders of the source tree). Without it the
+    classes are the labels this writer happened to see, and a class missing from the
+    sample would shift the indices of every class after it.
+    """
+
+    def __init__(self, out_dir: str, formats=FORMATS, size=None,
+                 shard_max_count=SHARD_MAX_COUNT, shard_max_bytes=SHARD_MAX_BYTES, classes=None):
+        formats = tuple(formats)
+        unknown = set(formats) - set(FORMATS)
+        if unknown:
+            raise ValueError(f"unknown pack format(s) {', '.join(sorted(unknown))} (choose from {', '.join(FORMATS)})")
+        if "memmap" in formats and not size:
+            raise ValueError("the memmap pack needs a fixed image size")
+        self.out_dir = out_dir
+        self.formats = formats
+        self.size = size
+        self.shard_max_count = shard_max_count
+        self.shard_max_bytes = shard_max_bytes
+        self.classes = set(classes or ())
+        self.lock = threading.Lock()
+        self.subsets = {}
+
+    def add(self, subset: str, label: str, src_path: str, sha: str, data: bytes, pixels=None, ext: str = "jpg"):
+        with self.lock:
+            writer = self.subsets.get(subset)
+            if writer is None:
+                writer = self.subsets[subset] = _SubsetWriter(os.path.join(self.out_dir, subset), self.formats,
+                                                              self.size, self.shard_max_count, self.shard_max_bytes)
+            writer.add(label, src_path, sha, data, pixels, ext)
+
+    def close(self):
+        with self.lock:
+            classes = sorted(self.classes.union(*(w.labels for w in self.subsets.values())))
+            class_index = {name: i for i, name in enumerate(classes)}
+            for writer in self.subsets.values():
+                writer.close(class_index)
+            os.makedirs(self.out_dir, exist_ok=True)
+            with open(os.path.join(self.out_dir, CLASSES), "w", encoding="utf-8") as f:
+                json.dump(classes, f, indent=2, ensure_ascii=False)
+            return {subset: w.count for subset, w in self.subsets.items()}
+
+# ---------- READERS ----------
+def load_classes(pack_dir: str) -> list:
+    with open(os.path.join(pack_dir, CLASSES), encoding="utf-8") as f:
+        return json.load(f)
+
+def load_meta(pack_dir: str, subset: str) -> dict:
+    with open(os.path.join(pack_dir, subset, META), encoding="utf-8") as f:
+        return json.load(f)
+
+def iter_tar(pack_dir: str, subset: str, shuffle_shards: bool = False, seed: int = 0):
+    """Yield (image_bytes, class_index, info) streaming the tar shards of a subset in order."""
+    class_index = {name: i for i, name in enumerate(load_classes(pack_dir))}
+    shards = list(load_meta(pack_dir, subset)["shards"])
+    if shuffle_shards:
+        random.Random(seed).shuffle(shards)
+    for name in shards:
+        with tarfile.open(os.path.join(pack_dir, subset, name), "r|") as tar:
+            data = None
+            for member in tar:
+                payload = tar.extractfile(member).read()
+                if not member.name.endswith(".json"):
+                    data = payload
+                elif data is not None:
+                    info = json.loads(payload)
+                    yield data, class_index[info["label"]], info
+                    data = None
+
+def open_memmap(pack_dir: str, subset: str):
+    """Return (images, labels): images is a read-only np.memmap N x S x S x 3 uint8."""
+    meta = load_meta(pack_dir, subset)
+    if not meta.get("shape"):
+        raise ValueError(f"{pack_dir}/{subset} has no memmap pack (formats: {meta.get('formats')})")
+    images = np.memmap(os.path.join(pack_dir, subset, IMAGES), dtype=np.uint8, mode="r", shape=tuple(meta["shape"]))
+    labels = np.load(os.path.join(pack_dir, subset, LABELS))
+    return images, labels
+
+def memmap_batches(images, labels, batch_size: int, shuffle: bool = True, seed: int = 0):
+    """Yield (x, y) batches. Unshuffled batches are zero-copy views of the memmap;
+    shuffled ones gather a random permutation (indices sorted inside each batch so
+    the reads stay as sequential as possible) into one batch-sized copy."""
+    n = len(labels)
+    if not shuffle:
+        for i in range(0, n, batch_size):
+            yield images[i:i + batch_size], labels[i:i + batch_size]
+        return
+    order = np.random.default_rng(seed).permutation(n)
+    for i in range(0, n, batch_size):
+        idx = np.sort(order[i:i + batch_size])
+        yield images[idx], labels[idx]
+
+# ---------- CONVERT ----------
+def list_split(src: str):
+    """{subset: [(path, label)]} from a dataset_split/ tree (sorted, like flow_from_directory)."""
+    out = {}
+    for subset in SUBSETS:
+        subset_dir = os.path.join(src, subset)
+        if not os.path.isdir(subset_dir):
+            continue
+        items = []
+        for label in sorted(os.listdir(subset_dir)):
+            label_dir = os.path.join(subset_dir, label)
+            if not os.path.isdir(label_dir):
+                continue
+            for fn in sorted(os.listdir(label_dir)):
+                items.append((os.path.join(label_dir, fn), label))
+        out[subset] = items
+    return out
+
+def convert(args):
+    formats = [f for f in args.formats.split(",") if f]
+    codec = get_codec(args.codec)
+    splits = list_split(args.src)
+    # every subset's label folders, even empty ones: a class with no val/test images keeps its index
+    classes = set().union(*(label_folders(os.path.join(args.src, subset)) for subset in splits))
+    writer = PackWriter(args.out, formats, args.size, args.shard_max_count, args.shard_max_bytes, classes)
+    t0 = time.perf_counter()
+    skipped = 0
+    for subset, items in splits.items():
+        # shuffled once here, so sequential reads (tar stream, zero-copy memmap slices) mix classes
+        random.Random(args.seed).shuffle(items)
+        for path, label in items:
+            with open(path, "rb") as f:
+                data = f.read()
+            pixels = None
+            try:
+                if "memmap" in formats:
+                    img, _ = codec.decode(data, args.size)
+                    if codec.dims(img) != (args.size, args.size):
+                        img = codec.resize(img, args.size)
+                    pixels = np.asarray(codec.to_pil(img))
+            except Exception as e:
+                print(f"[SKIP] {path} -> {e}")
+                skipped += 1
+                continue
+            sha = hashlib.sha256(data).hexdigest()
+            # tar member extension = the file's own format (png/webp sources must not be named .jpg)
+            ext = os.path.splitext(path)[1].lstrip(".").lower()
+            ext = "jpg" if ext == "jpeg" else ext
+            writer.add(subset, label, os.path.relpath(path, args.src), sha, data, pixels, ext)
+    counts = writer.close()
+    print(f"[PACK] {', '.join(f'{s}={n}' for s, n in counts.items())} ({skipped} skipped) -> {args.out} "
+          f"[{','.join(formats)}] in {time.perf_counter() - t0:.1f}s")
+
+# ---------- BENCHMARK ----------
+def bench(args):
+    """Samples/s of one pass over a subset: directory (open + decode + resize per sample,
+    like flow_from_directory), tar stream (sequential read + decode) and memmap (no decode)."""
+    items = list_split(args.src).get(args.subset, [])
+    if args.limit:
+        items = items[:args.limit]
+    codec = get_codec(args.codec)
+    size = args.size
+
+    def run(name, fn):
+        t0 = time.perf_counter()
+        n = fn()
+        elapsed = time.perf_counter() - t0
+        print(f"[BENCH] {name:22s}: {n} samples in {elapsed:.2f}s -> {n / elapsed:,.0f} samples/s")
+
+    def directory():
+        n = 0
+        for path, _ in items:
+            with open(path, "rb") as f:
+                img, _ = codec.decode(f.read(), size)
+            codec.resize(img, size)
+            n += 1
+        return n
+
+    def tar_stream():
+        n = 0
+        for data, _, _ in iter_tar(args.packed, args.subset):
+            img, _ = codec.decode(data, size)
+            if codec.dims(img) != (size, size):
+                codec.resize(img, size)
+            n += 1
+            if args.limit and n >= args.limit:
+                break
+        return n
+
+    def memmap(shuffle):
+        def fn():
+            images, labels = open_memmap(args.packed, args.subset)
+            n = 0
+            for x, _ in memmap_batches(images[:args.limit or None], labels[:args.limit or None],
+                                       args.batch, shuffle=shuffle):
+                # touch the pixels: a view alone reads nothing
+                x.sum(dtype=np.uint64)
+                n += len(x)
+            return n
+        return fn
+
+    meta = load_meta(args.packed, args.subset)
+    run("directory", directory)
+    if meta.get("shards"):
+        run("tar stream + decode", tar_stream)
+    if meta.get("shape"):
+        run("memmap sequential", memmap(False))
+        run("memmap shuffled", memmap(True))
+
+def main():
+    parser = argparse.ArgumentParser(description="packed training shards: tar (WebDataset) and uint8 memmap")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("convert", help="pack an existing dataset_split/ tree")
+    p.add_argument("--src", default="dataset_split")
+    p.add_argument("--out", default="dataset_packed")
+    p.add_argument("--formats", default="tar,memmap", help="comma-separated: tar, memmap")
+    p.add_argument("--size", type=int, default=224, help="memmap image side (train_classifier --img_size)")
+    p.add_argument("--codec", choices=tuple(CODECS), default="pillow")
+    p.add_argument("--seed", type=int, default=0, help="write-time shuffle")
+    p.add_argument("--shard-max-count", type=int, default=SHARD_MAX_COUNT)
+    p.add_argument("--shard-max-bytes", type=int, default=SHARD_MAX_BYTES)
+
+    p = sub.add_parser("bench", help="samples/s: directory vs tar shards vs memmap")
+    p.add_argument("--src", default="dataset_split")
+    p.add_argument("--packed", default="dataset_packed")
+    p.add_argument("--subset", default="train", choices=SUBSETS)
+    p.add_argument("--size", type=int, default=224)
+    p.add_argument("--batch", type=int, default=32)
+    p.add_argument("--limit", type=int, default=0)
+    p.add_argument("--codec", choices=tuple(CODECS), default="pillow")
+
+    args = parser.parse_args()
+    if args.command == "convert":
+        convert(args)
+    else:
+        bench(args)
+
+if __name__ == "__main__":
+    main()
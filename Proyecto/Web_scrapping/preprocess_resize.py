@@ -1,10 +1,20 @@
 # preprocess_resize.py
-from PIL import Image
 import os
+import argparse
+from image_codec import get_codec, CODECS
 
-SRC = "dataset"
-DST = "dataset_preprocessed"
-SIZE = (256, 256)
+parser = argparse.ArgumentParser()
+parser.add_argument("--src", default="dataset")
+parser.add_argument("--dst", default="dataset_preprocessed")
+parser.add_argument("--size", type=int, default=256)
+parser.add_argument("--exact-resize", action="store_true", help="full decode + plain LANCZOS (bit-exact)")
+parser.add_argument("--codec", choices=tuple(CODECS), default="pillow", help="decode/resize/encode backend")
+args = parser.parse_args()
+
+SRC = args.src
+DST = args.dst
+SIZE = args.size
+codec = get_codec(args.codec, args.exact_resize)
 
 os.makedirs(DST, exist_ok=True)
 for label in os.listdir(SRC):
@@ -17,10 +27,9 @@ for label in os.listdir(SRC):
         srcpath = os.path.join(srcdir, fn)
         dstpath = os.path.join(dstdir, fn)
         try:
-            with Image.open(srcpath) as im:
-                im = im.convert("RGB")
-                im = im.resize(SIZE, Image.LANCZOS)
-                im.save(dstpath, format="JPEG", quality=90)
+            with open(srcpath, "rb") as f:
+                im, _ = codec.decode(f.read(), SIZE)
+            with open(dstpath, "wb") as f:
+                f.write(codec.encode(codec.resize(im, SIZE), "jpeg"))
         except Exception as e:
             print("skip:", srcpath, e)
-
@@ -1,23 +1,15 @@
 # scraper_dataset.py  (versión para Chrome / chromedriver)
 import os
 import time
-import csv
-import hashlib
-import threading
-from queue import Queue
-import requests
-from PIL import Image
-from io import BytesIO
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-
-# --- Chrome webdriver imports ---
-from selenium.webdriver.chrome.service import Service as ChromeService
-from webdriver_manager.chrome import ChromeDriverManager
-# -----------------------------------
-
+import argparse
 from tqdm import tqdm
 import random
+from metadata_sink import open_sink, backend_for_path
+from label_quota import LabelQuota
+from downloaders import ThreadedDownloader, AsyncDownloader
+from url_frontier import Frontier
+from host_control import HostController
+from url_harvester import make_harvester, EXTRACTORS, SEARCH_URL, PAGE_URL
 
 # CONFIGURACION
 KEYWORDS = [
@@ -34,186 +26,146 @@ KEYWORDS = [
 ]
 IMAGES_PER_LABEL = 200
 OUTPUT_DIR = "dataset"
-CSV_META = "metadata.csv"
+CSV_META = "metadata.csv"   # .parquet / .sqlite también funcionan (ver metadata_sink.py)
+CSV_HEADER = ["filename", "label", "source_url", "width", "height", "sha256"]
 NUM_DOWNLOADER_THREADS = 8
 MAX_SIMULTANEOUS_DOWNLOADS = 5
 MIN_WIDTH = 200
 MIN_HEIGHT = 200
 REQUEST_TIMEOUT = 15
-
-# sincronización
-counter_lock = threading.Lock()
-download_semaphore = threading.Semaphore(MAX_SIMULTANEOUS_DOWNLOADS)
-print_lock = threading.Lock()
-
-download_queue = Queue()
+QUOTA_OVERBOOK = 2  # descargas extra en vuelo por label; se cancelan al completarse el cupo
+ASYNC_CONCURRENCY = 256  # motor async: descargas en vuelo en total
+ASYNC_PER_HOST = 16      # motor async: conexiones simultáneas por host
+FRONTIER_DB = "frontier.sqlite"  # URLs vistas/intentadas y sha256 guardados (ver url_frontier.py)
+NUM_BROWSERS = 3          # navegadores Chrome (o hilos HTTP) reutilizables: keywords extraídos en paralelo
+HARVEST_SLEEP = 1.0       # segundos entre scrolls (selenium) o entre páginas (http)
+MAX_URLS_PER_SEARCH = 2000
+HARVEST_RETRIES = 3       # búsquedas fallidas (Chrome caído, timeout) antes de abandonar un keyword
+HOST_MAX_CONCURRENCY = 32  # --adaptive: techo del límite AIMD por host
+HOST_RATE = 10.0           # --adaptive: peticiones/s por host (token bucket)
+HOST_STATS_INTERVAL = 30   # --adaptive: cada cuántos segundos imprimir las estadísticas por host
 
 # preparar carpetas
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 for kw in KEYWORDS:
     os.makedirs(os.path.join(OUTPUT_DIR, kw.replace(" ", "_")), exist_ok=True)
 
-# CSV
-with open(CSV_META, "w", newline="", encoding="utf-8") as f:
-    writer = csv.writer(f)
-    writer.writerow(["filename", "label", "source_url", "width", "height", "sha256"])
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engine", choices=("threads", "async"), default="threads",
+                        help="motor de descarga (ver downloaders.py)")
+    parser.add_argument("--frontier", default=FRONTIER_DB, help="base SQLite de la frontera de URLs")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="concurrencia/ritmo/timeout adaptativos por host en vez del semáforo fijo (host_control.py)")
+    parser.add_argument("--extractor", choices=EXTRACTORS, default="selenium",
+                        help="extracción de URLs con Chrome (selenium) o sin navegador (http)")
+    parser.add_argument("--browsers", type=int, default=NUM_BROWSERS,
+                        help="navegadores / hilos HTTP en paralelo para extraer URLs (ver url_harvester.py)")
+    parser.add_argument("--search-url", default=SEARCH_URL,
+                        help="plantilla de búsqueda con {q} (p. ej. las páginas de fixtures/ en fixture_server.py)")
+    parser.add_argument("--page-url", default=PAGE_URL,
+                        help="extractor http: plantilla de las páginas siguientes ({q}, {first}, {page}, {count})")
+    args = parser.parse_args()
+
+    frontier = Frontier(args.frontier)
+    seeded = frontier.seed_content(OUTPUT_DIR)
+    if seeded:
+        print(f"[FRONTIER] {seeded} imágenes existentes registradas por sha256")
+    # se agrega a la metadata existente: las corridas se retoman, no empiezan de cero
+    # (parquet no admite append: ese backend se reescribe en cada corrida)
+    meta_sink = open_sink(CSV_META, CSV_HEADER, append=backend_for_path(CSV_META) != "parquet")
+    quota = LabelQuota(OUTPUT_DIR, KEYWORDS, IMAGES_PER_LABEL, overbook=QUOTA_OVERBOOK)
+    controller = None
+    if args.adaptive:
+        controller = HostController(max_limit=HOST_MAX_CONCURRENCY, rate=HOST_RATE, max_timeout=REQUEST_TIMEOUT)
+    common = dict(min_width=MIN_WIDTH, min_height=MIN_HEIGHT, timeout=REQUEST_TIMEOUT, frontier=frontier,
+                  controller=controller)
+    if args.engine == "async":
+        downloader = AsyncDownloader(quota, meta_sink, OUTPUT_DIR, concurrency=ASYNC_CONCURRENCY,
+                                     per_host=ASYNC_PER_HOST, **common)
+    else:
+        downloader = ThreadedDownloader(quota, meta_sink, OUTPUT_DIR, threads=NUM_DOWNLOADER_THREADS,
+                                        max_simultaneous=MAX_SIMULTANEOUS_DOWNLOADS, **common)
+    downloader.start()
+
+    def enqueue(kw, urls):
+        """Llamado por el harvester con cada tanda de URLs: las nuevas se encolan al momento."""
+        new = frontier.add(urls, kw)
+        random.shuffle(new)
+        for url in new:
+            if quota.is_done(kw):
+                break
+            downloader.put((url, kw))
+        return len(new)
 
-def sha256_bytes(b):
-    import hashlib
-    m = hashlib.sha256()
-    m.update(b)
-    return m.hexdigest()
+    def search(kw):
+        print(f"[SEARCH] Procurando URLs para: '{kw}'")
+        return harvester.submit(kw, should_stop=lambda: quota.is_done(kw))
 
-def downloader_worker():
-    while True:
-        item = download_queue.get()
-        if item is None:
-            download_queue.task_done()
-            break
-        url, label = item
-        label_dir = os.path.join(OUTPUT_DIR, label.replace(" ", "_"))
+    harvester = make_harvester(args.extractor, args.browsers, enqueue, MAX_URLS_PER_SEARCH, HARVEST_SLEEP,
+                               args.search_url, args.page_url)
+    t_start = time.time()
+    last_report = t_start
 
-        with counter_lock:
-            cur_count = len([name for name in os.listdir(label_dir) if os.path.isfile(os.path.join(label_dir, name))])
-            if cur_count >= IMAGES_PER_LABEL:
-                download_queue.task_done()
+    searches = {}  # keyword -> Future de su búsqueda (None: se retomaron URLs pendientes)
+    failures = dict.fromkeys(KEYWORDS, 0)
+    for kw in KEYWORDS:
+        if quota.is_done(kw):
+            print(f"[DONE] {kw} ya tiene {quota.count(kw)} imágenes")
+            continue
+        # primero lo que quedó encolado sin intentar en una corrida anterior
+        pending = frontier.pending(kw)
+        if pending:
+            print(f"[RESUME] {len(pending)} urls pendientes para '{kw}'")
+            random.shuffle(pending)
+            for url in pending:
+                downloader.put((url, kw))
+            searches[kw] = None
+        else:
+            searches[kw] = search(kw)
+
+    while searches:
+        for kw, future in list(searches.items()):
+            if quota.is_done(kw):
+                # una búsqueda en curso se corta sola (should_stop)
+                print(f"[DONE] {kw} tiene {quota.count(kw)} imágenes")
+                del searches[kw]
                 continue
-download_semaphore.acquire()
-        try:
-            try:
-                resp = requests.get(url, timeout=REQUEST_TIMEOUT, headers={"User-Agent": "Mozilla/5.0"})
-                resp.raise_for_status()
-                img = Image.open(BytesIO(resp.content)).convert("RGB")
-            except Exception as e:
-                with print_lock:
-                    print(f"[ERROR] descargar {url}: {e}")
+            # mientras se extrae o queda algo en cola / en vuelo, solo esperar
+            if (future is not None and not future.done()) or not downloader.empty() or quota.is_full(kw):
                 continue
-            finally:
-                download_semaphore.release()
-
-            w, h = img.size
-            if w < MIN_WIDTH or h < MIN_HEIGHT:
-                with print_lock:
-                    print(f"[SKIP] {url} (too small {w}x{h})")
+            if future is not None and future.exception() is not None:
+                failures[kw] += 1
+                print(f"[ERROR] búsqueda de '{kw}' falló ({failures[kw]}/{HARVEST_RETRIES}): {future.exception()}")
+                if failures[kw] >= HARVEST_RETRIES:
+                    del searches[kw]
+                else:
+                    searches[kw] = search(kw)
                 continue
-
-            img_bytes = BytesIO()
-            img.save(img_bytes, format="JPEG", quality=85)
-            b = img_bytes.getvalue()
-            hsh = sha256_bytes(b)
-
-            with counter_lock:
-                cur_count = len([name for name in os.listdir(label_dir) if os.path.isfile(os.path.join(label_dir, name))])
-                if cur_count >= IMAGES_PER_LABEL:
-                    continue
-                filename = f"{label.replace(' ','_')}_{cur_count+1:05d}.jpg"
-                path = os.path.join(label_dir, filename)
-                with open(path, "wb") as f:
-                    f.write(b)
-                with open(CSV_META, "a", newline="", encoding="utf-8") as f_meta:
-                    writer = csv.writer(f_meta)
-                    writer.writerow([filename, label, url, w, h, hsh])
-
-            with print_lock:
-                print(f"[SAVED] {path} from {url}")
-
-        finally:
-            download_queue.task_done()
-
-def fetch_image_urls_for_keyword(keyword, max_urls=1000, sleep_between_scrolls=1):
-    urls = set()
-    # configurar Selenium con Chrome
-    options = webdriver.ChromeOptions()
-    # headless puede ser True o False
-    options.add_argument("--headless=new")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    # Opcional: user-agent
-    options.add_argument("user-agent=Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
-    service = ChromeService(ChromeDriverManager().install())
-    driver = webdriver.Chrome(service=service, options=options)
-
-    try:
-        search_url = "https://www.bing.com/images/search?q=" + keyword.replace(" ", "+")
-        driver.get(search_url)
-        time.sleep(1)
-        last_height = driver.execute_script("return document.body.scrollHeight")
-        scrolls = 0
-        while len(urls) < max_urls and scrolls < 200:
-            thumbs = driver.find_elements(By.CSS_SELECTOR, "img.mimg")
-            for t in thumbs:
-                src = t.get_attribute("src")
-                data_src = t.get_attribute("data-src")
-                if data_src and data_src.startswith("http"):
-                    urls.add(data_src)
-                elif src and src.startswith("http"):
-                    urls.add(src)
-            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(sleep_between_scrolls)
-            new_height = driver.execute_script("return document.body.scrollHeight")
-            if new_height == last_height:
-                break
-            last_height = new_height
-            scrolls += 1
-
-        thumbs = driver.find_elements(By.CSS_SELECTOR, "a.iusc")
-        for a in thumbs:
-            try:
-                a.click()
-                time.sleep(0.2)
-                imgs = driver.find_elements(By.CSS_SELECTOR, "img.nofocus")
-                for img in imgs:
-                    src = img.get_attribute("src")
-                    if src and src.startswith("http"):
-                        urls.add(src)
-            except Exception:
+            if future is not None and future.result() == 0:
+                # la búsqueda ya no devuelve nada sin intentar: reextraer no sirve
+                print(f"[WARN] sin urls nuevas para '{kw}', queda con {quota.count(kw)} imágenes")
+                del searches[kw]
                 continue
+            print(f"[INFO] cola vacía pero '{kw}' no acabó, reextrayendo otras urls...")
+            searches[kw] = search(kw)
+        if controller is not None and time.time() - last_report >= HOST_STATS_INTERVAL:
+            print("[HOSTS]\n" + controller.report())
+            last_report = time.time()
+        time.sleep(1)
 
-    finally:
-        driver.quit()
-    return list(urls)
-
-if __name__ == "__main__":
-    threads = []
-    for _ in range(NUM_DOWNLOADER_THREADS):
-        t = threading.Thread(target=downloader_worker, daemon=True)
-        t.start()
-        threads.append(t)
-
-    for kw in KEYWORDS:
-        print(f"\n[SEARCH] Procurando URLs para: '{kw}'")
-        urls = fetch_image_urls_for_keyword(kw, max_urls=2000)
-        print(f"[FOUND] {len(urls)} image urls for '{kw}'")
-        random.shuffle(urls)
-
-        for url in urls:
-            label_dir = os.path.join(OUTPUT_DIR, kw.replace(" ", "_"))
-            with counter_lock:
-                cur_count = len([name for name in os.listdir(label_dir) if os.path.isfile(os.path.join(label_dir, name))])
-            if cur_count >= IMAGES_PER_LABEL:
-                print(f"[DONE] {kw} tiene {cur_count} imágenes")
-                break
-            download_queue.put((url, kw))
-
-        while True:
-            label_dir = os.path.join(OUTPUT_DIR, kw.replace(" ", "_"))
-            with counter_lock:
-                cur_count = len([name for name in os.listdir(label_dir) if os.path.isfile(os.path.join(label_dir, name))])
-            if cur_count >= IMAGES_PER_LABEL:
-                break
-            if download_queue.empty():
-                print("[INFO] cola vacía pero no acabado, reextrayendo otras urls...")
-                extra_urls = fetch_image_urls_for_keyword(kw, max_urls=2000)
-                random.shuffle(extra_urls)
-                for url in extra_urls:
-                    download_queue.put((url, kw))
-            time.sleep(1)
-
-    for _ in threads:
-        download_queue.put(None)
-    download_queue.join()
-    for t in threads:
-        t.join(timeout=1)
-
+    harvester.close()
+    downloader.close()
+    meta_sink.close()
+    frontier_counts = frontier.counts()
+    frontier.close()
+
+    elapsed = time.time() - t_start
+    st = downloader.stats
+    print(f"[STATS] engine={args.engine} extractor={args.extractor} guardadas={st['saved']} errores={st['error']} "
+          f"descartadas={st['skipped']} canceladas={st['cancelled']} duplicadas={st['duplicate']} "
+          f"host_cortado={st['breaker']} reintentos={st['retries']} en {elapsed:.0f}s")
+    if controller is not None:
+        print("[HOSTS]\n" + controller.report())
+    print(f"[FRONTIER] {frontier_counts}")
     print("Proceso completado.")
@@ -1,31 +1,195 @@
 # split_dataset.py
-import os, random, shutil
+#
+# Reparte dataset_preprocessed/ en train/val/test de forma determinista:
+# el subconjunto de cada imagen sale del sha256 de su imagen de ORIGEN (no de un
+# shuffle), así una imagen nunca cambia de split cuando se agregan otras, ni cuando
+# se reprocesa con otro --codec/--size/--exact-resize/versión de Pillow (eso cambia
+# el sha256 del archivo preprocesado, no el del origen). etl_pipeline.py --pack usa
+# la misma clave.
+#
+# El sha256 de origen se busca, en orden, en: el manifiesto del ETL (--manifest,
+# src_path -> src_sha256), el metadata.csv del scraper (--src-meta, carpeta de
+# label + filename -> sha256) o hasheando el src_path que da metadata_processed.csv.
+# Si no hay forma de llegar al origen se usa el del archivo preprocesado (se avisa).
+#
+# En lugar de copiar, el split se materializa con hardlinks (por defecto),
+# symlinks, copias, o solo como manifiesto CSV. Las corridas son incrementales:
+# los enlaces que ya apuntan al archivo correcto no se tocan y se eliminan los
+# de imágenes que ya no están en el origen.
+#
+# Uso:
+#   python3 split_dataset.py                        # hardlinks en dataset_split/
+#   python3 split_dataset.py --mode manifest        # solo dataset_split/split_manifest.csv
+import os, csv, shutil, sqlite3, hashlib, argparse
+from check_corrupt import load_quarantine
+from label_quota import LabelQuota
 
 SRC = "dataset_preprocessed"
 DST = "dataset_split"
+META = "metadata_processed.csv"   # dst_path -> src_path (imagen de origen)
+SRC_META = "metadata.csv"         # del scraper: sha256 de cada imagen descargada
+ETL_MANIFEST = "etl_manifest.sqlite"  # de etl_pipeline.py --incremental: src_sha256 por src_path
 RATIOS = (0.8, 0.1, 0.1)  # train, val, test
-SEED = 42
-
-random.seed(SEED)
-os.makedirs(DST, exist_ok=True)
-for subset in ("train","val","test"):
-    os.makedirs(os.path.join(DST, subset), exist_ok=True)
-
-for label in sorted(os.listdir(SRC)):
-    srcdir = os.path.join(SRC, label)
-    if not os.path.isdir(srcdir): continue
-    files = [f for f in os.listdir(srcdir) if os.path.isfile(os.path.join(srcdir,f))]
-    random.shuffle(files)
-    n = len(files)
-    n_train = int(n * RATIOS[0])
-    n_val = int(n * RATIOS[1])
-    train_files = files[:n_train]
-    val_files = files[n_train:n_train+n_val]
-    test_files = files[n_train+n_val:]
-    for subset, flist in (("train", train_files), ("val", val_files), ("test", test_files)):
-        target_dir = os.path.join(DST, subset, label)
-        os.makedirs(target_dir, exist_ok=True)
-        for f in flist:
-            shutil.copy2(os.path.join(srcdir, f), os.path.join(target_dir, f))
-
-    print(f"{label}: total={n}, train={len(train_files)}, val={len(val_files)}, test={len(test_files)}")
+QUARANTINE = "quarantine.json"  # reporte de check_corrupt.py (si existe se saltan esos archivos)
+MANIFEST = "split_manifest.csv"
+SUBSETS = ("train", "val", "test")
+
+def sha256_of_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _csv_rows(path):
+    # los CSV del repo empiezan con una línea '#' y una en blanco
+    with open(path, newline="", encoding="utf-8") as f:
+        yield from csv.DictReader(line for line in f if line.strip() and not line.startswith("#"))
+
+def load_source_paths(meta_path):
+    """dst_path normalizado -> src_path, desde metadata_processed.csv."""
+    if not meta_path or not os.path.exists(meta_path):
+        return {}
+    return {os.path.normpath(row["dst_path"]): row["src_path"]
+            for row in _csv_rows(meta_path) if row.get("dst_path") and row.get("src_path")}
+
+class SourceHashes:
+    """sha256 de la imagen de origen de cada archivo preprocesado (la clave del split)."""
+    def __init__(self, meta_path=META, src_meta_path=SRC_META, manifest_path=ETL_MANIFEST):
+        self.src_paths = load_source_paths(meta_path)
+        self.by_path = {}   # src_path normalizado -> sha256 (manifiesto del ETL)
+        self.by_name = {}   # (carpeta de label, filename) -> sha256 (metadata.csv del scraper)
+        self.fallback = 0   # archivos sin origen conocido: se usó el sha256 del preprocesado
+        if manifest_path and os.path.exists(manifest_path):
+            conn = sqlite3.connect(f"file:{manifest_path}?mode=ro", uri=True)
+            try:
+                for src, sha in conn.execute("SELECT src_path, src_sha256 FROM files WHERE src_sha256 IS NOT NULL"):
+                    self.by_path[os.path.normpath(src)] = sha
+            finally:
+                conn.close()
+        if src_meta_path and os.path.exists(src_meta_path):
+            for row in _csv_rows(src_meta_path):
+                if row.get("filename") and row.get("sha256"):
+                    self.by_name[(LabelQuota.folder(row["label"]), row["filename"])] = row["sha256"]
+
+    def _by_name(self, path):
+        return self.by_name.get((os.path.basename(os.path.dirname(path)), os.path.basename(path)))
+
+    def get(self, dst_path):
+        src = self.src_paths.get(os.path.normpath(dst_path))
+        if src:
+            sha = self.by_path.get(os.path.normpath(src)) or self._by_name(src)
+            if sha:
+                return sha
+            if os.path.isfile(src):
+                return sha256_of_file(src)
+        # sin fila en metadata_processed.csv: el ETL conserva carpeta de label y nombre del origen
+        sha = self._by_name(dst_path)
+        if sha:
+            return sha
+        self.fallback += 1
+        return sha256_of_file(dst_path)
+
+def subset_for(sha, ratios=RATIOS):
+    """Posición estable en [0, 1) derivada del sha256 (de la imagen de origen) -> train/val/test."""
+    x = int(sha[:16], 16) / float(1 << 64)
+    if x < ratios[0]:
+        return "train"
+    if x < ratios[0] + ratios[1]:
+        return "val"
+    return "test"
+
+def _up_to_date(src_path, target, mode):
+    if mode == "symlink":
+        return os.path.islink(target) and os.path.samefile(src_path, target)
+    if os.path.islink(target):
+        return False
+    if os.path.samefile(src_path, target):
+        return True
+    # copia (o hardlink que cayó a copia): copy2 conserva tamaño y mtime
+    a, b = os.stat(src_path), os.stat(target)
+    return a.st_size == b.st_size and a.st_mtime_ns == b.st_mtime_ns
+
+def materialize(src_path, target, mode):
+    """Crea target según el modo; devuelve False si ya estaba al día."""
+    if os.path.lexists(target):
+        try:
+            if _up_to_date(src_path, target, mode):
+                return False
+        except OSError:
+            pass  # symlink roto
+        os.remove(target)
+    if mode == "symlink":
+        os.symlink(os.path.relpath(src_path, os.path.dirname(target)), target)
+    elif mode == "hardlink":
+        try:
+            os.link(src_path, target)
+        except OSError:
+            # otro filesystem o sin soporte de hardlinks: copiar
+            shutil.copy2(src_path, target)
+    else:
+        shutil.copy2(src_path, target)
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="split determinista train/val/test por sha256")
+    parser.add_argument("--src", default=SRC)
+    parser.add_argument("--dst", default=DST)
+    parser.add_argument("--meta", default=META, help="metadata_processed.csv: dst_path -> src_path")
+    parser.add_argument("--src-meta", default=SRC_META, help="metadata.csv del scraper (sha256 de origen)")
+    parser.add_argument("--manifest", default=ETL_MANIFEST, help="manifiesto SQLite del ETL (src_sha256)")
+    parser.add_argument("--quarantine", default=QUARANTINE)
+    parser.add_argument("--mode", choices=("hardlink", "symlink", "copy", "manifest"), default="hardlink")
+    args = parser.parse_args()
+
+    quarantined = load_quarantine(args.quarantine)
+    known = SourceHashes(args.meta, args.src_meta, args.manifest)
+    os.makedirs(args.dst, exist_ok=True)
+
+    rows = []
+    wanted = set()
+    created = 0
+    for label in sorted(os.listdir(args.src)):
+        srcdir = os.path.join(args.src, label)
+        if not os.path.isdir(srcdir): continue
+        counts = dict.fromkeys(SUBSETS, 0)
+        for f in sorted(os.listdir(srcdir)):
+            src_path = os.path.join(srcdir, f)
+            if not os.path.isfile(src_path) or os.path.join(label, f) in quarantined:
+                continue
+            sha = known.get(src_path)
+            subset = subset_for(sha)
+            counts[subset] += 1
+            rows.append([src_path, label, subset, sha])
+            if args.mode != "manifest":
+                target_dir = os.path.join(args.dst, subset, label)
+                os.makedirs(target_dir, exist_ok=True)
+                target = os.path.join(target_dir, f)
+                wanted.add(os.path.normpath(target))
+                created += materialize(src_path, target, args.mode)
+        n = sum(counts.values())
+        print(f"{label}: total={n}, train={counts['train']}, val={counts['val']}, test={counts['test']}")
+
+    # quitar lo que ya no corresponde (imágenes borradas, en cuarentena o que cambiaron de contenido)
+    removed = 0
+    if args.mode != "manifest":
+        for subset in SUBSETS:
+            for root, _, files in os.walk(os.path.join(args.dst, subset)):
+                for f in files:
+                    path = os.path.normpath(os.path.join(root, f))
+                    if path not in wanted:
+                        os.remove(path)
+                        removed += 1
+
+    with open(os.path.join(args.dst, MANIFEST), "w", newline="", encoding="utf-8") as mf:
+        writer = csv.writer(mf)
+        writer.writerow(["src_path", "label", "subset", "src_sha256"])
+        writer.writerows(rows)
+    if known.fallback:
+        print(f"[SPLIT][WARN] {known.fallback} archivos sin imagen de origen conocida: "
+              f"se repartieron por el sha256 del preprocesado (pueden cambiar de split si se reprocesan)")
+    print(f"[SPLIT] mode={args.mode}: {created} nuevos, {removed} eliminados, manifiesto en "
+          f"{os.path.join(args.dst, MANIFEST)}")
+
+if __name__ == "__main__":
+    main()
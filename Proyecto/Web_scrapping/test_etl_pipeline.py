@@ -0,0 +1,62 @@
+# test_etl_pipeline.py
+#
+# End-to-end checks of etl_pipeline.py on a tiny generated dataset (run with pytest).
+import os
+import sys
+import json
+import subprocess
+import pytest
+from PIL import Image
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(HERE, "etl_pipeline.py")
+# PIL format name -> extensions a file of that format may carry
+FORMAT_EXTS = {"JPEG": (".jpg", ".jpeg"), "PNG": (".png",), "WEBP": (".webp",)}
+
+def make_dataset(root, labels=("cat", "dog"), per_label=3):
+    for i, label in enumerate(labels):
+        os.makedirs(os.path.join(root, label))
+        for j in range(per_label):
+            Image.new("RGB", (80, 60), (40 * i, 30 * j, 90)).save(os.path.join(root, label, f"{label}_{j:05d}.jpg"))
+
+def run_etl(cwd, *argv):
+    subprocess.run([sys.executable, SCRIPT, "--src", "dataset", *argv], cwd=cwd, check=True,
+                   stdout=subprocess.DEVNULL)
+
+def files_under(root):
+    return [os.path.join(d, f) for d, _, files in os.walk(root) for f in files]
+
+@pytest.mark.parametrize("sizes", ["48:webp,32", "48:png,32:webp", "48,32:webp"])
+def test_every_variant_extension_matches_its_format(tmp_path, sizes):
+    make_dataset(tmp_path / "dataset")
+    run_etl(tmp_path, "--sizes", sizes, "--pack", "tar")
+    # --dst holds the first variant, dataset_preprocessed_<tag>/ the others
+    trees = [tmp_path / d for d in os.listdir(tmp_path) if d.startswith("dataset_preprocessed")]
+    assert len(trees) == 2
+    outputs = [p for tree in trees for p in files_under(tree)]
+    assert len(outputs) == 12
+    for path in outputs:
+        with Image.open(path) as im:
+            assert os.path.splitext(path)[1].lower() in FORMAT_EXTS[im.format], path
+
+def test_first_variant_keeps_the_label_layout(tmp_path):
+    make_dataset(tmp_path / "dataset")
+    run_etl(tmp_path, "--sizes", "48,32:webp")
+    # split_dataset.py / train_classifier.py take every folder of --dst as a label
+    assert sorted(os.listdir(tmp_path / "dataset_preprocessed")) == ["cat", "dog"]
+    assert sorted(os.listdir(tmp_path / "dataset_preprocessed_32_webp")) == ["cat", "dog"]
+    with Image.open(files_under(tmp_path / "dataset_preprocessed")[0]) as im:
+        assert im.size == (48, 48)
+
+def test_pack_classes_come_from_the_source_folders(tmp_path):
+    make_dataset(tmp_path / "dataset", labels=("ant", "bee", "cat"))
+    # --limit 3 only sees "ant": the pack must still list (and index) every class
+    run_etl(tmp_path, "--size", "32", "--limit", "3", "--pack", "memmap")
+    with open(tmp_path / "dataset_packed" / "classes.json", encoding="utf-8") as f:
+        assert json.load(f) == ["ant", "bee", "cat"]
+
+def test_pack_refuses_sharded_runs(tmp_path):
+    make_dataset(tmp_path / "dataset")
+    with pytest.raises(subprocess.CalledProcessError):
+        subprocess.run([sys.executable, SCRIPT, "--src", "dataset", "--pack", "tar", "--num-shards", "2"],
+                       cwd=tmp_path, check=True, capture_output=True)
@@ -0,0 +1,210 @@
+# url_frontier.py
+#
+# Frontera persistente de URLs para scraper_dataset.py (sobrevive a reinicios y caídas).
+#
+# Tabla urls: cada URL vista con su label y estado
+#   seen       extraída y encolada, todavía sin intentar
+#   attempted  un worker empezó a descargarla
+#   failed     error HTTP / imagen rechazada / contenido duplicado (columna error)
+#   ok         guardada; sha256 del contenido escrito
+# Tabla content: sha256 de cada imagen que ya está en el dataset.
+#
+# Una URL que ya se intentó (attempted/failed/ok) no se vuelve a descargar nunca;
+# las que quedaron en "seen" cuando se cortó la corrida se reencolan con pending().
+# defer() devuelve a "seen" una URL que no se pudo intentar (breaker del host abierto).
+# Un Bloom filter en memoria con todas las URLs conocidas evita ir a SQLite por
+# cada URL nueva: si el filtro dice "no está", seguro que es nueva.
+#
+#   frontier = Frontier("frontier.sqlite")
+#   for url in frontier.add(urls, label): downloader.put((url, label))
+#   frontier.attempt(url); ... frontier.fail(url, "http 404") / frontier.done(url, sha)
+#   if not frontier.claim_content(sha): descartar (ya está en el dataset)
+#
+# Se hace commit cada COMMIT_EVERY escrituras o COMMIT_INTERVAL segundos: una caída
+# pierde como mucho esa cola (esas URLs se reintentan al reiniciar).
+import os
+import math
+import time
+import sqlite3
+import hashlib
+import threading
+
+COMMIT_EVERY = 256
+COMMIT_INTERVAL = 2.0  # segundos
+BLOOM_CAPACITY = 1_000_000
+BLOOM_ERROR_RATE = 0.001
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS urls (
+    url      TEXT PRIMARY KEY,
+    label    TEXT NOT NULL,
+    state    TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error    TEXT,
+    sha256   TEXT,
+    updated  REAL
+);
+CREATE INDEX IF NOT EXISTS urls_label_state ON urls (label, state);
+CREATE TABLE IF NOT EXISTS content (
+    sha256   TEXT PRIMARY KEY,
+    label    TEXT,
+    filename TEXT,
+    url      TEXT
+);
+"""
+
+class BloomFilter:
+    """Bloom filter sobre un bytearray; k posiciones por doble hashing de un blake2b de 128 bits."""
+
+    def __init__(self, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE):
+        capacity = max(1, capacity)
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key):
+        d = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(d[:8], "little")
+        h2 = int.from_bytes(d[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for p in self._positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+def sha256_of_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class Frontier:
+    def __init__(self, path, capacity=BLOOM_CAPACITY):
+        self.path = path
+        # la usan los hilos de descarga y el hilo principal: una conexión + lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self.lock = threading.Lock()
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+
+        n_urls = self.conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+        self.bloom = BloomFilter(max(capacity, 2 * n_urls))
+        for (url,) in self.conn.execute("SELECT url FROM urls"):
+            self.bloom.add(url)
+        # el set de sha256 es chico (una entrada por imagen guardada): en memoria completo
+        self.content = {sha for (sha,) in self.conn.execute("SELECT sha256 FROM content")}
+
+    # ---------- URLS ----------
+    def add(self, urls, label):
+        """Registra URLs extraídas; devuelve las que hay que descargar (nuevas, sin repetir)."""
+        new = []
+        with self.lock:
+            for url in dict.fromkeys(urls):
+                # el Bloom filter no tiene falsos negativos: si no está, es nueva
+                if url in self.bloom and self.conn.execute(
+                        "SELECT 1 FROM urls WHERE url=?", (url,)).fetchone():
+                    continue
+                self.bloom.add(url)
+                new.append(url)
+            now = time.time()
+            self.conn.executemany("INSERT OR IGNORE INTO urls (url, label, state, updated) VALUES (?,?,'seen',?)",
+                                  [(url, label, now) for url in new])
+            self._wrote(len(new))
+        return new
+
+    def pending(self, label):
+        """URLs extraídas en una corrida anterior que nunca llegaron a intentarse."""
+        with self.lock:
+            return [url for (url,) in self.conn.execute(
+                "SELECT url FROM urls WHERE label=? AND state='seen'", (label,))]
+
+    def attempt(self, url):
+        self._set("UPDATE urls SET state='attempted', attempts=attempts+1, updated=? WHERE url=?",
+                  (time.time(), url))
+
+    def defer(self, url):
+        """La URL no se llegó a descargar (host cortado): vuelve a 'seen' para reintentarse."""
+        self._set("UPDATE urls SET state='seen', updated=? WHERE url=?", (time.time(), url))
+
+    def fail(self, url, error):
+        self._set("UPDATE urls SET state='failed', error=?, updated=? WHERE url=?",
+                  (str(error)[:500], time.time(), url))
+
+    def done(self, url, sha):
+        self._set("UPDATE urls SET state='ok', sha256=?, error=NULL, updated=? WHERE url=?",
+                  (sha, time.time(), url))
+
+    def _set(self, sql, params):
+        with self.lock:
+            self.conn.execute(sql, params)
+            self._wrote(1)
+
+    # ---------- CONTENIDO ----------
+    def claim_content(self, sha, label=None, url=None):
+        """Reserva un sha256 antes de escribir el archivo; False si ese contenido ya está en el dataset."""
+        with self.lock:
+            if sha in self.content:
+                return False
+            self.content.add(sha)
+            self.conn.execute("INSERT OR IGNORE INTO content (sha256, label, url) VALUES (?,?,?)",
+                              (sha, label, url))
+            self._wrote(1)
+            return True
+
+    def set_filename(self, sha, filename):
+        self._set("UPDATE content SET filename=? WHERE sha256=?", (filename, sha))
+
+    def unclaim_content(self, sha):
+        """Deshace claim_content() cuando el archivo al final no se escribió."""
+        with self.lock:
+            self.content.discard(sha)
+            self.conn.execute("DELETE FROM content WHERE sha256=?", (sha,))
+            self._wrote(1)
+
+    def seed_content(self, output_dir):
+        """Carga los sha256 de las imágenes que ya están en output_dir (solo si la tabla está vacía)."""
+        if self.content or not os.path.isdir(output_dir):
+            return 0
+        rows = []
+        for root, _, files in os.walk(output_dir):
+            for f in files:
+                sha = sha256_of_file(os.path.join(root, f))
+                if sha not in self.content:
+                    self.content.add(sha)
+                    rows.append((sha, os.path.basename(root), f))
+        with self.lock:
+            self.conn.executemany("INSERT OR IGNORE INTO content (sha256, label, filename) VALUES (?,?,?)", rows)
+            self.conn.commit()
+        return len(rows)
+
+    # ---------- RESUMEN ----------
+    def counts(self, label=None):
+        """{estado: cantidad} de todas las URLs (o de un label)."""
+        with self.lock:
+            if label is None:
+                rows = self.conn.execute("SELECT state, COUNT(*) FROM urls GROUP BY state")
+            else:
+                rows = self.conn.execute("SELECT state, COUNT(*) FROM urls WHERE label=? GROUP BY state", (label,))
+            return dict(rows.fetchall())
+
+    def _wrote(self, n):
+        # llamado con self.lock tomado
+        self.uncommitted += n
+        now = time.monotonic()
+        if self.uncommitted >= COMMIT_EVERY or (self.uncommitted and now - self.last_commit >= COMMIT_INTERVAL):
+            self.conn.commit()
+            self.uncommitted = 0
+            self.last_commit = now
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
@@ -0,0 +1,391 @@
+# url_harvester.py
+#
+# Extracción de URLs de imágenes (búsqueda de imágenes de Bing) para scraper_dataset.py.
+# Dos backends con la misma interfaz (submit(keyword, should_stop) -> Future, close()):
+#
+# selenium (Harvester), con un pool de navegadores reutilizables:
+# - DriverPool: hasta N sesiones de Chrome headless; ChromeDriverManager().install()
+#   se resuelve una sola vez y cada sesión se reutiliza entre keywords.
+# - harvest_keyword(): por cada "página" de scroll, un solo execute_script lee todos
+#   los a.iusc (su atributo m es un JSON con murl = imagen original) y los img.mimg,
+#   y hace el scroll siguiente. No se hace click en cada miniatura.
+# - Harvester: varios keywords en paralelo (uno por navegador); cada tanda de URLs
+#   nuevas se entrega enseguida a on_urls(keyword, urls), así la cola de descargas
+#   se alimenta mientras se sigue haciendo scroll.
+#
+# http (HttpHarvester), sin navegador: pide la página de resultados y los bloques
+# siguientes del scroll infinito (images/async?first=N) con requests, y saca las URLs
+# del HTML con expresiones regulares sobre los tags a.iusc / img.mimg (mismo JSON m).
+# Mucho más liviano en arranque y memoria; no ejecuta JavaScript.
+#
+# Prueba / comparación sin internet contra las páginas grabadas en fixtures/bing/:
+#   python3 url_harvester.py --fixture --extractor both --workers 3
+import os
+import re
+import html
+import json
+import time
+import argparse
+import threading
+from queue import Queue, Empty
+from contextlib import contextmanager
+from functools import lru_cache
+from urllib.parse import quote_plus
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+# Optional: selenium solo hace falta para el backend con navegador
+try:
+    from selenium import webdriver
+    from selenium.common.exceptions import WebDriverException
+
+    # --- Chrome webdriver imports ---
+    from selenium.webdriver.chrome.service import Service as ChromeService
+    from webdriver_manager.chrome import ChromeDriverManager
+    # -----------------------------------
+    SELENIUM_AVAILABLE = True
+except Exception:
+    SELENIUM_AVAILABLE = False
+
+SEARCH_URL = "https://www.bing.com/images/search?q={q}"
+# bloques siguientes del scroll infinito; {first} = índice del primer resultado, {page} = 1, 2, ...
+PAGE_URL = "https://www.bing.com/images/async?q={q}&first={first}&count={count}&mmasync=1"
+PAGE_SIZE = 35
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+MAX_SCROLLS = 200
+
+# Un round-trip por página: extrae todo lo visible, hace scroll y devuelve [urls, altura].
+HARVEST_JS = """
+const out = [];
+for (const a of document.querySelectorAll('a.iusc')) {
+    const m = a.getAttribute('m');
+    if (!m) continue;
+    try {
+        const meta = JSON.parse(m);
+        if (meta.murl) out.push(meta.murl);
+    } catch (e) {}
+}
+for (const img of document.querySelectorAll('img.mimg')) {
+    const src = img.getAttribute('data-src') || img.getAttribute('src');
+    if (src) out.push(src);
+}
+const height = document.body.scrollHeight;
+window.scrollTo(0, height);
+return [out.filter(u => u.startsWith('http')), height];
+"""
+
+# ---------- SELENIUM ----------
+@lru_cache(maxsize=1)
+def chromedriver_path():
+    return ChromeDriverManager().install()
+
+def make_driver(headless=True):
+    options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument("--headless=new")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument(f"user-agent={USER_AGENT}")
+    return webdriver.Chrome(service=ChromeService(chromedriver_path()), options=options)
+
+class DriverPool:
+    """Hasta size navegadores; se crean a demanda y se devuelven al pool después de cada uso."""
+
+    def __init__(self, size, headless=True):
+        self.size = size
+        self.headless = headless
+        self.idle = Queue()
+        self.lock = threading.Lock()
+        self.drivers = []
+
+    def _acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except Empty:
+            pass
+        with self.lock:
+            if len(self.drivers) < self.size:
+                driver = make_driver(self.headless)
+                self.drivers.append(driver)
+                return driver
+        return self.idle.get()
+
+    @contextmanager
+    def driver(self):
+        driver = self._acquire()
+        broken = False
+        try:
+            yield driver
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            if broken:
+                # sesión rota (Chrome se cayó, timeout...): se descarta y se crea otra la próxima vez
+                with self.lock:
+                    self.drivers.remove(driver)
+                try:
+                    driver.quit()
+                except Exception:
+                    pass
+            else:
+                self.idle.put(driver)
+
+    def close(self):
+        with self.lock:
+            for driver in self.drivers:
+                try:
+                    driver.quit()
+                except Exception:
+                    pass
+            self.drivers.clear()
+
+def harvest_keyword(driver, keyword, on_urls, max_urls=1000, sleep_between_scrolls=1.0,
+                    search_url=SEARCH_URL, should_stop=None):
+    """Hace scroll por los resultados de keyword y entrega cada tanda nueva a on_urls(keyword, urls).
+
+    Devuelve la suma de lo que devuelve on_urls (p. ej. cuántas URLs eran nuevas para la frontera).
+    """
+    driver.get(search_url.format(q=quote_plus(keyword)))
+    time.sleep(sleep_between_scrolls)
+    seen = set()
+    total = 0
+    last_height = None
+    for _ in range(MAX_SCROLLS):
+        urls, height = driver.execute_script(HARVEST_JS)
+        new = [u for u in dict.fromkeys(urls) if u not in seen]
+        if new:
+            seen.update(new)
+            total += on_urls(keyword, new) or 0
+        if len(seen) >= max_urls or height == last_height or (should_stop and should_stop()):
+            break
+        last_height = height
+        time.sleep(sleep_between_scrolls)
+    return total
+
+class Harvester:
+    """Extrae varios keywords a la vez, uno por navegador del pool."""
+
+    def __init__(self, browsers, on_urls, max_urls=1000, sleep_between_scrolls=1.0,
+                 search_url=SEARCH_URL, headless=True):
+        if not SELENIUM_AVAILABLE:
+            raise RuntimeError("el extractor selenium necesita selenium y webdriver-manager (o usar --extractor http)")
+        self.pool = DriverPool(browsers, headless)
+        self.executor = ThreadPoolExecutor(max_workers=browsers)
+        self.on_urls = on_urls
+        self.max_urls = max_urls
+        self.sleep_between_scrolls = sleep_between_scrolls
+        self.search_url = search_url
+
+    def _run(self, keyword, should_stop):
+        with self.pool.driver() as driver:
+            return harvest_keyword(driver, keyword, self.on_urls, self.max_urls,
+                                   self.sleep_between_scrolls, self.search_url, should_stop)
+
+    def submit(self, keyword, should_stop=None):
+        """Future cuyo resultado es el total devuelto por on_urls para este keyword."""
+        return self.executor.submit(self._run, keyword, should_stop)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.pool.close()
+
+# ---------- HTTP ----------
+# tags <a ...> / <img ...> respetando valores entre comillas (el JSON de m puede traer '>')
+_TAG_RE = re.compile(r"""<(a|img)\s((?:[^>"']|"[^"]*"|'[^']*')*)>""", re.IGNORECASE)
+_ATTR_RE = re.compile(r"""([\w:-]+)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+
+def parse_result_page(text):
+    """URLs de imágenes de una página (o bloque async) de resultados: murl de a.iusc y miniaturas img.mimg."""
+    urls = []
+    for m in _TAG_RE.finditer(text):
+        body = m.group(2)
+        # descarte rápido antes de parsear atributos: solo interesan estas dos clases
+        if "iusc" not in body and "mimg" not in body:
+            continue
+        attrs = {k.lower(): html.unescape(v1 or v2) for k, v1, v2 in _ATTR_RE.findall(body)}
+        classes = attrs.get("class", "").split()
+        if m.group(1).lower() == "a":
+            if "iusc" in classes and attrs.get("m"):
+                try:
+                    murl = json.loads(attrs["m"]).get("murl")
+                except ValueError:
+                    continue
+                if murl:
+                    urls.append(murl)
+        elif "mimg" in classes:
+            src = attrs.get("data-src") or attrs.get("src")
+            if src:
+                urls.append(src)
+    return [u for u in urls if u.startswith("http")]
+
+def harvest_keyword_http(session, keyword, on_urls, max_urls=1000, sleep_between_pages=0.0,
+                         search_url=SEARCH_URL, page_url=PAGE_URL, page_size=PAGE_SIZE,
+                         should_stop=None, timeout=15):
+    """Como harvest_keyword() pero pidiendo las páginas por HTTP; para cuando una página no trae nada nuevo."""
+    q = quote_plus(keyword)
+    seen = set()
+    total = 0
+    for page in range(MAX_SCROLLS):
+        if page == 0:
+            url = search_url.format(q=q)
+        else:
+            url = page_url.format(q=q, page=page, first=page * page_size + 1, count=page_size)
+        resp = session.get(url, timeout=timeout)
+        if resp.status_code == 404:
+            break
+        resp.raise_for_status()
+        new = [u for u in dict.fromkeys(parse_result_page(resp.text)) if u not in seen]
+        if not new:
+            break
+        seen.update(new)
+        total += on_urls(keyword, new) or 0
+        if len(seen) >= max_urls or (should_stop and should_stop()):
+            break
+        if sleep_between_pages:
+            time.sleep(sleep_between_pages)
+    return total
+
+class HttpHarvester:
+    """Extrae varios keywords a la vez con requests (una Session keep-alive por hilo)."""
+
+    def __init__(self, workers, on_urls, max_urls=1000, sleep_between_pages=0.0,
+                 search_url=SEARCH_URL, page_url=PAGE_URL, page_size=PAGE_SIZE, timeout=15):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.local = threading.local()
+        self.sessions = []
+        self.on_urls = on_urls
+        self.max_urls = max_urls
+        self.sleep_between_pages = sleep_between_pages
+        self.search_url = search_url
+        self.page_url = page_url
+        self.page_size = page_size
+        self.timeout = timeout
+
+    def _session(self):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update({"User-Agent": USER_AGENT, "Accept-Language": "en-US,en;q=0.9"})
+            self.local.session = session
+            self.sessions.append(session)
+        return session
+
+    def _run(self, keyword, should_stop):
+        return harvest_keyword_http(self._session(), keyword, self.on_urls, self.max_urls,
+                                    self.sleep_between_pages, self.search_url, self.page_url,
+                                    self.page_size, should_stop, self.timeout)
+
+    def submit(self, keyword, should_stop=None):
+        """Future cuyo resultado es el total devuelto por on_urls para este keyword."""
+        return self.executor.submit(self._run, keyword, should_stop)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for session in self.sessions:
+            session.close()
+
+EXTRACTORS = ("selenium", "http")
+
+def make_harvester(extractor, workers, on_urls, max_urls=1000, sleep=1.0,
+                   search_url=SEARCH_URL, page_url=PAGE_URL):
+    """Construye el backend elegido con --extractor."""
+    if extractor == "http":
+        return HttpHarvester(workers, on_urls, max_urls, sleep, search_url, page_url)
+    return Harvester(workers, on_urls, max_urls, sleep, search_url)
+
+# ---------- BENCHMARK ----------
+def _tree_rss_kib(root):
+    """RSS de root más todos sus descendientes (chromedriver, Chrome y sus renderers)."""
+    parents, rss = {}, {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("PPid:"):
+                        parents[int(pid)] = int(line.split()[1])
+                    elif line.startswith("VmRSS:"):
+                        rss[int(pid)] = int(line.split()[1])
+        except OSError:
+            continue
+    tree, changed = {root}, True
+    while changed:
+        children = {pid for pid, ppid in parents.items() if ppid in tree} - tree
+        changed = bool(children)
+        tree |= children
+    return sum(rss.get(pid, 0) for pid in tree)
+
+def run_benchmark(extractor, keywords, workers, max_urls, sleep, search_url, page_url):
+    counts = dict.fromkeys(keywords, 0)
+    first_batch = {}
+    counts_lock = threading.Lock()
+    peak = [0]
+    sampling = threading.Event()
+
+    def sample():
+        while not sampling.is_set():
+            peak[0] = max(peak[0], _tree_rss_kib(os.getpid()))
+            sampling.wait(0.1)
+
+    def on_urls(keyword, urls):
+        with counts_lock:
+            counts[keyword] += len(urls)
+            first_batch.setdefault(keyword, time.perf_counter() - t0)
+        return len(urls)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    t0 = time.perf_counter()
+    # el arranque de los navegadores entra en la medición: es parte del costo del backend
+    harvester = make_harvester(extractor, workers, on_urls, max_urls, sleep, search_url, page_url)
+    try:
+        for f in [harvester.submit(kw) for kw in keywords]:
+            f.result()
+    finally:
+        harvester.close()
+    elapsed = time.perf_counter() - t0
+    sampling.set()
+    sampler.join()
+    for kw in keywords:
+        print(f"[HARVEST] {extractor}: {kw}: {counts[kw]} urls (primeras a los {first_batch.get(kw, 0):.2f}s)")
+    total = sum(counts.values())
+    print(f"[HARVEST] {extractor}: {total} urls en {elapsed:.2f}s con {workers} workers -> "
+          f"{total / elapsed:.1f} urls/s, RSS pico {peak[0] / 1024:.0f} MiB (proceso + hijos)")
+    return total / elapsed, peak[0] / 1024
+
+if __name__ == "__main__":
+    from fixture_server import start_server
+
+    parser = argparse.ArgumentParser(description="extrae URLs de imágenes y mide urls/s y RSS por backend")
+    parser.add_argument("--keywords", default="multimeter,oscilloscope,breadboard,soldering iron,stepper motor,transformer")
+    parser.add_argument("--extractor", choices=EXTRACTORS + ("both",), default="both")
+    parser.add_argument("--workers", type=int, default=3, help="navegadores / hilos HTTP en paralelo")
+    parser.add_argument("--max-urls", type=int, default=2000)
+    parser.add_argument("--sleep", type=float, default=1.0, help="segundos entre scrolls / páginas")
+    parser.add_argument("--fixture", action="store_true",
+                        help="usar las páginas grabadas de fixtures/bing/ en un servidor local")
+    args = parser.parse_args()
+
+    search_url, page_url = SEARCH_URL, PAGE_URL
+    if args.fixture:
+        _, base = start_server(static_dir=os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures"))
+        search_url = base + "/static/bing/search.html?q={q}"
+        page_url = base + "/static/bing/async_{page}.html?q={q}"
+    keywords = [k.strip() for k in args.keywords.split(",") if k.strip()]
+    extractors = EXTRACTORS[::-1] if args.extractor == "both" else (args.extractor,)
+    results = {}
+    for extractor in extractors:
+        if extractor == "selenium" and not SELENIUM_AVAILABLE:
+            print("[HARVEST] selenium no está instalado, se omite ese backend")
+            continue
+        try:
+            results[extractor] = run_benchmark(extractor, keywords, args.workers, args.max_urls, args.sleep,
+                                               search_url, page_url)
+        except Exception as e:
+            print(f"[HARVEST] {extractor}: falló ({e!r})")
+    if len(results) == 2:
+        (s_rate, s_rss), (h_rate, h_rss) = results["selenium"], results["http"]
+        print(f"[HARVEST] http vs selenium: {h_rate / s_rate:.1f}x urls/s, {s_rss / max(h_rss, 1):.1f}x menos RSS")